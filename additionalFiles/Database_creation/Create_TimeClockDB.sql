@@ -15,7 +15,11 @@ CREATE TABLE `User` (
     email VARCHAR(255),
     password TEXT, /* sha2("your password", 512) */
     permission_id INT,
-    FOREIGN KEY (permission_id) REFERENCES Permissions(id)
+    FOREIGN KEY (permission_id) REFERENCES Permissions(id),
+    UNIQUE KEY uq_User_email (email),
+    UNIQUE KEY uq_User_tagNum (tagNum),
+    KEY ix_User_lastName (lastName),
+    KEY ix_User_firstName (firstName)
 );
 
 CREATE TABLE OnlineTime (
@@ -24,23 +28,115 @@ CREATE TABLE OnlineTime (
     dateTimeStop DATETIME,
     breakTime INT,
     user_id INT,
-    FOREIGN KEY (user_id) REFERENCES `User`(id)
+    openSession TINYINT AS (IF(dateTimeStop IS NULL, 1, NULL)) STORED, /* 1 while the session is open, NULL once stopped */
+    FOREIGN KEY (user_id) REFERENCES `User`(id),
+    UNIQUE KEY uq_OnlineTime_openSession (user_id, openSession), /* at most one open session per user */
+    KEY ix_OnlineTime_user_stop (user_id, dateTimeStop, dateTimeStart),
+    KEY ix_OnlineTime_start (dateTimeStart, id)
 );
 
 CREATE TABLE TotalTime (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    sumTime TIME,
-    daysWorked INT,
+    sumSeconds BIGINT NOT NULL DEFAULT 0, /* total of all completed sessions, kept up to date incrementally */
     breakTime TIME,
     user_id INT,
+    FOREIGN KEY (user_id) REFERENCES `User`(id),
+    UNIQUE KEY uq_TotalTime_user (user_id)
+);
+
+CREATE TABLE PunchEvent (
+    eventKey VARCHAR(64) PRIMARY KEY, /* idempotency key sent by the badge reader */
+    user_id INT,
+    eventTime DATETIME,
+    direction VARCHAR(3), /* 'in' or 'out' */
     FOREIGN KEY (user_id) REFERENCES `User`(id)
 );
 
+/* Worked seconds per user and day / ISO week, maintained by the clock-out, edit and delete paths */
+CREATE TABLE UserDailyTime (
+    user_id INT,
+    day DATE,
+    seconds BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    KEY ix_UserDailyTime_day (day),
+    FOREIGN KEY (user_id) REFERENCES `User`(id)
+);
+
+CREATE TABLE UserWeeklyTime (
+    user_id INT,
+    weekStart DATE, /* Monday of the ISO week */
+    seconds BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, weekStart),
+    KEY ix_UserWeeklyTime_weekStart (weekStart),
+    FOREIGN KEY (user_id) REFERENCES `User`(id)
+);
+
+/* What the last bulk recompute saw of each user's completed sessions, lets it skip unchanged users */
+CREATE TABLE TotalTimeFingerprint (
+    user_id INT PRIMARY KEY,
+    sessionCount INT NOT NULL,
+    sessionSeconds BIGINT NOT NULL,
+    startSeconds BIGINT NOT NULL, /* sum of the session starts in seconds since 1970-01-01 */
+    checkedAt DATETIME,
+    FOREIGN KEY (user_id) REFERENCES `User`(id)
+);
+
+/* One row per inserted, updated or deleted User, OnlineTime and TotalTime row, read by GET /sync */
+CREATE TABLE ChangeLog (
+    version BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tableName VARCHAR(32) NOT NULL,
+    rowId INT NOT NULL,
+    operation VARCHAR(6) NOT NULL, /* 'upsert' or 'delete' */
+    changedAt DATETIME NOT NULL,
+    KEY ix_ChangeLog_table (tableName, version)
+);
+
+CREATE TRIGGER trg_User_insert AFTER INSERT ON `User` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('User', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_User_update AFTER UPDATE ON `User` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('User', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_User_delete AFTER DELETE ON `User` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('User', OLD.id, 'delete', NOW());
+CREATE TRIGGER trg_OnlineTime_insert AFTER INSERT ON `OnlineTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('OnlineTime', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_OnlineTime_update AFTER UPDATE ON `OnlineTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('OnlineTime', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_OnlineTime_delete AFTER DELETE ON `OnlineTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('OnlineTime', OLD.id, 'delete', NOW());
+CREATE TRIGGER trg_TotalTime_insert AFTER INSERT ON `TotalTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('TotalTime', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_TotalTime_update AFTER UPDATE ON `TotalTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('TotalTime', NEW.id, 'upsert', NOW());
+CREATE TRIGGER trg_TotalTime_delete AFTER DELETE ON `TotalTime` FOR EACH ROW
+    INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) VALUES ('TotalTime', OLD.id, 'delete', NOW());
+
+/* Migrations already contained in this script, see app/migrations.py */
+CREATE TABLE SchemaVersion (
+    version INT PRIMARY KEY,
+    description VARCHAR(255),
+    appliedAt DATETIME
+);
+
+INSERT INTO SchemaVersion (version, description, appliedAt)
+VALUES
+    (1, 'Store TotalTime as integer seconds', NOW()),
+    (2, 'At most one open session per user', NOW()),
+    (3, 'PunchEvent table for badge reader idempotency keys', NOW()),
+    (4, 'Unique and composite indexes for the service queries', NOW()),
+    (5, 'Daily and weekly rollups of worked time', NOW()),
+    (6, 'Session fingerprints of the bulk recompute job', NOW()),
+    (7, 'Trigger-fed change log for delta sync', NOW()),
+    (8, 'Latest change per table for the ETags', NOW()),
+    (9, 'First name index for the user name lookup', NOW());
+
 -- Test the schema with select queries
 SELECT * FROM `User`;
 SELECT * FROM Permissions;
 SELECT * FROM TotalTime;
 SELECT * FROM OnlineTime;
+SELECT * FROM PunchEvent;
+SELECT * FROM UserDailyTime;
+SELECT * FROM UserWeeklyTime;
 
 -- Display tables in the database
 SHOW TABLES;
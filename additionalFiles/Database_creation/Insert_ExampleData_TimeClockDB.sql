@@ -23,12 +23,28 @@ VALUES
     ('2024-11-02 09:00:00', '2024-11-02 18:00:00', 45, 2),
     ('2024-11-03 10:00:00', '2024-11-03 16:00:00', 30, 3);
 
--- Insert data into TotalTime table
-INSERT INTO TotalTime (sumTime, daysWorked, breakTime, user_id)
-VALUES
-    ('40:00:00', 5, '5:00:00', 1),
-    ('35:00:00', 4, '4:15:00', 2),
-    ('25:00:00', 3, '2:30:00', 3);
+-- Insert data into TotalTime table, derived from the sessions above like the application keeps it
+-- (OnlineTime.breakTime is in minutes)
+INSERT INTO TotalTime (sumSeconds, breakTime, user_id)
+SELECT SUM(TIMESTAMPDIFF(SECOND, dateTimeStart, dateTimeStop)), SEC_TO_TIME(SUM(breakTime) * 60), user_id
+FROM OnlineTime
+WHERE dateTimeStop IS NOT NULL
+GROUP BY user_id;
+
+-- Insert the rollups of the sessions above (none of them crosses midnight)
+INSERT INTO UserDailyTime (user_id, day, seconds)
+SELECT user_id, DATE(dateTimeStart), SUM(TIMESTAMPDIFF(SECOND, dateTimeStart, dateTimeStop))
+FROM OnlineTime
+WHERE dateTimeStop IS NOT NULL
+GROUP BY user_id, DATE(dateTimeStart);
+
+INSERT INTO UserWeeklyTime (user_id, weekStart, seconds)
+SELECT user_id, weekStart, SUM(seconds)
+FROM (SELECT user_id, DATE(dateTimeStart) - INTERVAL WEEKDAY(dateTimeStart) DAY AS weekStart,
+             TIMESTAMPDIFF(SECOND, dateTimeStart, dateTimeStop) AS seconds
+      FROM OnlineTime
+      WHERE dateTimeStop IS NOT NULL) AS sessions
+GROUP BY user_id, weekStart;
 
 -- Verify inserted data
 SELECT * FROM Permissions;
@@ -8,20 +8,41 @@ from flask import Flask
 from flask_cors import CORS
 from flasgger import Swagger
 from flask_login import LoginManager
-from flask_wtf.csrf import CSRFProtect, CSRFError
+from flask_wtf.csrf import CSRFError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .config import Config
-from .mysqlConnector import get_db_connection
+from .repositories import init_repository, get_repository
+from .jsonProvider import TimeClockJSONProvider
 
 # Initialize the Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# ISO-8601 dates and TIME values in every JSON response, serialized by orjson when available
+app.json = TimeClockJSONProvider(app, use_orjson=app.config['JSON_USE_ORJSON'])
+
+# Behind reverse proxies, take the client address from the X-Forwarded-For entries they added
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
 # Ensure SECRET_KEY is set
 if not app.config.get('SECRET_KEY'):
     app.config['SECRET_KEY'] = 'your_secret_key'  # Replace with a strong key
 
+# Tune the bcrypt cost to PASSWORD_HASH_TARGET_MS on this machine unless it is fixed
+from .passwordHashing import password_hasher
+if not app.config['PASSWORD_BCRYPT_ROUNDS']:
+    password_hasher.calibrate(app.config['PASSWORD_HASH_TARGET_MS'], app.config['PASSWORD_BCRYPT_MIN_ROUNDS'])
+
+# Initialize the storage backend (MySQL connection pool or SQLite file)
+init_repository(app)
+
+# Bearer tokens authenticate their request before the CSRF check, which they are exempt from
+from .apiTokens import authenticate_bearer, TokenAwareCSRFProtect
+app.before_request(authenticate_bearer)
+
 # Initialize CSRF protection
-csrf = CSRFProtect()
+csrf = TokenAwareCSRFProtect()
 csrf.init_app(app)
 
 # Initialize Flask-Login
@@ -54,24 +75,58 @@ swagger = Swagger(app,
 
 # User loader for Flask-Login
 from .authentication import User
+from .cache import user_cache
 
 @login_manager.user_loader
 def load_user(user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT * FROM User WHERE id = %s', (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    if user:
-        return User(
-            id=user['id'],
-            firstName=user['firstName'],
-            lastName=user['lastName'],
-            email=user['email'],
-            role=user['permission_id']
-        )
-    return None
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    # Only the columns the User object needs, never the password hash
+    user = user_cache.get(user_id)
+    if user is None:
+        # Read before the query, an update or delete committing meanwhile must not be overwritten by this row
+        generation = user_cache.generation(user_id)
+        repo = get_repository()
+        if repo is None:
+            return None
+        user = repo.users.get_login(user_id)
+        if user is None:
+            return None
+        user_cache.set(user_id, user, generation)
+
+    return User(
+        id=user['id'],
+        firstName=user['firstName'],
+        lastName=user['lastName'],
+        email=user['email'],
+        role=user['permission_id']
+    )
+
+# Schema migrations (`flask migrate-db`)
+from .migrations import init_migrations
+init_migrations(app)
+
+# Bulk recompute job (`flask recompute-totals`)
+from .jobs import init_jobs
+init_jobs(app)
+
+# Change log retention (`flask prune-changelog`)
+from .sync import init_sync
+init_sync(app)
+
+# Load the role lookup once so role checks never query the database
+from .authentication import reload_roles
+with app.app_context():
+    reload_roles(publish=False)
+
+# Warm the tagNum index so kiosk lookups never wait on the database
+from .tagIndex import tag_index
+if app.config.get('TAG_INDEX_WARM_ON_STARTUP'):
+    with app.app_context():
+        tag_index.warm()
 
 # Register routes
 from .routes import init_routes
@@ -0,0 +1,338 @@
+"""
+Signed bearer tokens for kiosks and integrations
+
+A token is the user's id, role and name signed with SECRET_KEY and a timestamp
+(itsdangerous), sent as 'Authorization: Bearer <token>'. Checking it needs no
+database access and no session, so any worker sharing the SECRET_KEY accepts
+it. Tokens expire after API_TOKEN_TTL seconds. Revoked tokens are kept until
+they would have expired anyway: single tokens by their id, and all tokens of
+a user issued before a point in time (e.g. when the user is deleted). With
+CACHE_BACKEND = 'memory' the revocations live in the process that made them,
+so revocation only holds with a single worker process; with 'shared' they live
+in a SharedMemoryFile every worker of the host reads (see cache.py). Workers
+on other hosts never see them, such deployments need a short API_TOKEN_TTL.
+
+A request carrying a bearer token is authenticated by the token alone, even
+if it also has a session cookie, and skips the CSRF check: the token is not
+sent by the browser on its own, so it cannot be forged across sites.
+
+Classes:
+ - TokenRevocations: The in-memory revocation list of one process.
+ - SharedTokenRevocations: The revocation list shared by the processes of one host.
+ - TokenAwareCSRFProtect: CSRF protection that leaves bearer token requests alone.
+
+Functions:
+ - create_revocations(config): Returns the revocation list selected by CACHE_BACKEND.
+ - issue_token(user): Returns a signed token for a login User.
+ - user_from_token(token): Returns the User a valid, unrevoked token stands for, or None.
+ - bearer_token(request): Returns the token of an 'Authorization: Bearer' header, or None.
+ - authenticate_bearer(): before_request hook logging in the user of a bearer token, 401 for a bad one.
+ - issue_api_token(): Exchanges email and password for a token (POST /auth/token).
+ - revoke_api_token(): Revokes the caller's token or, for admins, every token of a user.
+
+Objects:
+ - token_revocations: The revocation list shared by the application.
+"""
+import hashlib
+import secrets
+import struct
+import threading
+import time
+from flask import current_app, jsonify, request, g
+from flask_login import current_user
+from flask_wtf.csrf import CSRFProtect
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from .config import Config
+from .cache import SharedMemoryFile, shared_path
+from .repositories import get_repository
+from .passwordHashing import HashingBusyError
+from .authentication import User, get_role, check_credentials, hashing_busy_response
+
+TOKEN_SALT = 'api-token'
+
+
+class TokenRevocations:
+    """
+    Revoked token ids and per-user revocation times, each dropped once no token it covers can still be valid.
+    """
+    backend = 'memory'
+
+    def __init__(self):
+        self._tokens = {}  # token id -> expiry of the token
+        self._users = {}   # user id -> (revoked before, expiry of the last token it covers)
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        for token_id in [token_id for token_id, expires_at in self._tokens.items() if expires_at <= now]:
+            del self._tokens[token_id]
+        for user_id in [user_id for user_id, (_, expires_at) in self._users.items() if expires_at <= now]:
+            del self._users[user_id]
+
+    def revoke(self, token_id, expires_at):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._tokens[token_id] = expires_at
+        return True
+
+    def revoke_user(self, user_id, ttl):
+        """
+        Revokes every token of the user issued up to now.
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._users[user_id] = (now, now + ttl)
+        return True
+
+    def is_revoked(self, token_id, user_id, issued_at):
+        with self._lock:
+            if token_id in self._tokens:
+                return True
+            user = self._users.get(user_id)
+            return user is not None and issued_at <= user[0]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.backend, 'tokens': len(self._tokens), 'users': len(self._users)}
+
+
+class SharedTokenRevocations:
+    """
+    The revocation list in a SharedMemoryFile used by the worker processes of a host.
+
+    The file holds `slots` slots of (key hash, revoked before, expiry), keyed by
+    'token:<id>' or 'user:<id>'. A key lives in the first free or expired slot of
+    the PROBE_LENGTH slots after its hash. A revocation is only dropped once it
+    has expired: when all of a key's slots hold live revocations the new one is
+    refused instead.
+    """
+    backend = 'shared'
+    MAGIC = b'TCREVOK1'
+    SLOT = struct.Struct('<Qdd')
+    PROBE_LENGTH = 16
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._file = SharedMemoryFile(path, self.MAGIC, slots, slots * self.SLOT.size)
+        self._map = self._file.data
+        self._locked = self._file.locked
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks a slot that was never used
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _probe(self, key_hash):
+        start = key_hash % self.slots
+        for probe in range(self.PROBE_LENGTH):
+            offset = ((start + probe) % self.slots) * self.SLOT.size
+            yield offset, self.SLOT.unpack_from(self._map, offset)
+
+    def _find(self, key_hash, now):
+        """
+        Returns the revoked before time of a live key, None if it is not revoked.
+        """
+        for _, (slot_hash, revoked_before, expires_at) in self._probe(key_hash):
+            if slot_hash == 0:
+                # Keys are stored in the first free slot, none lives past one that was never used
+                return None
+            if slot_hash == key_hash and expires_at > now:
+                return revoked_before
+        return None
+
+    def _store(self, key, revoked_before, expires_at):
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked():
+            free = None
+            for offset, (slot_hash, _, slot_expires_at) in self._probe(key_hash):
+                if slot_hash == key_hash:
+                    free = offset
+                    break
+                if free is None and slot_expires_at <= now:
+                    free = offset
+                if slot_hash == 0:
+                    break
+            if free is None:
+                print(f"Error: no free slot for {key} in the token revocation table {self.path}")
+                return False
+            self.SLOT.pack_into(self._map, free, key_hash, revoked_before, expires_at)
+            return True
+
+    def revoke(self, token_id, expires_at):
+        return self._store(f"token:{token_id}", 0.0, expires_at)
+
+    def revoke_user(self, user_id, ttl):
+        """
+        Revokes every token of the user issued up to now.
+        """
+        now = time.time()
+        return self._store(f"user:{user_id}", now, now + ttl)
+
+    def is_revoked(self, token_id, user_id, issued_at):
+        now = time.time()
+        token_hash, user_hash = self._hash(f"token:{token_id}"), self._hash(f"user:{user_id}")
+        with self._locked():
+            if self._find(token_hash, now) is not None:
+                return True
+            revoked_before = self._find(user_hash, now)
+            return revoked_before is not None and issued_at <= revoked_before
+
+    def clear(self):
+        with self._locked():
+            self._map[:] = bytes(self.slots * self.SLOT.size)
+
+    def stats(self):
+        now = time.time()
+        with self._locked():
+            live = [revoked_before for slot_hash, revoked_before, expires_at in self.SLOT.iter_unpack(self._map)
+                    if slot_hash and expires_at > now]
+        return {'backend': self.backend, 'tokens': sum(1 for revoked_before in live if not revoked_before),
+                'users': sum(1 for revoked_before in live if revoked_before), 'slots': self.slots, 'path': self.path}
+
+
+def create_revocations(config):
+    """
+    Returns the revocation list of CACHE_BACKEND, shared by the workers of the host when it is 'shared'.
+    """
+    if config.CACHE_BACKEND == 'shared':
+        return SharedTokenRevocations(shared_path('revocations'), config.API_TOKEN_REVOCATION_SLOTS)
+    return TokenRevocations()
+
+
+token_revocations = create_revocations(Config)
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def issue_token(user):
+    """
+    Returns a signed token for a login User (id, firstName, lastName, email, role).
+    """
+    return _serializer().dumps({'id': user.id,
+                                'role': user.role,
+                                'firstName': user.firstName,
+                                'lastName': user.lastName,
+                                'email': user.email,
+                                'jti': secrets.token_urlsafe(9)})
+
+
+def _load_claims(token):
+    """
+    Returns (claims, issued at) of a token with a valid signature and age, or (None, None).
+    """
+    try:
+        claims, issued_at = _serializer().loads(token, max_age=current_app.config['API_TOKEN_TTL'], return_timestamp=True)
+    except (BadSignature, SignatureExpired):
+        return None, None
+    if not isinstance(claims, dict) or not isinstance(claims.get('id'), int):
+        return None, None
+    return claims, issued_at.timestamp()
+
+
+def user_from_token(token):
+    """
+    Returns the User a valid, unrevoked token stands for, or None. Never touches the database.
+    """
+    claims, issued_at = _load_claims(token)
+    if claims is None or token_revocations.is_revoked(claims.get('jti'), claims['id'], issued_at):
+        return None
+    user = User(id=claims['id'], firstName=claims.get('firstName'), lastName=claims.get('lastName'),
+                email=claims.get('email'), role=claims.get('role'))
+    user.token_claims = dict(claims, issuedAt=issued_at)
+    return user
+
+
+def bearer_token(req):
+    """
+    Returns the token of an 'Authorization: Bearer <token>' header, or None.
+    """
+    scheme, _, token = req.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def authenticate_bearer():
+    """
+    Makes the bearer token, when there is one, the only credential of the request.
+    An invalid, expired or revoked token is answered with 401 instead of falling back to the session cookie.
+    """
+    token = bearer_token(request)
+    if token is None:
+        return None
+    user = user_from_token(token)
+    if user is None:
+        response = jsonify({"message": "Invalid or expired token"})
+        response.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+        return response, 401
+    # Flask-Login takes g._login_user as the current user and skips its session lookup
+    g._login_user = user
+    g.bearer_authenticated = True
+    return None
+
+
+class TokenAwareCSRFProtect(CSRFProtect):
+    def protect(self, *args, **kwargs):
+        if g.get('bearer_authenticated'):
+            return
+        super().protect(*args, **kwargs)
+
+
+def issue_api_token():
+    """
+    Exchanges the JSON body {"email", "password"} for a bearer token.
+    :return: JSON {"token", "tokenType", "expiresIn"} and status code.
+    """
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    email, password = data.get('email'), data.get('password')
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({"error": "Required field is missing (email, password)"}), 400
+
+    repo = get_repository()
+    if repo is None:
+        return jsonify({"message": "Database connection failed"}), 500
+    try:
+        user = check_credentials(repo, email, password)
+    except HashingBusyError:
+        return hashing_busy_response()
+    if user is None:
+        return jsonify({"message": "Invalid credentials"}), 401
+    return jsonify({"token": issue_token(user), "tokenType": "Bearer",
+                    "expiresIn": current_app.config['API_TOKEN_TTL']}), 200
+
+
+def revoke_api_token():
+    """
+    Revokes the bearer token of the request, or with {"user_id": N} (admins only) every token of that user.
+    :return: JSON response and status code.
+    """
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    ttl = current_app.config['API_TOKEN_TTL']
+    if 'user_id' in data:
+        role = get_role(current_user.role)
+        if role is None or 'admin' not in role.granted:
+            return jsonify({"message": "Access forbidden - Admin role required"}), 403
+        if not isinstance(data['user_id'], int):
+            return jsonify({"error": "Invalid user_id, expected an integer"}), 400
+        if not token_revocations.revoke_user(data['user_id'], ttl):
+            return jsonify({"message": "The revocation list is full, try again later"}), 503
+        return jsonify({"message": f"Tokens of user {data['user_id']} revoked"}), 200
+
+    claims = getattr(current_user, 'token_claims', None)
+    if claims is None:
+        return jsonify({"message": "The request was not made with a bearer token"}), 400
+    if not token_revocations.revoke(claims['jti'], claims['issuedAt'] + ttl):
+        return jsonify({"message": "The revocation list is full, try again later"}), 503
+    return jsonify({"message": "Token revoked"}), 200
@@ -1,9 +1,12 @@
-from flask import Flask, render_template, redirect, url_for, request, abort, jsonify
+from flask import Flask, render_template, redirect, url_for, request, abort, jsonify, current_app
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import mysql.connector
-from bcrypt import hashpw, gensalt, checkpw
 from functools import wraps
-from .mysqlConnector import get_db_connection
+from collections import namedtuple
+from types import MappingProxyType
+from .repositories import get_repository, DuplicateKeyError
+from .tagIndex import tag_index
+from .passwordHashing import password_hasher, HashingBusyError
+from .etags import resource_versions, USERS, PERMISSIONS, TOTALTIME
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, Length
@@ -16,6 +19,66 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Roles from most to least privileged, every role includes the permissions of the roles after it
+ROLE_HIERARCHY = ('dev', 'admin', 'supervisor', 'user', 'guest')
+ROLE_BITS = MappingProxyType({name: 1 << bit for bit, name in enumerate(reversed(ROLE_HIERARCHY))})
+
+# A permission id resolved to its role name, permission bitmask and the role names it satisfies
+RoleInfo = namedtuple('RoleInfo', ['name', 'mask', 'granted'])
+
+def _build_roles(levels):
+    """
+    Builds the immutable permission_id -> RoleInfo lookup from (id, permissionLevel) pairs.
+    """
+    roles = {}
+    for permission_id, level in levels:
+        name = str(level).lower()
+        if name not in ROLE_BITS:
+            continue
+        mask = (ROLE_BITS[name] << 1) - 1  # the role's own bit and every less privileged one
+        roles[permission_id] = RoleInfo(name, mask, frozenset(r for r, bit in ROLE_BITS.items() if mask & bit))
+    return MappingProxyType(roles)
+
+# Matches the seeded Permissions table, used until the real table could be read
+_roles = _build_roles([(1, 'Dev'), (2, 'Admin'), (3, 'Supervisor'), (4, 'User'), (5, 'Guest')])
+_roles_loaded = False
+_roles_version = None  # PERMISSIONS version the lookup was loaded at
+
+def reload_roles(publish=True):
+    """
+    Reloads the Permissions table into the role lookup used by role_required.
+    With publish, bumps the PERMISSIONS version so the other workers reload theirs too.
+
+    Returns:
+        bool: True if the table was read, False if the previous lookup was kept.
+    """
+    global _roles, _roles_loaded, _roles_version
+    version = resource_versions.version(PERMISSIONS)
+    repo = get_repository()
+    if repo is None:
+        return False
+    try:
+        rows = repo.permissions.levels()
+    except Exception as e:
+        print(f"Error loading permissions: {e}")
+        return False
+    _roles = _build_roles(rows)
+    _roles_loaded = True
+    if publish:
+        resource_versions.bump(PERMISSIONS)
+        version = resource_versions.version(PERMISSIONS)
+    _roles_version = version
+    return True
+
+def get_role(permission_id):
+    """
+    Returns the RoleInfo of a permission id, or None if it has no known role.
+    """
+    # Another worker reloaded the table (shared CACHE_BACKEND only, otherwise the version is our own)
+    if not _roles_loaded or resource_versions.version(PERMISSIONS) != _roles_version:
+        reload_roles(publish=False)
+    return _roles.get(permission_id)
+
 # User class (required by Flask-Login)
 class User(UserMixin):
     def __init__(self, id, firstName, lastName, email, role):
@@ -23,7 +86,12 @@ class User(UserMixin):
         self.firstName = firstName
         self.lastName = lastName
         self.email = email
-        self.role = role
+        self.role = role  # permission_id of the user
+
+    @property
+    def role_name(self):
+        role = get_role(self.role)
+        return role.name if role else None
 
 
 class RegisterForm(FlaskForm):
@@ -36,21 +104,19 @@ class RegisterForm(FlaskForm):
 
 # Role-based access decorator
 def role_required(role):
+    """
+    Allows the route for users whose role is `role` or ranks above it in ROLE_HIERARCHY.
+    """
+    if role not in ROLE_BITS:
+        raise ValueError(f"Unknown role: {role}")
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if(current_user.role == 1):
-                current_user.role = "dev"
-            elif(current_user.role == 2):
-                current_user.role = "admin"
-            elif(current_user.role == 3):
-                current_user.role = "supervisor"
-            elif(current_user.role == 4):
-                current_user.role = "user"
-            elif(current_user.role == 4):
-                current_user.role = "guest"
-            print(current_user.role)
-            if not current_user.is_authenticated or current_user.role != role:
+            if not current_user.is_authenticated:
+                abort(403)  # Forbidden
+            user_role = get_role(current_user.role)
+            if user_role is None or role not in user_role.granted:
                 abort(403)  # Forbidden
             return func(*args, **kwargs)
         return wrapper
@@ -61,21 +127,48 @@ class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
 
+def hashing_busy_response():
+    """
+    The 503 sent while the password hashing pool is saturated.
+    """
+    return (jsonify({"message": "Too many logins at once, try again shortly"}), 503,
+            {'Retry-After': str(current_app.config['PASSWORD_HASH_RETRY_AFTER'])})
+
+def check_credentials(repo, email, password):
+    """
+    Returns the User with this email if password matches, else None. Raises HashingBusyError if the hashing pool is full.
+    """
+    user = repo.users.get_credentials(email)
+    if user is None:
+        return None
+    valid, new_hash = password_hasher.verify(password, user['password'])
+    if not valid:
+        return None
+    if new_hash:
+        # Upgrade a legacy SHA-512 hash or an outdated bcrypt cost while the password is at hand
+        try:
+            with repo.transaction():
+                repo.users.replace_password(user['id'], user['password'], new_hash)
+        except Exception as e:
+            print(f"Error rehashing password of user {user['id']}: {e}")
+    return User(id=user['id'], firstName=user['firstName'], lastName=user['lastName'], email=user['email'], role=user['permission_id'])
+
 def auth_login():
     form = LoginForm()
     if form.validate_on_submit():  # Automatically checks CSRF token
         email = form.email.data
         password = form.password.data
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT * FROM User WHERE email = %s', (email,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        repo = get_repository()
+        if repo is None:
+            return jsonify({"message": "Database connection failed"}), 500
 
-        if user and checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
-            login_user(User(id=user['id'], firstName=user['firstName'], lastName=user['lastName'], email=user['email'], role=user['permission_id']), remember=True)
+        try:
+            user = check_credentials(repo, email, password)
+        except HashingBusyError:
+            return hashing_busy_response()
+        if user:
+            login_user(user, remember=True)
             return redirect(url_for('dashboard'))
         return 'Invalid credentials!'
     return render_template('login.html', form=form)
@@ -91,48 +184,34 @@ def auth_register():
         password = form.password.data
         tagNum = form.tagNum.data
 
-        # Hash the password
-        hashed_password = hashpw(password.encode('utf-8'), gensalt()).decode('utf-8')
+        # Hash the password on the bounded hashing pool
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashingBusyError:
+            return hashing_busy_response()
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        repo = get_repository()
+        if repo is None:
+            return jsonify({"message": "Database connection failed"}), 500
 
         try:
-            cursor.execute("START TRANSACTION;")
-
-            # Insert into User table
-            cursor.execute(
-                "INSERT INTO User (firstName, lastName, tagNum, email, password, permission_id) "
-                "VALUES (%s, %s, %s, %s, %s, (SELECT id FROM Permissions WHERE title = 'Standard User'));",
-                (firstName, lastName, tagNum, email, hashed_password)
-            )
-            conn.commit()
-
-            cursor.execute(
-                "SELECT id FROM User WHERE email = %s;",
-                (email,)
-            )
-            user_id = cursor.fetchone()
-
-            if user_id:
-                cursor.execute(
-                    "INSERT INTO TotalTime (sumTime, daysWorked, breakTime, user_id) "
-                    "VALUES ('00:00:00', 0, '00:00:00', %s);",
-                    (user_id[0],)
-                )
-                conn.commit()
-
-                return redirect(url_for('login'))
-            else:
-                conn.rollback()
-                return jsonify({"error": "User creation failed after insert."}), 500
-
+            with repo.transaction():
+                # Insert into User table, the unique keys on email and tagNum reject duplicates
+                user_id = repo.users.create(firstName, lastName, tagNum, email, hashed_password)
+                # Create TotalTime for User in the same transaction
+                repo.totals.create(user_id)
+            tag_index.invalidate_tag(tagNum)
+            resource_versions.bump(USERS, TOTALTIME)
+
+            return redirect(url_for('login'))
+
+        except DuplicateKeyError as e:
+            message = duplicate_user_message(e)
+            if message:
+                return jsonify({"error": message}), 400
+            return jsonify({"error": f"Error: {str(e)}"}), 500
         except Exception as e:
-            conn.rollback()
             return jsonify({"error": f"Error: {str(e)}"}), 500
-        finally:
-            cursor.close()
-            conn.close()
 
     return render_template('register.html', form=form)
 
@@ -0,0 +1,108 @@
+"""
+Multiplexed read requests
+
+POST /batch runs a list of GET sub-requests through the application's own
+routes and returns their responses together, so a dashboard load costs one
+round trip. The caller is authenticated once: the sub-requests are dispatched
+inside the batch request's application context and so share its logged in
+user and its database connection. With "parallel": true they run on a thread
+pool instead; each worker then has its own application context and checks out
+its own pooled connection, as a connection is never shared between threads.
+
+Functions:
+ - run_batch(): Runs the sub-requests of a POST /batch body and returns the combined response.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import jsonify, request, current_app, g
+from flask_login import current_user
+
+# Headers a sub-request may set, authentication always comes from the batch request
+FORWARDED_HEADERS = ('If-None-Match', 'Accept')
+
+
+def _parse_item(item):
+    """
+    Returns (path, headers, error) for one entry of the 'requests' list.
+    """
+    if isinstance(item, str):
+        item = {'path': item}
+    if not isinstance(item, dict):
+        return None, None, "Request must be a path or an object"
+    path = item.get('path')
+    if not isinstance(path, str) or not path.startswith('/') or path.startswith('//'):
+        return None, None, "Invalid path, expected an absolute path such as /users/all"
+    if str(item.get('method', 'GET')).upper() != 'GET':
+        return None, None, "Only GET requests can be batched"
+    if path.split('?', 1)[0].rstrip('/') == '/batch':
+        return None, None, "Batches cannot be nested"
+    headers = item.get('headers') or {}
+    if not isinstance(headers, dict):
+        return None, None, "Invalid headers, expected an object"
+    return path, {name: str(value) for name, value in headers.items() if name in FORWARDED_HEADERS}, None
+
+
+def _dispatch(app, path, headers, base_url, remote_addr):
+    """
+    Runs one GET sub-request through the app's routes and returns its result entry.
+    """
+    with app.test_request_context(path, method='GET', headers=headers, base_url=base_url,
+                                  environ_base={'REMOTE_ADDR': remote_addr}):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            print(f"Error in batched request {path}: {e}")
+            return {'path': path, 'status': 500, 'body': {"message": "An internal error occurred"}}
+        if response.is_streamed and response.content_length is None:
+            # Listings with ?stream= and the event stream, reading them here would defeat their purpose
+            response.close()
+            return {'path': path, 'status': 400, 'body': {"message": "Streaming responses cannot be batched"}}
+        result = {'path': path, 'status': response.status_code,
+                  'body': response.get_json(silent=True) if response.is_json else response.get_data(as_text=True) or None}
+        if response.headers.get('ETag'):
+            result['etag'] = response.headers['ETag']
+        return result
+
+
+def _dispatch_in_context(app, user, path, headers, base_url, remote_addr):
+    # A worker thread has no application context, give it one with the batch request's user
+    with app.app_context():
+        g._login_user = user
+        return _dispatch(app, path, headers, base_url, remote_addr)
+
+
+def run_batch():
+    """
+    Runs the GET sub-requests of a JSON body {"requests": [path or {"path", "headers"}, ...], "parallel": false}.
+    :return: JSON {"responses": [{"path", "status", "body", "etag"}, ...]} in request order and status code.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Required field is missing (requests)"}), 400
+    if len(items) > current_app.config['BATCH_MAX_REQUESTS']:
+        return jsonify({"error": f"Too many requests, at most {current_app.config['BATCH_MAX_REQUESTS']} per batch"}), 413
+    parallel = data.get('parallel', False) is True
+
+    app = current_app._get_current_object()
+    base_url, remote_addr = request.host_url, request.remote_addr
+    responses = [None] * len(items)
+    pending = []  # (index, path, headers) of the valid sub-requests
+    for index, item in enumerate(items):
+        path, headers, error = _parse_item(item)
+        if error:
+            responses[index] = {'path': item.get('path') if isinstance(item, dict) else item, 'status': 400, 'body': {"message": error}}
+        else:
+            pending.append((index, path, headers))
+
+    if parallel and len(pending) > 1:
+        user = current_user._get_current_object()
+        with ThreadPoolExecutor(max_workers=min(len(pending), current_app.config['BATCH_MAX_WORKERS'])) as executor:
+            futures = [(index, executor.submit(_dispatch_in_context, app, user, path, headers, base_url, remote_addr))
+                       for index, path, headers in pending]
+            for index, future in futures:
+                responses[index] = future.result()
+    else:
+        for index, path, headers in pending:
+            responses[index] = _dispatch(app, path, headers, base_url, remote_addr)
+
+    return jsonify({"responses": responses}), 200
@@ -0,0 +1,399 @@
+"""
+In-process and shared caching
+
+A TTLCache lives in one process, so with several WSGI workers every worker
+keeps its own copy and only sees the invalidations it made itself. With
+CACHE_BACKEND = 'shared' the caches and generation counters live in mmap'd
+files (by default under /dev/shm) instead, shared by every worker process of
+the host: a delete from any worker is seen by the next read in all of them.
+
+Classes:
+ - TTLCache: A thread-safe LRU cache whose entries also expire after a fixed time.
+ - SharedMemoryFile: An mmap'd file with a layout check and a lock across threads and processes.
+ - SharedCache: The TTLCache interface over a table of fixed-size slots in shared memory.
+ - SharedCounters: Named generation counters in shared memory.
+
+Functions:
+ - shared_path(name): Returns the file of a shared structure under CACHE_SHARED_PATH.
+ - create_cache(name, maxsize, ttl): Returns the cache selected by CACHE_BACKEND.
+
+Objects:
+ - user_cache: Caches the User rows used by the Flask-Login user loader.
+ - shared_counters: The generation counters of the host, None unless CACHE_BACKEND is 'shared'.
+"""
+import hashlib
+import json
+import mmap
+import os
+import secrets
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .config import Config
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache with a per-entry time to live.
+
+    Holds at most `maxsize` entries; inserting into a full cache evicts the
+    least recently used one. Entries older than `ttl` seconds are treated as
+    missing and dropped when they are next looked up. Every delete bumps a
+    generation counter, so a fill that read the database before a concurrent
+    invalidation can pass the generation it started at and is then skipped.
+    """
+    backend = 'memory'
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'staleFills': 0}
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return item[1]
+                del self._data[key]
+            self._stats['misses'] += 1
+            return None
+
+    def generation(self, key):
+        """
+        Returns the generation to pass to set() by a caller about to read key's value from the database.
+        """
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, generation=None):
+        """
+        Stores value under key, evicting the least recently used entry if the cache is full.
+        Skipped if key may have been invalidated since `generation` was read.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._stats['staleFills'] += 1
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        """
+        Removes key from the cache if present.
+        """
+        with self._lock:
+            self._stats['invalidations'] += 1
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        """
+        Returns the number of entries and the hit/miss counters.
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl, backend=self.backend)
+
+
+class SharedMemoryFile:
+    """
+    A file of `size` bytes mapped into memory, shared by every process that opens the same path.
+
+    The file starts with a header of `magic` and a layout number; a file with
+    another size or header (new, or written by a differently configured
+    version) is zeroed and given this one. `locked()` excludes other threads
+    and processes; Unix only, as it relies on flock.
+    """
+    HEADER = struct.Struct('<8sQ')
+
+    def __init__(self, path, magic, layout, size):
+        import fcntl
+        self._fcntl = fcntl
+        self.path = path
+        self.size = self.HEADER.size + size
+        self._lock = threading.Lock()  # flock does not exclude the threads of one process
+        self._open_lock_fd()
+        with self.locked():
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+            self.map = mmap.mmap(self._fd, self.size)
+            if self.HEADER.unpack_from(self.map, 0) != (magic, layout):
+                self.map[:] = bytes(self.size)
+                self.HEADER.pack_into(self.map, 0, magic, layout)
+        self.data = memoryview(self.map)[self.HEADER.size:]
+
+    def _open_lock_fd(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def locked(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked after opening: a shared file description would make flock a no-op between the workers
+                self._open_lock_fd()
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+
+class SharedCache:
+    """
+    The TTLCache interface over `maxsize` fixed-size slots in a SharedMemoryFile.
+
+    A slot holds (key hash, generation, expiry, length) followed by the JSON of
+    [key, value], so only JSON values of at most `slot_bytes` fit; larger ones
+    are not cached. A key lives in one of PROBE_LENGTH slots after its hash. An
+    insert takes an empty or expired slot there, or else the one expiring
+    first, which with a common ttl is the least recently stored. clear() bumps
+    the cache's generation, and slots of older generations count as empty.
+    A delete also bumps the invalidation counter of the key's bucket (one per
+    slot, by key hash), so generation(key) changes for the keys of that bucket
+    only and a fill that raced with the delete is skipped.
+    """
+    backend = 'shared'
+    MAGIC = b'TCCACHE2'
+    STATE = struct.Struct('<Q')  # generation
+    BUCKET = struct.Struct('<Q')  # invalidations of the keys hashing to the bucket
+    SLOT = struct.Struct('<QQdI')  # key hash, generation, expires at (epoch seconds), payload length
+    PROBE_LENGTH = 8
+
+    def __init__(self, path, maxsize, ttl, slot_bytes):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.slot_size = self.SLOT.size + slot_bytes
+        self._slots_offset = self.STATE.size + maxsize * self.BUCKET.size
+        self._file = SharedMemoryFile(path, self.MAGIC, maxsize * 65536 + slot_bytes,
+                                      self._slots_offset + maxsize * self.slot_size)
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'tooLarge': 0, 'staleFills': 0}
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _offset(self, slot):
+        return self._slots_offset + slot * self.slot_size
+
+    def _bucket_offset(self, key_hash):
+        return self.STATE.size + (key_hash % self.maxsize) * self.BUCKET.size
+
+    def _generation(self):
+        return self.STATE.unpack_from(self._file.data, 0)[0]
+
+    def _key_generation(self, key_hash):
+        return self._generation(), self.BUCKET.unpack_from(self._file.data, self._bucket_offset(key_hash))[0]
+
+    def _probe(self, key_hash):
+        start = key_hash % self.maxsize
+        for probe in range(self.PROBE_LENGTH):
+            offset = self._offset((start + probe) % self.maxsize)
+            yield offset, self.SLOT.unpack_from(self._file.data, offset)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        key_hash = self._hash(key)
+        with self._file.locked():
+            generation, now = self._generation(), time.time()
+            for offset, (slot_hash, slot_generation, expires_at, length) in self._probe(key_hash):
+                if slot_hash == key_hash and slot_generation == generation and expires_at > now:
+                    start = offset + self.SLOT.size
+                    stored_key, value = json.loads(bytes(self._file.data[start:start + length]))
+                    if stored_key == repr(key):
+                        self._count('hits')
+                        return value
+        self._count('misses')
+        return None
+
+    def generation(self, key):
+        """
+        Returns the generation to pass to set() by a caller about to read key's value from the database:
+        the cache's generation and the invalidation count of key's bucket.
+        """
+        key_hash = self._hash(key)
+        with self._file.locked():
+            return self._key_generation(key_hash)
+
+    def set(self, key, value, generation=None):
+        """
+        Stores value under key, replacing an expired or the earliest expiring entry if its slots are taken.
+        Skipped if the cache was cleared or key deleted since `generation` was read.
+        """
+        payload = json.dumps([repr(key), value], separators=(',', ':')).encode('utf-8')
+        if len(payload) > self.slot_size - self.SLOT.size:
+            self._count('tooLarge')
+            return
+        key_hash = self._hash(key)
+        with self._file.locked():
+            if generation is not None and generation != self._key_generation(key_hash):
+                self._count('staleFills')
+                return
+            generation, now = self._generation(), time.time()
+            target = free = oldest = None
+            for offset, (slot_hash, slot_generation, expires_at, _) in self._probe(key_hash):
+                live = slot_hash != 0 and slot_generation == generation and expires_at > now
+                if slot_hash == key_hash and live:
+                    target = offset
+                    break
+                if free is None and not live:
+                    free = offset
+                if oldest is None or expires_at < oldest[1]:
+                    oldest = (offset, expires_at)
+            if target is None:
+                target = free if free is not None else oldest[0]
+                if free is None:
+                    self._count('evictions')
+            self.SLOT.pack_into(self._file.data, target, key_hash, generation, now + self.ttl, len(payload))
+            start = target + self.SLOT.size
+            self._file.data[start:start + len(payload)] = payload
+
+    def delete(self, key):
+        """
+        Removes key from the cache if present, for every process sharing it.
+        """
+        self._count('invalidations')
+        key_hash = self._hash(key)
+        with self._file.locked():
+            bucket = self._bucket_offset(key_hash)
+            self.BUCKET.pack_into(self._file.data, bucket, self.BUCKET.unpack_from(self._file.data, bucket)[0] + 1)
+            for offset, (slot_hash, _, _, _) in self._probe(key_hash):
+                if slot_hash == key_hash:
+                    self.SLOT.pack_into(self._file.data, offset, 0, 0, 0.0, 0)
+
+    def clear(self):
+        """
+        Removes every entry by moving the cache to a new generation.
+        """
+        with self._file.locked():
+            self.STATE.pack_into(self._file.data, 0, self._generation() + 1)
+
+    def stats(self):
+        """
+        Returns the number of live entries, this process' hit/miss counters and the layout.
+        """
+        with self._file.locked():
+            generation, now = self._generation(), time.time()
+            size = 0
+            for slot in range(self.maxsize):
+                slot_hash, slot_generation, expires_at, _ = self.SLOT.unpack_from(self._file.data, self._offset(slot))
+                size += bool(slot_hash and slot_generation == generation and expires_at > now)
+        with self._stats_lock:
+            return dict(self._stats, size=size, maxsize=self.maxsize, ttl=self.ttl, backend=self.backend,
+                        path=self._file.path)
+
+
+class SharedCounters:
+    """
+    Up to MAX_COUNTERS named 64-bit counters in a SharedMemoryFile, allocated on first use.
+
+    A counter is only ever incremented, so a process notices a change made by
+    any other one by comparing a value it saw before with the current one. The
+    file also holds a random instance id, the same for every process sharing it.
+    """
+    MAGIC = b'TCCOUNT1'
+    MAX_COUNTERS = 64
+    NAME_BYTES = 24
+    STATE = struct.Struct('<16s')  # instance id
+    COUNTER = struct.Struct(f'<{NAME_BYTES}sQ')
+
+    def __init__(self, path):
+        self._file = SharedMemoryFile(path, self.MAGIC, self.MAX_COUNTERS,
+                                      self.STATE.size + self.MAX_COUNTERS * self.COUNTER.size)
+        self._offsets = {}  # name -> offset of its value, stable once allocated
+        with self._file.locked():
+            if self.STATE.unpack_from(self._file.data, 0)[0] == bytes(16):
+                self.STATE.pack_into(self._file.data, 0, secrets.token_hex(8).encode('ascii'))
+            self.instance_id = self.STATE.unpack_from(self._file.data, 0)[0].decode('ascii')
+
+    def _value_offset(self, name):
+        offset = self._offsets.get(name)
+        if offset is not None:
+            return offset
+        encoded = name.encode('utf-8')
+        if len(encoded) > self.NAME_BYTES:
+            raise ValueError(f"Counter name too long: {name}")
+        with self._file.locked():
+            for index in range(self.MAX_COUNTERS):
+                entry = self.STATE.size + index * self.COUNTER.size
+                stored = self.COUNTER.unpack_from(self._file.data, entry)[0].rstrip(b'\0')
+                if stored in (encoded, b''):
+                    if not stored:
+                        self.COUNTER.pack_into(self._file.data, entry, encoded, 0)
+                    offset = entry + self.NAME_BYTES
+                    break
+            else:
+                raise ValueError("No room for another shared counter")
+        self._offsets[name] = offset
+        return offset
+
+    def get(self, name):
+        """
+        Returns the current value of a counter. An aligned 8 byte read needs no lock.
+        """
+        return struct.unpack_from('<Q', self._file.data, self._value_offset(name))[0]
+
+    def bump(self, name):
+        """
+        Increments a counter and returns its new value.
+        """
+        offset = self._value_offset(name)
+        with self._file.locked():
+            value = struct.unpack_from('<Q', self._file.data, offset)[0] + 1
+            struct.pack_into('<Q', self._file.data, offset, value)
+            return value
+
+
+def shared_path(name):
+    """
+    Returns the file of the shared structure `name`, CACHE_SHARED_PATH defaults to /dev/shm/timeclock.
+    """
+    prefix = Config.CACHE_SHARED_PATH or os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'timeclock')
+    return f"{prefix}-{name}"
+
+
+def create_cache(name, maxsize, ttl):
+    """
+    Returns a TTLCache, or with CACHE_BACKEND = 'shared' a SharedCache every worker of the host uses.
+    """
+    if Config.CACHE_BACKEND == 'shared':
+        return SharedCache(shared_path(f"{name}.cache"), maxsize, ttl, Config.CACHE_SHARED_SLOT_BYTES)
+    if Config.CACHE_BACKEND != 'memory':
+        raise ValueError(f"Unknown CACHE_BACKEND: {Config.CACHE_BACKEND}")
+    return TTLCache(maxsize, ttl)
+
+
+user_cache = create_cache('users', maxsize=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+shared_counters = SharedCounters(shared_path('counters')) if Config.CACHE_BACKEND == 'shared' else None
@@ -16,21 +16,164 @@ class Config:
     Configuration class for application settings.
 
     Attributes:
+        DATABASE_BACKEND (str): Storage backend, 'mysql' for the MySQL server or 'sqlite' for an embedded SQLite file.
+        SQLITE_DATABASE_PATH (str): Path (or file: URI) of the SQLite database file.
+        SQLITE_BUSY_TIMEOUT (float): Seconds a SQLite writer waits for the database lock.
         MYSQL_DATABASE_USERNAME (str): The username for the MySQL database.
         MYSQL_DATABASE_PASSWORD (str): The password for the MySQL database.
         MYSQL_DATABASE_HOST (str): The host for the MySQL database.
         MYSQL_DATABASE_PORT (str): The port for the MySQL database.
         MYSQL_DATABASE_DBNAME (str): The name of the MySQL database.
+        MYSQL_POOL_SIZE (int): Maximum number of pooled MySQL connections per process.
+        MYSQL_POOL_ACQUIRE_TIMEOUT (float): Seconds a request waits for a free pooled connection.
+        MYSQL_POOL_PING_INTERVAL (float): Seconds a pooled connection may sit idle before it is pinged on checkout.
+        MIGRATE_ON_STARTUP (bool): Apply pending schema migrations when the app starts.
+        PUNCH_BATCH_MAX_EVENTS (int): Maximum number of badge events accepted by one /onlinetime/batch request.
+        TAG_INDEX_WARM_ON_STARTUP (bool): Load the tagNum index from the database when the app starts.
+        USER_CACHE_SIZE (int): Maximum number of users kept by the login user loader cache.
+        USER_CACHE_TTL (float): Seconds a cached login user stays valid.
+        CACHE_BACKEND (str): 'memory' for per-process caches, 'shared' for caches and change counters in shared memory used by every worker of the host.
+        CACHE_SHARED_PATH (str): Path prefix of the shared memory files, defaults to /dev/shm/timeclock. Give each deployment on a host its own.
+        CACHE_SHARED_SLOT_BYTES (int): Room for one entry of a shared cache, larger entries are not cached.
+        PAGE_SIZE_DEFAULT (int): Page size of the listing endpoints when only a cursor is given.
+        PAGE_SIZE_MAX (int): Largest page size the listing endpoints accept.
+        STREAM_FETCH_SIZE (int): Rows fetched per chunk by the streaming listing responses.
+        JSON_USE_ORJSON (bool): Serialize JSON with orjson when it is installed.
+        PASSWORD_HASH_WORKERS (int): Threads running bcrypt for login and registration.
+        PASSWORD_HASH_QUEUE_SIZE (int): Password checks allowed to wait for a hashing thread before new ones get 503.
+        PASSWORD_HASH_TIMEOUT (float): Seconds a request waits for its password check before giving up with 503.
+        PASSWORD_HASH_RETRY_AFTER (int): Retry-After seconds sent with the 503 of a full hashing queue.
+        PASSWORD_HASH_TARGET_MS (float): Time one bcrypt hash may take, the cost is calibrated to it at startup.
+        PASSWORD_BCRYPT_ROUNDS (int): Fixed bcrypt cost, 0 to calibrate it at startup.
+        PASSWORD_BCRYPT_MIN_ROUNDS (int): Lowest bcrypt cost calibration may choose.
+        API_TOKEN_TTL (int): Seconds a bearer token from /auth/token stays valid.
+        API_TOKEN_REVOCATION_SLOTS (int): Revoked tokens and users the shared revocation list (CACHE_BACKEND 'shared') has room for.
+        PROXY_FIX_X_FOR (int): Reverse proxies in front of the app whose X-Forwarded-For entries are trusted for the client IP, 0 to use the connecting address.
+        RATE_LIMIT_ENABLED (bool): Answer requests over the limits below with 429.
+        RATE_LIMIT_BACKEND (str): 'memory' for per-process counters, 'shared' for counters in shared memory used by every worker of the host.
+        RATE_LIMIT_WINDOW (int): Seconds of the sliding window the limits below apply to.
+        RATE_LIMIT_MAX_KEYS (int): Most clients the memory backend tracks at once.
+        RATE_LIMIT_SWEEP_INTERVAL (float): Seconds between sweeps of stale clients from the memory backend.
+        RATE_LIMIT_SHARED_PATH (str): File of the shared backend, defaults to CACHE_SHARED_PATH + '-ratelimit'.
+        RATE_LIMIT_SHARED_SLOTS (int): Clients the shared backend's table has room for.
+        RATE_LIMIT_LOGIN_PER_IP (int): Login, token and registration attempts per client IP and window, 0 for no limit. A site whose kiosks or staff share one address behind NAT or a proxy sends the whole shift start from it.
+        RATE_LIMIT_LOGIN_PER_EMAIL (int): Login and token attempts per email address and window.
+        RATE_LIMIT_PUNCH_PER_USER (int): Clock-in and clock-out requests per user and window.
+        RATE_LIMIT_PUNCH_PER_TAG (int): Badge punches per tag and window.
+        BATCH_MAX_REQUESTS (int): Maximum number of sub-requests accepted by one /batch request.
+        BATCH_MAX_WORKERS (int): Threads running the sub-requests of a parallel /batch request, each on its own connection.
+        PAYROLL_OVERTIME_HOURS_PER_DAY (float): Hours per day after which the payroll report counts overtime.
+        PAYROLL_MAX_DAYS (int): Longest period the payroll report accepts.
+        SSE_QUEUE_SIZE (int): Events buffered per /onlinetime/stream client before it is disconnected as too slow.
+        SSE_HEARTBEAT_INTERVAL (float): Seconds without events after which /onlinetime/stream sends a keep-alive comment.
+        SSE_SHARED_SLOTS (int): Events the shared event log (CACHE_BACKEND 'shared') keeps for the workers to pick up, a worker further behind disconnects its streams.
+        SSE_POLL_INTERVAL (float): Seconds between the checks of a worker with connected streams for events published by the other workers (CACHE_BACKEND 'shared').
+        RECOMPUTE_CHUNK_SIZE (int): Users per grouped query of the bulk recompute job.
+        RECOMPUTE_WORKERS (int): Chunks the bulk recompute job processes in parallel, each on its own connection.
+        SYNC_PAGE_SIZE (int): Most changes returned by one /sync request.
+        SYNC_SETTLE_SECONDS (float): Changes younger than this are sent again by the next /sync, in case an older transaction commits late; with the memory CACHE_BACKEND, listings of a table changed this recently get no ETag.
+        SYNC_LOG_RETENTION_DAYS (int): Days of changes `flask prune-changelog` keeps by default.
 
     Additional configuration settings can be added as needed.
     """
+    DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'mysql').lower()
+
+    # Embedded SQLite backend
+    SQLITE_DATABASE_PATH = os.getenv('SQLITE_DATABASE_PATH', 'timeclock.sqlite3')
+    SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5))
+
     MYSQL_DATABASE_USERNAME = os.getenv('MYSQL_DATABASE_USERNAME')
     MYSQL_DATABASE_PASSWORD = os.getenv('MYSQL_DATABASE_PASSWORD')
     MYSQL_DATABASE_HOST = os.getenv('MYSQL_DATABASE_HOST')
     MYSQL_DATABASE_PORT = os.getenv('MYSQL_DATABASE_PORT')
     MYSQL_DATABASE_DBNAME = os.getenv('MYSQL_DATABASE_DBNAME')
 
-    #Secret Key for App
-    SECRET_KEY = os.urandom(24)
+    # Connection pool settings
+    MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 10))
+    MYSQL_POOL_ACQUIRE_TIMEOUT = float(os.getenv('MYSQL_POOL_ACQUIRE_TIMEOUT', 5))
+    MYSQL_POOL_PING_INTERVAL = float(os.getenv('MYSQL_POOL_PING_INTERVAL', 30))
+
+    # Schema migrations, also available as `flask migrate-db`
+    MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', 'false').lower() == 'true'
+
+    # Badge reader batch ingestion
+    PUNCH_BATCH_MAX_EVENTS = int(os.getenv('PUNCH_BATCH_MAX_EVENTS', 1000))
+
+    # Badge kiosk lookups
+    TAG_INDEX_WARM_ON_STARTUP = os.getenv('TAG_INDEX_WARM_ON_STARTUP', 'true').lower() == 'true'
+
+    # Login user loader cache
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+
+    # Cache backend, 'shared' keeps the worker processes of a host coherent
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_SHARED_PATH = os.getenv('CACHE_SHARED_PATH', '')
+    CACHE_SHARED_SLOT_BYTES = int(os.getenv('CACHE_SHARED_SLOT_BYTES', 512))
+
+    # Keyset pagination of the listing endpoints
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 100))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 1000))
+
+    # Streaming listing responses
+    STREAM_FETCH_SIZE = int(os.getenv('STREAM_FETCH_SIZE', 500))
+
+    # JSON serialization, falls back to the json module without orjson
+    JSON_USE_ORJSON = os.getenv('JSON_USE_ORJSON', 'true').lower() == 'true'
+
+    # Password hashing pool, keeps login storms from starving the other requests
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 50))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    PASSWORD_HASH_RETRY_AFTER = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', 2))
+    PASSWORD_HASH_TARGET_MS = float(os.getenv('PASSWORD_HASH_TARGET_MS', 250))
+    PASSWORD_BCRYPT_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_ROUNDS', 0))
+    PASSWORD_BCRYPT_MIN_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_MIN_ROUNDS', 10))
+
+    # Multiplexed read requests
+    BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 20))
+    BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 4))
+
+    # Clock-in/clock-out event stream
+    SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 100))
+    SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 15))
+    SSE_SHARED_SLOTS = int(os.getenv('SSE_SHARED_SLOTS', 1024))
+    SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', 0.2))
+
+    # Payroll period report
+    PAYROLL_OVERTIME_HOURS_PER_DAY = float(os.getenv('PAYROLL_OVERTIME_HOURS_PER_DAY', 8))
+    PAYROLL_MAX_DAYS = int(os.getenv('PAYROLL_MAX_DAYS', 366))
+
+    # Bulk recompute job, also available as `flask recompute-totals`
+    RECOMPUTE_CHUNK_SIZE = int(os.getenv('RECOMPUTE_CHUNK_SIZE', 500))
+    RECOMPUTE_WORKERS = int(os.getenv('RECOMPUTE_WORKERS', 4))
+
+    # Delta sync, old changes are removed with `flask prune-changelog`
+    SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 1000))
+    SYNC_SETTLE_SECONDS = float(os.getenv('SYNC_SETTLE_SECONDS', 2))
+    SYNC_LOG_RETENTION_DAYS = int(os.getenv('SYNC_LOG_RETENTION_DAYS', 30))
+
+    # Bearer tokens for kiosks and integrations, signed with SECRET_KEY
+    API_TOKEN_TTL = int(os.getenv('API_TOKEN_TTL', 12 * 3600))
+    API_TOKEN_REVOCATION_SLOTS = int(os.getenv('API_TOKEN_REVOCATION_SLOTS', 4096))
+
+    # Reverse proxies trusted to report the client address
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', 0))
+
+    # Rate limits of the login and punch routes, counted per sliding window
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', 60))
+    RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+    RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv('RATE_LIMIT_SWEEP_INTERVAL', 60))
+    RATE_LIMIT_SHARED_PATH = os.getenv('RATE_LIMIT_SHARED_PATH', '')
+    RATE_LIMIT_SHARED_SLOTS = int(os.getenv('RATE_LIMIT_SHARED_SLOTS', 65536))
+    RATE_LIMIT_LOGIN_PER_IP = int(os.getenv('RATE_LIMIT_LOGIN_PER_IP', 1000))
+    RATE_LIMIT_LOGIN_PER_EMAIL = int(os.getenv('RATE_LIMIT_LOGIN_PER_EMAIL', 10))
+    RATE_LIMIT_PUNCH_PER_USER = int(os.getenv('RATE_LIMIT_PUNCH_PER_USER', 10))
+    RATE_LIMIT_PUNCH_PER_TAG = int(os.getenv('RATE_LIMIT_PUNCH_PER_TAG', 10))
+
+    #Secret Key for App, set it so sessions and tokens survive restarts and are accepted by every worker
+    SECRET_KEY = os.getenv('SECRET_KEY') or os.urandom(24)
 
     # Additional configuration settings can be added here
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Conditional GET support for the read endpoints
+
+A GET response carries a strong ETag built from the versions of the resources
+it is read from, the request URL and, for endpoints that answer with the
+caller's own data, the user id. A request whose If-None-Match still matches is
+answered with 304 before the view runs, so it never reads the listing.
+
+Where the versions come from depends on CACHE_BACKEND:
+ - 'shared': counters in the host's SharedCounters file, bumped by the write
+   paths after their transaction committed. The ETag contains the file's
+   instance id and is valid in every worker of the host.
+ - 'memory': each worker would only see its own bumps, so the versions of the
+   User, OnlineTime and TotalTime resources are read from ChangeLog (the
+   latest change of their table) and every worker and host agrees on them.
+   That costs every conditional GET, 304s included, one index lookup on
+   ix_ChangeLog_table per resource; the 'shared' counters need none. A table
+   changed less than SYNC_SETTLE_SECONDS ago may still see an older
+   transaction commit, so its responses go without an ETag until it settled,
+   like the versions GET /sync hands out. PERMISSIONS has no log, so
+   /permissions and the other views reading it are never tagged in this mode.
+
+Classes:
+ - ResourceVersions: Thread-safe version counters per resource, optionally shared between processes.
+
+Functions:
+ - conditional_get(*resources, per_user): Decorator adding ETag/If-None-Match handling to a view.
+
+Objects:
+ - resource_versions: The counters shared by the application.
+"""
+import hashlib
+import threading
+from functools import wraps
+from flask import current_app, request, make_response
+from flask_login import current_user
+from .cache import shared_counters
+from .repositories import get_repository
+
+# Names of the versioned resources
+USERS = 'users'
+PERMISSIONS = 'permissions'
+ONLINETIME = 'onlinetime'
+TOTALTIME = 'totaltime'
+
+# The table whose ChangeLog versions stand for a resource when the counters are per process
+CHANGE_LOG_TABLES = {USERS: 'User', ONLINETIME: 'OnlineTime', TOTALTIME: 'TotalTime'}
+
+
+class ResourceVersions:
+    """
+    The version of every resource, kept in `counters` (cache.SharedCounters) when given.
+    """
+    RESOURCES = (USERS, PERMISSIONS, ONLINETIME, TOTALTIME)
+
+    def __init__(self, counters=None):
+        self._counters = counters
+        self._versions = dict.fromkeys(self.RESOURCES, 0)
+        self._lock = threading.Lock()
+        self._stats = {'notModified': 0, 'tagged': 0, 'untagged': 0}
+
+    def bump(self, *resources):
+        """
+        Marks resources as changed, invalidating every ETag built from them.
+        Without shared counters only this process sees the bump, the ETags follow ChangeLog instead.
+        """
+        if self._counters is not None:
+            for resource in resources:
+                self._counters.bump(resource)
+            return
+        with self._lock:
+            for resource in resources:
+                self._versions[resource] += 1
+
+    def version(self, resource):
+        """
+        Returns the current version of a resource.
+        """
+        if self._counters is not None:
+            return self._counters.get(resource)
+        with self._lock:
+            return self._versions[resource]
+
+    def _logged_versions(self, resources):
+        """
+        Returns the ChangeLog version of every resource, or None if one has no settled version.
+        """
+        if any(resource not in CHANGE_LOG_TABLES for resource in resources):
+            return None
+        repo = get_repository()
+        if repo is None:
+            return None
+        settle = current_app.config['SYNC_SETTLE_SECONDS']
+        versions = []
+        try:
+            for resource in resources:
+                version, age = repo.changes.latest(CHANGE_LOG_TABLES[resource])
+                if age is not None and age < settle:
+                    return None
+                versions.append(version)
+        except Exception as e:
+            print(f"Error reading change versions: {e}")
+            return None
+        return versions
+
+    def etag(self, resources, key):
+        """
+        Returns the ETag value for a representation of resources identified by key (URL and user),
+        or None if the response must not be tagged.
+        """
+        if self._counters is not None:
+            prefix, versions = self._counters.instance_id, [self.version(resource) for resource in resources]
+        else:
+            prefix, versions = 'log', self._logged_versions(resources)
+            if versions is None:
+                return None
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+        return f"{prefix}-{'.'.join(map(str, versions))}-{digest}"
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        versions = {resource: self.version(resource) for resource in self.RESOURCES}
+        with self._lock:
+            return dict(self._stats, versions=versions)
+
+
+resource_versions = ResourceVersions(shared_counters)
+
+
+def conditional_get(*resources, per_user=False):
+    """
+    Answers a matching If-None-Match with 304 and tags successful responses with an ETag.
+
+    The versions are read before the view runs, so a write that lands while the
+    view reads only makes the next request miss. Place it below login_required
+    and role_required so a 304 is never sent to a caller who may not see the data.
+
+    Parameters:
+        resources (str): The resources the view reads.
+        per_user (bool): The response depends on the logged in user, not only on the URL.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            if per_user:
+                key += f"#{current_user.get_id()}"
+            etag = resource_versions.etag(resources, key)
+            if etag is None:
+                resource_versions.count('untagged')
+                return view(*args, **kwargs)
+            if etag in request.if_none_match:
+                resource_versions.count('notModified')
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                resource_versions.count('tagged')
+            response.set_etag(etag)
+            # Browsers keep the response but revalidate it on every use
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
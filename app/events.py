@@ -0,0 +1,330 @@
+"""
+Clock-in/clock-out event feed
+
+A publish/subscribe broker behind the /onlinetime/stream Server-Sent Events
+endpoint. The punch paths publish after their transaction committed; every
+connected stream has a bounded queue, and a subscriber that falls too far
+behind is dropped instead of slowing the punch paths down.
+
+With CACHE_BACKEND = 'memory' the broker lives in one process, so a stream
+only sees the punches handled by its own worker; deployments with several
+workers need 'shared'. Then events are appended to a ring of recent events in
+a SharedMemoryFile (see cache.py), and every worker with a stream connected
+polls it every SSE_POLL_INTERVAL seconds and hands the new events to its
+subscribers. A worker that falls more than SSE_SHARED_SLOTS events behind
+disconnects its streams, which reconnect for a fresh snapshot. Workers on
+other hosts never see the events.
+
+Classes:
+ - EventBroker: Fans the events published in this process out to the subscribed queues.
+ - SharedEventLog: The ring of recent events shared by the processes of one host.
+ - SharedEventBroker: The EventBroker interface over a SharedEventLog.
+
+Functions:
+ - create_event_broker(config): Returns the broker selected by CACHE_BACKEND.
+ - publish_clock_event(kind, user_id, session_id, date_time_start, date_time_stop): Publishes a clock-in or clock-out.
+ - format_sse(event, data, event_id): Formats one Server-Sent Events message.
+ - sse_stream(subscriber, snapshot, heartbeat): Yields the snapshot, then the subscriber's events as SSE messages.
+
+Objects:
+ - event_broker: The broker shared by the application.
+"""
+import json
+import queue
+import struct
+import threading
+import time
+from flask import current_app
+from .config import Config
+from .repositories import get_repository
+from .cache import SharedMemoryFile, shared_path, user_cache
+from .jsonProvider import encode_default
+
+# Put on a subscriber's queue to end its stream
+_DISCONNECT = object()
+
+
+class EventBroker:
+    """
+    Fans the events published in this process out to its subscribers.
+    """
+    backend = 'memory'
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._stats = {'published': 0, 'dropped': 0}
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, maxsize):
+        """
+        Returns a new queue that receives (id, event, data) tuples of every later publish.
+        """
+        subscriber = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        """
+        Queues an event for every subscriber, dropping the subscribers whose queue is full.
+        """
+        with self._lock:
+            self._sequence += 1
+            self._stats['published'] += 1
+            self._deliver((self._sequence, event, data))
+
+    def _deliver(self, message):
+        """
+        Queues a message for every subscriber. Called with the lock held.
+        """
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Too slow to keep up, end its stream so the client reconnects and gets a fresh snapshot
+                self._disconnect(subscriber)
+
+    def _disconnect(self, subscriber):
+        self._subscribers.discard(subscriber)
+        self._stats['dropped'] += 1
+        with subscriber.mutex:
+            subscriber.queue.clear()
+        subscriber.put_nowait((None, None, _DISCONNECT))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, subscribers=len(self._subscribers), backend=self.backend)
+
+
+class SharedEventLog:
+    """
+    The last `slots` published events in a SharedMemoryFile used by the worker processes of a host.
+
+    The file holds the sequence of the latest event, the time until which some
+    process has streams connected, and a ring of slots of (sequence, length)
+    followed by the JSON of [event, data]. Event n lives in slot n % slots
+    until event n + slots overwrites it, so a reader that last saw an older
+    event than latest - slots has lost some.
+    """
+    MAGIC = b'TCEVENT1'
+    STATE = struct.Struct('<Qd')  # latest sequence, streams connected until (epoch seconds)
+    SLOT = struct.Struct('<QI')  # sequence, payload length
+
+    def __init__(self, path, slots, slot_bytes):
+        self.path = path
+        self.slots = slots
+        self.slot_size = self.SLOT.size + slot_bytes
+        self._file = SharedMemoryFile(path, self.MAGIC, slots * 65536 + slot_bytes,
+                                      self.STATE.size + slots * self.slot_size)
+
+    def _offset(self, sequence):
+        return self.STATE.size + (sequence % self.slots) * self.slot_size
+
+    def latest(self):
+        with self._file.locked():
+            return self.STATE.unpack_from(self._file.data, 0)[0]
+
+    def append(self, event, data):
+        """
+        Stores an event after the latest one and returns its sequence, or None if it does not fit a slot.
+        """
+        payload = json.dumps([event, data], default=encode_default, separators=(',', ':')).encode('utf-8')
+        if len(payload) > self.slot_size - self.SLOT.size:
+            print(f"Error: {event} event of {len(payload)} bytes does not fit the event log {self.path}")
+            return None
+        with self._file.locked():
+            sequence, listening_until = self.STATE.unpack_from(self._file.data, 0)
+            sequence += 1
+            offset = self._offset(sequence)
+            self.SLOT.pack_into(self._file.data, offset, sequence, len(payload))
+            start = offset + self.SLOT.size
+            self._file.data[start:start + len(payload)] = payload
+            self.STATE.pack_into(self._file.data, 0, sequence, listening_until)
+            return sequence
+
+    def read_after(self, seen):
+        """
+        Returns ([(sequence, event, data), ...] of the events after sequence `seen`, whether events were lost).
+        """
+        with self._file.locked():
+            latest = self.STATE.unpack_from(self._file.data, 0)[0]
+            first = max(seen + 1, latest - self.slots + 1)
+            payloads = []
+            for sequence in range(first, latest + 1):
+                offset = self._offset(sequence)
+                length = self.SLOT.unpack_from(self._file.data, offset)[1]
+                start = offset + self.SLOT.size
+                payloads.append((sequence, bytes(self._file.data[start:start + length])))
+        return [(sequence, *json.loads(payload)) for sequence, payload in payloads], first > seen + 1
+
+    def listening(self):
+        """
+        Returns whether a process had streams connected recently.
+        """
+        with self._file.locked():
+            return self.STATE.unpack_from(self._file.data, 0)[1] > time.time()
+
+    def keep_listening(self, until):
+        with self._file.locked():
+            sequence, listening_until = self.STATE.unpack_from(self._file.data, 0)
+            self.STATE.pack_into(self._file.data, 0, sequence, max(listening_until, until))
+
+
+class SharedEventBroker(EventBroker):
+    """
+    The EventBroker interface over a SharedEventLog.
+
+    publish() only appends to the log. While this process has subscribers, a
+    relay thread reads the log every `poll_interval` seconds and queues the new
+    events for them, its own ones included. Each subscriber gets the events
+    appended after it subscribed.
+    """
+    backend = 'shared'
+
+    def __init__(self, log, poll_interval):
+        super().__init__()
+        self._log = log
+        self._poll_interval = poll_interval
+        self._starts = {}  # subscriber -> sequence of the latest event when it subscribed
+        self._seen = 0
+        self._relay = None
+
+    def has_subscribers(self):
+        # Publishers look the user up only for a connected stream, in any worker
+        return bool(self._subscribers) or self._log.listening()
+
+    def subscribe(self, maxsize):
+        subscriber = queue.Queue(maxsize=maxsize)
+        latest = self._log.latest()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            self._starts[subscriber] = latest
+            if self._relay is None or not self._relay.is_alive():
+                # A relay thread does not survive a fork, every worker starts its own
+                self._seen = latest
+                self._relay = threading.Thread(target=self._run_relay, name='event-relay', daemon=True)
+                self._relay.start()
+        self._log.keep_listening(time.time() + self._listen_seconds())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self._starts.pop(subscriber, None)
+
+    def publish(self, event, data):
+        if self._log.append(event, data) is not None:
+            with self._lock:
+                self._stats['published'] += 1
+
+    def _listen_seconds(self):
+        # Outlasts a few polls, so a relay that died stops the user lookups of the publishers soon after
+        return max(1.0, 5 * self._poll_interval)
+
+    def _deliver(self, message):
+        for subscriber in list(self._subscribers):
+            if message[0] <= self._starts.get(subscriber, 0):
+                continue
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self._disconnect(subscriber)
+
+    def _disconnect(self, subscriber):
+        self._starts.pop(subscriber, None)
+        super()._disconnect(subscriber)
+
+    def _run_relay(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._relay = None
+                    return
+            self._log.keep_listening(time.time() + self._listen_seconds())
+            messages, lost = self._log.read_after(self._seen)
+            with self._lock:
+                if lost:
+                    # The log wrapped since the last poll, the streams reconnect for a fresh snapshot
+                    for subscriber in list(self._subscribers):
+                        self._disconnect(subscriber)
+                for message in messages:
+                    self._deliver(message)
+                if messages:
+                    self._seen = messages[-1][0]
+            time.sleep(self._poll_interval)
+
+    def stats(self):
+        return dict(super().stats(), latest=self._log.latest(), slots=self._log.slots, path=self._log.path)
+
+
+def create_event_broker(config):
+    """
+    Returns the broker of CACHE_BACKEND, shared by the workers of the host when it is 'shared'.
+    """
+    if config.CACHE_BACKEND == 'shared':
+        return SharedEventBroker(SharedEventLog(shared_path('events'), config.SSE_SHARED_SLOTS,
+                                                config.CACHE_SHARED_SLOT_BYTES),
+                                 config.SSE_POLL_INTERVAL)
+    return EventBroker()
+
+
+event_broker = create_event_broker(Config)
+
+
+def publish_clock_event(kind, user_id, session_id, date_time_start, date_time_stop=None):
+    """
+    Publishes a committed clock-in ('clock-in') or clock-out ('clock-out').
+    The user's name is only looked up when a stream is connected.
+    """
+    if not event_broker.has_subscribers():
+        return
+    user = user_cache.get(user_id)
+    if user is None:
+        repo = get_repository()
+        user = repo.users.get_login(user_id) if repo else None
+    event_broker.publish(kind, {'id': session_id,
+                                'user_id': user_id,
+                                'firstName': user['firstName'] if user else None,
+                                'lastName': user['lastName'] if user else None,
+                                'dateTimeStart': date_time_start,
+                                'dateTimeStop': date_time_stop})
+
+
+def format_sse(event, data, event_id=None):
+    """
+    Formats one Server-Sent Events message with a JSON data line.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {current_app.json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def sse_stream(subscriber, snapshot, heartbeat):
+    """
+    Yields the snapshot of open sessions, then every event published to the subscriber.
+    A comment line is sent after heartbeat seconds without events so proxies keep the connection open.
+    """
+    try:
+        yield format_sse('snapshot', {'sessions': snapshot})
+        while True:
+            try:
+                event_id, event, data = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if data is _DISCONNECT:
+                return
+            yield format_sse(event, data, event_id)
+    finally:
+        event_broker.unsubscribe(subscriber)
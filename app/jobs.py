@@ -0,0 +1,157 @@
+"""
+Bulk recompute of TotalTime and the daily/weekly rollups
+
+Repairs every user's totals after bad data was fixed by hand. User ids are
+split into chunks; each chunk is handled by one worker with its own
+connection: one grouped query computes the chunk's totals, users whose
+completed sessions did not change since the last run are skipped, and the
+rest are written back with executemany.
+
+Classes:
+ - RecomputeJob: Runs the recompute and reports its progress.
+
+Functions:
+ - init_jobs(app): Registers the `flask recompute-totals` command.
+
+Objects:
+ - recompute_job: The job instance shared by the admin routes.
+"""
+import threading
+import click
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from .repositories import get_repository
+from .etags import resource_versions, TOTALTIME
+
+
+class RecomputeJob:
+    """
+    One recompute run at a time per process, with thread-safe progress counters.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {'status': 'idle'}
+
+    def progress(self):
+        """
+        Returns a copy of the current progress: status, users, processed, changed, skipped, chunks, timestamps and error.
+        """
+        with self._lock:
+            return dict(self._state)
+
+    def _update(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._state[name] += value
+
+    def start(self, app, chunk_size=None, workers=None, force=False):
+        """
+        Starts a run in a background thread.
+
+        Returns:
+            bool: False if a run is already in progress.
+        """
+        if not self._begin():
+            return False
+        thread = threading.Thread(target=self._run, args=(app, chunk_size, workers, force), daemon=True)
+        thread.start()
+        return True
+
+    def run(self, app, chunk_size=None, workers=None, force=False, on_progress=None):
+        """
+        Runs a recompute in the calling thread.
+
+        Returns:
+            dict: The final progress, or None if a run is already in progress.
+        """
+        if not self._begin():
+            return None
+        self._run(app, chunk_size, workers, force, on_progress)
+        return self.progress()
+
+    def _begin(self):
+        with self._lock:
+            if self._state['status'] == 'running':
+                return False
+            self._state = {'status': 'running', 'users': 0, 'processed': 0, 'changed': 0, 'skipped': 0,
+                           'chunks': 0, 'chunksDone': 0, 'startedAt': datetime.now().replace(microsecond=0),
+                           'finishedAt': None, 'error': None}
+            return True
+
+    def _run(self, app, chunk_size, workers, force, on_progress=None):
+        chunk_size = chunk_size or app.config['RECOMPUTE_CHUNK_SIZE']
+        workers = workers or app.config['RECOMPUTE_WORKERS']
+        try:
+            with app.app_context():
+                repo = get_repository()
+                if repo is None:
+                    raise RuntimeError("Database connection failed")
+                user_ids = repo.users.ids()
+            chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+            self._update(users=len(user_ids), chunks=len(chunks))
+
+            # Every worker runs in its own app context and so checks out its own connection
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._recompute_chunk, app, chunk, force) for chunk in chunks]
+                for future in as_completed(futures):
+                    future.result()
+                    if on_progress:
+                        on_progress(self.progress())
+            status, error = 'done', None
+        except Exception as e:
+            print(f"Error recomputing totals: {e}")
+            status, error = 'failed', str(e)
+        with self._lock:
+            self._state.update(status=status, error=error, finishedAt=datetime.now().replace(microsecond=0))
+
+    def _recompute_chunk(self, app, user_ids, force):
+        """
+        Recomputes one chunk of users in one transaction.
+        """
+        with app.app_context():
+            repo = get_repository()
+            if repo is None:
+                raise RuntimeError("Database connection failed")
+            with repo.transaction():
+                # Punches update TotalTime too, holding its rows keeps them from interleaving with the rewrite
+                repo.totals.lock_users(user_ids)
+                fingerprints = repo.totals.fingerprints(user_ids)
+                for user_id in user_ids:
+                    fingerprints.setdefault(user_id, (0, 0, 0))
+                if force:
+                    changed = fingerprints
+                else:
+                    stored = repo.totals.stored_fingerprints(user_ids)
+                    changed = {user_id: values for user_id, values in fingerprints.items() if stored.get(user_id) != values}
+                repo.totals.set_many([(values[1], user_id) for user_id, values in changed.items()])
+                repo.rollups.rebuild(list(changed))
+                repo.totals.save_fingerprints(changed, datetime.now().replace(microsecond=0))
+            if changed:
+                resource_versions.bump(TOTALTIME)
+        self._update(processed=len(user_ids), changed=len(changed), skipped=len(user_ids) - len(changed), chunksDone=1)
+
+
+recompute_job = RecomputeJob()
+
+
+def init_jobs(app):
+    """
+    Registers the `flask recompute-totals` command.
+    """
+    @app.cli.command('recompute-totals')
+    @click.option('--chunk-size', type=int, default=None, help='Users per grouped query (default RECOMPUTE_CHUNK_SIZE).')
+    @click.option('--workers', type=int, default=None, help='Chunks processed in parallel (default RECOMPUTE_WORKERS).')
+    @click.option('--force', is_flag=True, help='Rewrite every user, even if their sessions did not change.')
+    def recompute_totals(chunk_size, workers, force):
+        """Rebuild TotalTime and the daily/weekly rollups of all users from their sessions."""
+        def report(progress):
+            click.echo(f"{progress['processed']}/{progress['users']} users, "
+                       f"{progress['changed']} changed, {progress['skipped']} skipped")
+
+        progress = recompute_job.run(current_app._get_current_object(), chunk_size, workers, force, report)
+        if progress is None:
+            raise click.ClickException("A recompute is already running")
+        if progress['status'] == 'failed':
+            raise click.ClickException(f"Recompute failed: {progress['error']}")
+        click.echo(f"Done: {progress['changed']} of {progress['users']} users recomputed")
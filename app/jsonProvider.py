@@ -0,0 +1,107 @@
+"""
+JSON provider of the application
+
+Replaces Flask's default provider, which renders datetimes as RFC 1123 strings
+and cannot encode the timedelta values MySQL returns for TIME columns. Every
+response, stream and event uses the same ISO-8601 encoding:
+
+ - datetime: 'YYYY-MM-DDTHH:MM:SS'
+ - date: 'YYYY-MM-DD'
+ - timedelta (TIME columns): 'HH:MM:SS', hours not wrapped at 24
+
+When orjson is installed (and Config.JSON_USE_ORJSON is set) it serializes
+straight to bytes, which is several times faster than the standard library
+for large listings; otherwise the json module is used with the same encoding.
+
+Classes:
+ - TimeClockJSONProvider: The provider, installed as app.json.
+
+Functions:
+ - encode_default(value): Encodes the values the JSON serializers do not handle natively.
+"""
+import dataclasses
+import decimal
+from datetime import date, datetime, timedelta
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_timedelta(value):
+    seconds = int(value.total_seconds())
+    sign = '-' if seconds < 0 else ''
+    hours, remainder = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{sign}{hours:02}:{minutes:02}:{seconds:02}"
+
+
+def encode_default(value):
+    """
+    Encodes the values the JSON serializers do not handle natively.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return _encode_timedelta(value)
+    if isinstance(value, decimal.Decimal):
+        # MySQL returns SUM() as DECIMAL
+        return int(value) if value == value.to_integral_value() else float(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class TimeClockJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider with ISO-8601 dates and an orjson fast path.
+
+    Keys are sorted like with Flask's default provider. orjson writes
+    non-ASCII characters as UTF-8 where the json module escapes them.
+    """
+    default = staticmethod(encode_default)
+
+    def __init__(self, app, use_orjson=True):
+        super().__init__(app)
+        self.use_orjson = use_orjson and orjson is not None
+
+    def _orjson_options(self, indent):
+        options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent=False):
+        """
+        Serializes obj to UTF-8 encoded JSON.
+        """
+        if self.use_orjson:
+            return orjson.dumps(obj, default=encode_default, option=self._orjson_options(indent))
+        return super().dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.dumps(obj, default=encode_default, option=self._orjson_options(False)).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Builds a JSON response from the serialized bytes, without an intermediate str.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = self.dumps_bytes(obj, indent)
+        if indent:
+            body += b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
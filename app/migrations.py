@@ -0,0 +1,196 @@
+"""
+Versioned schema migrations
+
+Each migration is a version number, a description and the statements that
+bring a TimeClockDB schema from the previous version to this one; a step
+that cannot be written as one statement is a function taking the cursor. The
+SchemaVersion table records which versions were applied. MySQL commits DDL
+implicitly, so a version is recorded right after its statements succeed; a
+migration that fails halfway has to be finished by hand before rerunning.
+
+Functions:
+ - get_schema_version(cursor): Returns the highest applied migration version.
+ - run_migrations(target): Applies every pending migration up to target.
+ - init_migrations(app): Registers the `flask migrate-db` command.
+"""
+import click
+from datetime import datetime
+from flask import current_app
+from .mysqlConnector import get_db_connection
+from .rollups import rollup_deltas
+from .repositories.base import CHANGE_TRACKED_TABLES
+
+
+def _backfill_rollups(cursor):
+    # Sessions crossing midnight have to be split, which is simpler in Python than in SQL
+    cursor.execute("SELECT user_id, dateTimeStart, dateTimeStop FROM OnlineTime WHERE dateTimeStop IS NOT NULL")
+    daily, weekly = rollup_deltas(added=cursor.fetchall())
+    cursor.executemany(
+        "INSERT INTO UserDailyTime (user_id, day, seconds) VALUES (%s, %s, %s)",
+        [(user_id, day, seconds) for (user_id, day), seconds in daily.items()]
+    )
+    cursor.executemany(
+        "INSERT INTO UserWeeklyTime (user_id, weekStart, seconds) VALUES (%s, %s, %s)",
+        [(user_id, start, seconds) for (user_id, start), seconds in weekly.items()]
+    )
+
+
+def _check_user_duplicates(cursor):
+    # ALTER TABLE fails on the first duplicate it meets, after earlier statements already committed
+    duplicates = []
+    for column in ('email', 'tagNum'):
+        cursor.execute(
+            f"SELECT {column}, GROUP_CONCAT(id ORDER BY id) FROM `User` WHERE {column} IS NOT NULL"
+            f" GROUP BY {column} HAVING COUNT(*) > 1"
+        )
+        duplicates += [f"{column} {value!r} is shared by users {ids}" for value, ids in cursor.fetchall()]
+    if duplicates:
+        raise RuntimeError("Cannot add the unique keys on User, resolve these duplicates first: " + "; ".join(duplicates))
+
+
+def _change_triggers():
+    # Log every write to the synced tables, see GET /sync
+    return [
+        f"CREATE TRIGGER trg_{table}_{event.lower()} AFTER {event} ON `{table}` FOR EACH ROW "
+        f"INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) "
+        f"VALUES ('{table}', {'OLD' if event == 'DELETE' else 'NEW'}.id, '{'delete' if event == 'DELETE' else 'upsert'}', NOW())"
+        for table in CHANGE_TRACKED_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')
+    ]
+
+
+MIGRATIONS = [
+    (1, "Store TotalTime as integer seconds", [
+        "ALTER TABLE TotalTime ADD COLUMN sumSeconds BIGINT NOT NULL DEFAULT 0 AFTER id",
+        "UPDATE TotalTime SET sumSeconds = ("
+        " SELECT COALESCE(SUM(TIMESTAMPDIFF(SECOND, dateTimeStart, dateTimeStop)), 0) FROM OnlineTime"
+        " WHERE OnlineTime.user_id = TotalTime.user_id AND dateTimeStop IS NOT NULL)",
+        "ALTER TABLE TotalTime DROP COLUMN sumTime, DROP COLUMN daysWorked",
+    ]),
+    (2, "At most one open session per user", [
+        # Close all but the latest open session per user (as zero-length sessions) so the unique key can be built
+        "UPDATE OnlineTime AS stale JOIN OnlineTime AS newer"
+        " ON newer.user_id = stale.user_id AND newer.dateTimeStop IS NULL"
+        " AND (newer.dateTimeStart > stale.dateTimeStart OR (newer.dateTimeStart = stale.dateTimeStart AND newer.id > stale.id))"
+        " SET stale.dateTimeStop = stale.dateTimeStart WHERE stale.dateTimeStop IS NULL",
+        "ALTER TABLE OnlineTime"
+        " ADD COLUMN openSession TINYINT AS (IF(dateTimeStop IS NULL, 1, NULL)) STORED,"
+        " ADD UNIQUE KEY uq_OnlineTime_openSession (user_id, openSession)",
+    ]),
+    (3, "PunchEvent table for badge reader idempotency keys", [
+        "CREATE TABLE PunchEvent ("
+        " eventKey VARCHAR(64) PRIMARY KEY, user_id INT, eventTime DATETIME, direction VARCHAR(3),"
+        " FOREIGN KEY (user_id) REFERENCES `User`(id))",
+    ]),
+    (4, "Unique and composite indexes for the service queries", [
+        # Replace the duplicate checks of create_user with constraint violations, two users may share a name
+        _check_user_duplicates,
+        "ALTER TABLE `User`"
+        " ADD UNIQUE KEY uq_User_email (email),"
+        " ADD UNIQUE KEY uq_User_tagNum (tagNum),"
+        " ADD KEY ix_User_lastName (lastName)",
+        # user_id AND dateTimeStop = ? (edit/delete), user_id AND dateTimeStop IS NULL ORDER BY dateTimeStart
+        "ALTER TABLE OnlineTime"
+        " ADD KEY ix_OnlineTime_user_stop (user_id, dateTimeStop, dateTimeStart),"
+        " ADD KEY ix_OnlineTime_start (dateTimeStart, id)",
+        "ALTER TABLE TotalTime ADD UNIQUE KEY uq_TotalTime_user (user_id)",
+    ]),
+    (5, "Daily and weekly rollups of worked time", [
+        "CREATE TABLE UserDailyTime ("
+        " user_id INT, day DATE, seconds BIGINT NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (user_id, day), KEY ix_UserDailyTime_day (day),"
+        " FOREIGN KEY (user_id) REFERENCES `User`(id))",
+        "CREATE TABLE UserWeeklyTime ("
+        " user_id INT, weekStart DATE, seconds BIGINT NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (user_id, weekStart), KEY ix_UserWeeklyTime_weekStart (weekStart),"
+        " FOREIGN KEY (user_id) REFERENCES `User`(id))",
+        _backfill_rollups,
+    ]),
+    (6, "Session fingerprints of the bulk recompute job", [
+        "CREATE TABLE TotalTimeFingerprint ("
+        " user_id INT PRIMARY KEY, sessionCount INT NOT NULL, sessionSeconds BIGINT NOT NULL,"
+        " startSeconds BIGINT NOT NULL, checkedAt DATETIME,"
+        " FOREIGN KEY (user_id) REFERENCES `User`(id))",
+    ]),
+    (7, "Trigger-fed change log for delta sync", [
+        "CREATE TABLE ChangeLog ("
+        " version BIGINT AUTO_INCREMENT PRIMARY KEY, tableName VARCHAR(32) NOT NULL, rowId INT NOT NULL,"
+        " operation VARCHAR(6) NOT NULL, changedAt DATETIME NOT NULL)",
+    ] + _change_triggers()),
+    (8, "Latest change per table for the ETags", [
+        "ALTER TABLE ChangeLog ADD KEY ix_ChangeLog_table (tableName, version)",
+    ]),
+    # firstName = ? OR lastName = ? can merge two indexes, with only one of them it scans the table
+    (9, "First name index for the user name lookup", [
+        "ALTER TABLE `User` ADD KEY ix_User_firstName (firstName)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor):
+    """
+    Returns the highest applied migration version, creating the SchemaVersion table if needed.
+    """
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS SchemaVersion ("
+        " version INT PRIMARY KEY, description VARCHAR(255), appliedAt DATETIME)"
+    )
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM SchemaVersion")
+    return cursor.fetchone()[0]
+
+
+def run_migrations(target=None):
+    """
+    Applies every pending migration up to target (default: the latest).
+
+    Returns:
+        list: The versions that were applied, in order.
+    """
+    target = LATEST_VERSION if target is None else target
+    if current_app.config.get('DATABASE_BACKEND', 'mysql') != 'mysql':
+        # The embedded backends create the latest schema on startup
+        return []
+    cnx = get_db_connection()
+    if not cnx:
+        raise RuntimeError("Database connection failed")
+    applied = []
+    with cnx.cursor() as cursor:
+        current = get_schema_version(cursor)
+        for version, description, statements in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO SchemaVersion (version, description, appliedAt) VALUES (%s, %s, %s)",
+                (version, description, datetime.now().replace(microsecond=0))
+            )
+            cnx.commit()
+            applied.append(version)
+    return applied
+
+
+def init_migrations(app):
+    """
+    Registers the `flask migrate-db` command and, if MIGRATE_ON_STARTUP is set, migrates right away.
+    """
+    @app.cli.command('migrate-db')
+    @click.option('--target', type=int, default=None, help='Migrate up to this version instead of the latest.')
+    def migrate_db(target):
+        """Apply pending TimeClockDB schema migrations."""
+        applied = run_migrations(target)
+        if applied:
+            click.echo(f"Applied migrations: {', '.join(map(str, applied))}")
+        else:
+            click.echo("Schema is up to date")
+
+    if app.config.get('MIGRATE_ON_STARTUP'):
+        with app.app_context():
+            try:
+                run_migrations()
+            except Exception as e:
+                print(f"Error running migrations: {e}")
@@ -1,32 +1,204 @@
 """
 Database connection logic.
 
-This module contains functions for establishing a connection to the MySQL database.
+This module contains the bounded MySQL connection pool and the helpers that
+check a connection out of it for the duration of a request.
+
+Functions:
+ - init_db(app): Creates the connection pool for the app and registers the teardown handler.
+ - get_db_connection(): Returns the connection bound to the current app context.
+ - close_db_connection(exception): Returns the app context's connection to the pool.
+ - get_pool_stats(): Returns usage counters of the connection pool.
 """
+import threading
+import time
+from collections import deque
 import mysql.connector
 from mysql.connector import Error
+from flask import current_app, g
 from .config import Config
 
+
+class PoolTimeout(Error):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class ConnectionPool:
+    """
+    A bounded pool of MySQL connections.
+
+    Connections are opened lazily up to `size`. A caller that finds the pool
+    exhausted waits up to `acquire_timeout` seconds for a connection to be
+    released. Idle connections are pinged before being handed out again when
+    they have not been used for `ping_interval` seconds.
+    """
+    def __init__(self, size, acquire_timeout, ping_interval, **config):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        # Unset settings fall back to the connector's defaults
+        self._config = {key: value for key, value in config.items() if value is not None}
+        self._idle = deque()  # (connection, last_used) pairs, most recently used last
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {'acquired': 0, 'released': 0, 'created': 0, 'discarded': 0, 'timeouts': 0, 'waited': 0}
+
+    def _connect(self):
+        # consume_results lets several cursors share one connection per request
+        cnx = mysql.connector.connect(consume_results=True, **self._config)
+        self._stats['created'] += 1
+        return cnx
+
+    def _is_alive(self, cnx, last_used):
+        if time.monotonic() - last_used < self.ping_interval:
+            return True
+        try:
+            cnx.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def _discard(self, cnx):
+        self._stats['discarded'] += 1
+        try:
+            cnx.close()
+        except Error:
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Checks a live connection out of the pool.
+
+        Parameters:
+            timeout (float): Seconds to wait for a free connection, defaults to the pool's acquire timeout.
+
+        Returns:
+            MySQLConnection: A connection that must be handed back with release().
+
+        Raises:
+            PoolTimeout: If the pool stays exhausted for the whole timeout.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            waited = False
+            while True:
+                while self._idle:
+                    cnx, last_used = self._idle.pop()
+                    if self._is_alive(cnx, last_used):
+                        self._stats['acquired'] += 1
+                        self._stats['waited'] += waited
+                        return cnx
+                    self._open -= 1
+                    self._discard(cnx)
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(msg=f"No database connection available within {timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+        # Open the new connection outside the lock so other callers are not blocked by the handshake
+        try:
+            cnx = self._connect()
+        except Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['acquired'] += 1
+            self._stats['waited'] += waited
+        return cnx
+
+    def release(self, cnx):
+        """
+        Hands a connection back to the pool, discarding it if it is broken.
+        """
+        try:
+            # Never leak an open transaction into the next request
+            cnx.rollback()
+            healthy = True
+        except Error:
+            healthy = False
+        with self._cond:
+            self._stats['released'] += 1
+            if healthy:
+                self._idle.append((cnx, time.monotonic()))
+            else:
+                self._open -= 1
+                self._discard(cnx)
+            self._cond.notify()
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool's size and usage counters.
+        """
+        with self._cond:
+            return dict(self._stats,
+                        size=self.size,
+                        open=self._open,
+                        idle=len(self._idle),
+                        in_use=self._open - len(self._idle))
+
+
+def init_db(app):
+    """
+    Creates the connection pool for the app and returns connections to it on teardown.
+
+    Parameters:
+        app (Flask): The Flask application.
+    """
+    app.extensions['mysql_pool'] = ConnectionPool(
+        size=app.config.get('MYSQL_POOL_SIZE', Config.MYSQL_POOL_SIZE),
+        acquire_timeout=app.config.get('MYSQL_POOL_ACQUIRE_TIMEOUT', Config.MYSQL_POOL_ACQUIRE_TIMEOUT),
+        ping_interval=app.config.get('MYSQL_POOL_PING_INTERVAL', Config.MYSQL_POOL_PING_INTERVAL),
+        user=Config.MYSQL_DATABASE_USERNAME,
+        password=Config.MYSQL_DATABASE_PASSWORD,
+        host=Config.MYSQL_DATABASE_HOST,
+        port=Config.MYSQL_DATABASE_PORT,
+        database=Config.MYSQL_DATABASE_DBNAME
+    )
+    app.teardown_appcontext(close_db_connection)
+
+
 def get_db_connection():
     """
-    Establishes and returns a connection to the MySQL database.
+    Returns the connection bound to the current app context.
+
+    The first call within a request checks a connection out of the pool, later
+    calls in the same request reuse it. The connection is handed back by
+    close_db_connection() when the app context is torn down, so callers must
+    not close it themselves.
 
     Returns:
-        MySQLConnection: A connection object if the connection is successful, 
-                         or None if the connection fails.
-    """
-    config = {
-        'user': Config.MYSQL_DATABASE_USERNAME,
-        'password': Config.MYSQL_DATABASE_PASSWORD,
-        'host': Config.MYSQL_DATABASE_HOST,
-        'port': Config.MYSQL_DATABASE_PORT,
-        'database': Config.MYSQL_DATABASE_DBNAME
-    }
-
-    try:
-        cnx = mysql.connector.connect(**config)
-        if cnx.is_connected():
-            return cnx
-    except Error as e:
-        print(f"Error: {e}")
-    return None
+        MySQLConnection: A connection object if one could be acquired,
+                         or None if the pool is exhausted or the database is unreachable.
+    """
+    if 'db_cnx' not in g:
+        try:
+            g.db_cnx = current_app.extensions['mysql_pool'].acquire()
+        except Error as e:
+            print(f"Error: {e}")
+            return None
+    return g.db_cnx
+
+
+def close_db_connection(exception=None):
+    """
+    Returns the app context's connection to the pool, if one was checked out.
+    """
+    cnx = g.pop('db_cnx', None)
+    if cnx is not None:
+        current_app.extensions['mysql_pool'].release(cnx)
+
+
+def get_pool_stats():
+    """
+    Returns usage counters of the current app's connection pool, or None without a MySQL pool.
+    """
+    pool = current_app.extensions.get('mysql_pool')
+    return pool.stats() if pool else None
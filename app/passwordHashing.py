@@ -0,0 +1,195 @@
+"""
+Bounded password hashing
+
+bcrypt is deliberately slow, and a login storm running it on every request
+thread starves the cheap requests (punches, listings) of CPU. Hashing and
+verification run on a small dedicated thread pool instead; bcrypt releases
+the GIL while it works, so the pool bounds the cores spent on it. At most
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE calls are admitted at once,
+further ones fail right away with HashingBusyError, which the login and
+registration routes answer with 503 and Retry-After.
+
+Stored hashes are identified by their format: bcrypt ('$2b$<cost>$...') is
+the current scheme, hex SHA-512 (what SQL's SHA2(password, 512) returns, used
+by the seed data and by older API-created users) is still verified. A
+successful login with a legacy hash or a bcrypt cost below the current one
+returns a new hash for the caller to store. The bcrypt cost is calibrated at
+startup to the largest one that hashes within PASSWORD_HASH_TARGET_MS.
+
+Classes:
+ - HashingBusyError: Raised when the pool and its queue are full.
+ - BcryptScheme: The current scheme.
+ - Sha512HexScheme: Legacy unsalted hex SHA-512, verify only.
+ - PasswordHasher: The bounded executor with queue-wait and hash-time metrics.
+
+Objects:
+ - password_hasher: The executor shared by the application.
+"""
+import hashlib
+import hmac
+import math
+import re
+import threading
+import time
+# Only an alias of the builtin TimeoutError since Python 3.11
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from bcrypt import hashpw, gensalt, checkpw
+from .config import Config
+
+
+class HashingBusyError(Exception):
+    pass
+
+
+class BcryptScheme:
+    name = 'bcrypt'
+    HASH_PATTERN = re.compile(r'^\$2[aby]\$(\d{2})\$[./A-Za-z0-9]{53}$')
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+
+    def identify(self, hashed):
+        return self.HASH_PATTERN.match(hashed) is not None
+
+    # bcrypt only uses the first 72 bytes, newer releases raise instead of truncating
+    MAX_PASSWORD_BYTES = 72
+
+    def hash(self, password, rounds=None):
+        return hashpw(password.encode('utf-8')[:self.MAX_PASSWORD_BYTES], gensalt(rounds or self.rounds)).decode('utf-8')
+
+    def verify(self, password, hashed):
+        return checkpw(password.encode('utf-8')[:self.MAX_PASSWORD_BYTES], hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        # Only ever raise the cost, workers calibrated on different hardware must not undo each other
+        return int(self.HASH_PATTERN.match(hashed).group(1)) < self.rounds
+
+
+class Sha512HexScheme:
+    name = 'sha512'
+    HASH_PATTERN = re.compile(r'^[0-9a-fA-F]{128}$')
+
+    def identify(self, hashed):
+        return self.HASH_PATTERN.match(hashed) is not None
+
+    def verify(self, password, hashed):
+        return hmac.compare_digest(hashlib.sha512(password.encode('utf-8')).hexdigest(), hashed.lower())
+
+    def needs_rehash(self, hashed):
+        return True
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on `workers` threads with room for `queue_size` waiting calls.
+    New hashes use `scheme`, stored ones are verified with whichever of `schemes` recognizes them.
+    """
+    def __init__(self, workers, queue_size, timeout, rounds):
+        self.scheme = BcryptScheme(rounds)
+        self.schemes = (self.scheme, Sha512HexScheme())
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._stats = {'completed': 0, 'rejected': 0, 'timedOut': 0, 'admitted': 0,
+                       'queueWaitTotal': 0.0, 'queueWaitMax': 0.0, 'hashTimeTotal': 0.0, 'hashTimeMax': 0.0}
+
+    def _run(self, func, submitted_at):
+        started_at = time.perf_counter()
+        try:
+            return func()
+        finally:
+            finished_at = time.perf_counter()
+            self._slots.release()
+            queue_wait, hash_time = started_at - submitted_at, finished_at - started_at
+            with self._lock:
+                self._stats['completed'] += 1
+                self._stats['queueWaitTotal'] += queue_wait
+                self._stats['queueWaitMax'] = max(self._stats['queueWaitMax'], queue_wait)
+                self._stats['hashTimeTotal'] += hash_time
+                self._stats['hashTimeMax'] = max(self._stats['hashTimeMax'], hash_time)
+
+    def _submit(self, func):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusyError("Too many password checks in progress")
+        with self._lock:
+            self._stats['admitted'] += 1
+        future = self._executor.submit(self._run, func, time.perf_counter())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The call keeps its slot until it finishes, the caller just stops waiting
+            with self._lock:
+                self._stats['timedOut'] += 1
+            raise HashingBusyError("Password check timed out")
+
+    def calibrate(self, target_ms, min_rounds, max_rounds=16):
+        """
+        Sets the bcrypt cost to the largest one between min_rounds and max_rounds that hashes within target_ms.
+        Each extra round doubles the work, so one timed hash at min_rounds is enough to extrapolate.
+
+        Returns:
+            int: The chosen cost.
+        """
+        started_at = time.perf_counter()
+        self.scheme.hash('calibration', min_rounds)
+        elapsed_ms = max((time.perf_counter() - started_at) * 1000, 0.001)
+        extra_rounds = int(math.floor(math.log2(target_ms / elapsed_ms))) if target_ms > elapsed_ms else 0
+        self.scheme.rounds = min(max_rounds, min_rounds + extra_rounds)
+        return self.scheme.rounds
+
+    def hash(self, password):
+        """
+        Returns the hash of password under the current scheme as a str.
+        """
+        return self._submit(lambda: self.scheme.hash(password))
+
+    def _verify_and_update(self, password, hashed):
+        for scheme in self.schemes:
+            if scheme.identify(hashed):
+                if not scheme.verify(password, hashed):
+                    return False, None
+                # The password is known right now, the only time a stored hash can be upgraded
+                return True, self.scheme.hash(password) if scheme.needs_rehash(hashed) else None
+        return False, None
+
+    def verify(self, password, hashed):
+        """
+        Checks password against a stored hash of any supported scheme.
+
+        Returns:
+            tuple: (valid, new_hash). new_hash is set when the password matched a legacy
+                   scheme or a lower bcrypt cost and should replace the stored hash.
+        """
+        if not hashed:
+            return False, None
+        return self._submit(lambda: self._verify_and_update(password, hashed))
+
+    def stats(self):
+        """
+        Returns the call counters, calls in progress and the average and maximum queue wait and hash time in ms.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['completed']
+        return {'admitted': stats['admitted'],
+                'completed': completed,
+                'rejected': stats['rejected'],
+                'timedOut': stats['timedOut'],
+                'inProgress': stats['admitted'] - completed,
+                'workers': self.workers,
+                'bcryptRounds': self.scheme.rounds,
+                'queueSize': self.queue_size,
+                'queueWaitAvgMs': round(stats['queueWaitTotal'] / completed * 1000, 2) if completed else 0.0,
+                'queueWaitMaxMs': round(stats['queueWaitMax'] * 1000, 2),
+                'hashTimeAvgMs': round(stats['hashTimeTotal'] / completed * 1000, 2) if completed else 0.0,
+                'hashTimeMaxMs': round(stats['hashTimeMax'] * 1000, 2)}
+
+
+password_hasher = PasswordHasher(workers=Config.PASSWORD_HASH_WORKERS, queue_size=Config.PASSWORD_HASH_QUEUE_SIZE,
+                                 timeout=Config.PASSWORD_HASH_TIMEOUT,
+                                 rounds=Config.PASSWORD_BCRYPT_ROUNDS or Config.PASSWORD_BCRYPT_MIN_ROUNDS)
@@ -0,0 +1,288 @@
+"""
+Request rate limiting
+
+Every /login attempt costs a database query and a bcrypt check, and a broken
+badge reader can punch the same tag many times a second. The `rate_limit`
+decorator counts requests per client IP, email, user id or badge tag with a
+sliding window: the count of the current RATE_LIMIT_WINDOW plus the previous
+window's count weighted by how much of it still overlaps. A request over a
+limit is answered with 429 and Retry-After from inside the decorator, before
+the route touches the database or the hashing pool. The rules of a request
+are checked together and a request rejected by any of them is counted by none,
+so a client that backs off gets through again and guessing at one email does
+not use up the budget of the address it comes from.
+
+The client IP is the connecting address, which behind a reverse proxy is the
+proxy's own; set PROXY_FIX_X_FOR to the number of proxies to count the client
+from their X-Forwarded-For entries. Clients behind one NAT still share an
+address, so the per-IP limit is set high enough for a shift start and the
+per-email limit is the one that slows down password guessing.
+
+Two stores keep the counters:
+ - MemoryWindowStore: a dict of [window, count, previous count] per key in
+   this process, swept of stale keys every RATE_LIMIT_SWEEP_INTERVAL seconds
+   and capped at RATE_LIMIT_MAX_KEYS.
+ - SharedWindowStore: a fixed table of slots in an mmap'd file (see
+   cache.SharedMemoryFile), so every worker process on the host shares one set of counters.
+   A key lives in one of a few slots after its hash; slots of stale windows are
+   reused, and a full neighbourhood gives up its oldest slot.
+
+Classes:
+ - MemoryWindowStore: Per-process counters.
+ - SharedWindowStore: Counters shared by the processes of one host.
+
+Functions:
+ - rate_limit(scope, *rules, methods=None): Route decorator applying (key, config name) rules.
+ - create_store(config): Returns the store selected by RATE_LIMIT_BACKEND.
+
+Objects:
+ - rate_limiter: The store shared by the application.
+"""
+import hashlib
+import math
+import struct
+import threading
+import time
+from functools import wraps
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from .config import Config
+from .cache import SharedMemoryFile, shared_path
+
+
+def _window_state(window, count, previous, now, window_seconds):
+    """
+    Moves (window, count, previous) of a key to the window of `now`.
+    """
+    current = int(now // window_seconds)
+    if window == current:
+        return current, count, previous
+    if window == current - 1:
+        return current, 0, count
+    return current, 0, 0
+
+
+def _check(count, previous, now, window_seconds, limit):
+    """
+    Returns (allowed, retry after in seconds) for one more request on top of count and previous.
+    """
+    elapsed = (now % window_seconds) / window_seconds
+    if previous * (1 - elapsed) + count + 1 <= limit:
+        return True, 0
+    if count + 1 > limit:
+        # Only the next window makes room, once this window's count has shrunk enough as its previous one
+        wait = window_seconds * ((1 - elapsed) + max(0.0, 1 - (limit - 1) / count))
+    else:
+        # The previous window's share shrinks as time passes, wait until it leaves room
+        wait = window_seconds * ((1 - (limit - count - 1) / previous) - elapsed)
+    return False, max(1, int(math.ceil(wait)))
+
+
+class MemoryWindowStore:
+    """
+    Sliding window counters in a dict of this process.
+    """
+    backend = 'memory'
+
+    def __init__(self, window_seconds, max_keys, sweep_interval):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._counters = {}  # key -> [window, count, previous count]
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + sweep_interval
+        self._stats = {'allowed': 0, 'rejected': 0, 'evictions': 0}
+
+    def _sweep(self, now):
+        current = int(now // self.window_seconds)
+        for key in [key for key, state in self._counters.items() if state[0] < current - 1]:
+            del self._counters[key]
+        self._next_sweep = now + self.sweep_interval
+
+    def hit(self, rules):
+        """
+        Counts one request for every (key, limit) of rules, or for none if it would exceed one of the limits.
+
+        Returns:
+            tuple: (allowed, retry after in seconds).
+        """
+        now = time.time()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            states, retry_after = [], 0
+            for key, limit in rules:
+                window, count, previous = _window_state(*(self._counters.get(key) or (0, 0, 0)), now, self.window_seconds)
+                retry_after = max(retry_after, _check(count, previous, now, self.window_seconds, limit)[1])
+                states.append((key, window, count, previous))
+            # A rejected request counts for none of the rules, not even those it passed
+            allowed = retry_after == 0
+            for key, window, count, previous in states:
+                if key not in self._counters and len(self._counters) >= self.max_keys:
+                    # Full of live keys, make room by dropping the one seen first
+                    del self._counters[next(iter(self._counters))]
+                    self._stats['evictions'] += 1
+                self._counters[key] = [window, count + 1 if allowed else count, previous]
+            self._stats['allowed' if allowed else 'rejected'] += 1
+            return allowed, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, backend=self.backend, keys=len(self._counters), windowSeconds=self.window_seconds)
+
+
+class SharedWindowStore:
+    """
+    Sliding window counters in a SharedMemoryFile used by the worker processes of a host.
+
+    The file holds `slots` slots of (key hash, window, count, previous count).
+    A key is stored in one of the PROBE_LENGTH slots after its hash.
+    """
+    backend = 'shared'
+    MAGIC = b'TCRL0001'
+    SLOT = struct.Struct('<QqII')
+    PROBE_LENGTH = 8
+
+    def __init__(self, path, slots, window_seconds):
+        self.path = path
+        self.slots = slots
+        self.window_seconds = window_seconds
+        self._file = SharedMemoryFile(path, self.MAGIC, slots, slots * self.SLOT.size)
+        self._map = self._file.data
+        self._locked = self._file.locked
+        self._stats = {'allowed': 0, 'rejected': 0, 'evictions': 0}
+
+    @staticmethod
+    def _hash(key):
+        # 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    def _offset(self, slot):
+        return slot * self.SLOT.size
+
+    def _find_slot(self, key_hash, current):
+        """
+        Returns (offset, state) of the key's slot, claiming a free, stale or the oldest slot for a new key.
+        """
+        start = key_hash % self.slots
+        free = oldest = None
+        for probe in range(self.PROBE_LENGTH):
+            offset = self._offset((start + probe) % self.slots)
+            slot_hash, window, count, previous = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, (window, count, previous)
+            if free is None and (slot_hash == 0 or window < current - 1):
+                free = offset
+            if oldest is None or window < oldest[1]:
+                oldest = (offset, window)
+        if free is None:
+            free = oldest[0]
+            self._stats['evictions'] += 1
+        return free, (0, 0, 0)
+
+    def hit(self, rules):
+        """
+        Counts one request for every (key, limit) of rules, or for none if it would exceed one of the limits.
+
+        Returns:
+            tuple: (allowed, retry after in seconds).
+        """
+        now = time.time()
+        current = int(now // self.window_seconds)
+        with self._locked():
+            states, retry_after = [], 0
+            for key, limit in rules:
+                key_hash = self._hash(key)
+                offset, state = self._find_slot(key_hash, current)
+                window, count, previous = _window_state(*state, now, self.window_seconds)
+                retry_after = max(retry_after, _check(count, previous, now, self.window_seconds, limit)[1])
+                # Claim the slot now, so the next rule's key does not take it
+                self.SLOT.pack_into(self._map, offset, key_hash, window, count, previous)
+                states.append((offset, key_hash, window, count, previous))
+            # A rejected request counts for none of the rules, not even those it passed
+            allowed = retry_after == 0
+            if allowed:
+                for offset, key_hash, window, count, previous in states:
+                    self.SLOT.pack_into(self._map, offset, key_hash, window, count + 1, previous)
+            self._stats['allowed' if allowed else 'rejected'] += 1
+            return allowed, retry_after
+
+    def clear(self):
+        with self._locked():
+            self._map[:] = bytes(self.slots * self.SLOT.size)
+
+    def stats(self):
+        current = int(time.time() // self.window_seconds)
+        with self._locked():
+            keys = sum(1 for slot_hash, window, _, _ in self.SLOT.iter_unpack(self._map)
+                       if slot_hash and window >= current - 1)
+            return dict(self._stats, backend=self.backend, keys=keys, slots=self.slots, path=self.path,
+                        windowSeconds=self.window_seconds)
+
+
+def create_store(config):
+    """
+    Returns the store selected by RATE_LIMIT_BACKEND ('memory' or 'shared').
+    """
+    if config.RATE_LIMIT_BACKEND == 'shared':
+        path = config.RATE_LIMIT_SHARED_PATH or shared_path('ratelimit')
+        return SharedWindowStore(path, config.RATE_LIMIT_SHARED_SLOTS, config.RATE_LIMIT_WINDOW)
+    if config.RATE_LIMIT_BACKEND != 'memory':
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {config.RATE_LIMIT_BACKEND}")
+    return MemoryWindowStore(config.RATE_LIMIT_WINDOW, config.RATE_LIMIT_MAX_KEYS, config.RATE_LIMIT_SWEEP_INTERVAL)
+
+
+rate_limiter = create_store(Config)
+
+
+def _request_email():
+    data = request.get_json(silent=True) if request.is_json else None
+    email = data.get('email') if isinstance(data, dict) else request.form.get('email')
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def _current_user_id():
+    return current_user.id if current_user.is_authenticated else None
+
+
+# What a rule can count requests by, None skips the rule for the request
+KEY_FUNCTIONS = {
+    'ip': lambda: request.remote_addr,
+    'email': _request_email,
+    'user': _current_user_id,
+    'tag': lambda: (request.view_args or {}).get('tag_num'),
+}
+
+
+def rate_limit(scope, *rules, methods=None):
+    """
+    Limits the route per rule, each a (key, config name) pair such as ('ip', 'RATE_LIMIT_LOGIN_PER_IP').
+    The config value is the number of requests allowed per RATE_LIMIT_WINDOW, 0 disables the rule.
+    Only requests with one of `methods` are counted when it is given.
+    """
+    for key, _ in rules:
+        if key not in KEY_FUNCTIONS:
+            raise ValueError(f"Unknown rate limit key: {key}")
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_app.config['RATE_LIMIT_ENABLED'] and (methods is None or request.method in methods):
+                limits = []
+                for key, config_name in rules:
+                    limit = current_app.config[config_name]
+                    value = KEY_FUNCTIONS[key]()
+                    if limit and value is not None:
+                        limits.append((f"{scope}:{key}:{value}", limit))
+                allowed, retry_after = rate_limiter.hit(limits) if limits else (True, 0)
+                if not allowed:
+                    response = jsonify({"message": "Too many requests, try again later"})
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response, 429
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,158 @@
+"""
+Payroll period reports
+
+The sessions overlapping a period are read in one streamed query, turned into
+NumPy arrays chunk by chunk and aggregated with vectorized group-bys, so the
+report costs one pass over the period's sessions for the whole headcount.
+
+Functions:
+ - aggregate_payroll(user_ids, starts, stops, breaks, first_day, last_day, overtime_seconds): Vectorized per-user totals.
+ - get_payroll_report(): Returns gross time, break time, overtime and days worked per user for a period.
+"""
+from datetime import datetime, time, timedelta
+import numpy as np
+from flask import jsonify, request, current_app
+from .repositories import get_repository
+from .utils import parse_date, format_seconds
+
+ONE_SECOND = np.timedelta64(1, 's')
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def aggregate_payroll(user_ids, starts, stops, breaks, first_day, last_day, overtime_seconds):
+    """
+    Aggregates session intervals into per-user payroll figures.
+
+    Sessions are clipped to the period and split at midnight, so daily overtime
+    and days worked count the part of a night shift that falls on each day.
+
+    Parameters:
+        user_ids (ndarray): Index of each session's user in the report, int64.
+        starts, stops (ndarray): Session start and stop, datetime64[s].
+        breaks (ndarray): Break seconds of each session, counted on the day the session starts.
+        first_day, last_day (date): The period, both days included.
+        overtime_seconds (int): Seconds per day above which time counts as overtime.
+
+    Returns:
+        tuple: (gross, breaks, overtime, days_worked) arrays indexed by user, sized by the largest user index + 1.
+    """
+    n_days = (last_day - first_day).days + 1
+    period_start = np.datetime64(first_day, 'D').astype('datetime64[s]')
+    period_stop = period_start + n_days * ONE_DAY
+    n_users = int(user_ids.max()) + 1 if user_ids.size else 0
+
+    # Breaks belong to the day the session started, only when that day is in the period
+    break_seconds = np.bincount(
+        user_ids, weights=np.where((starts >= period_start) & (starts < period_stop), breaks, 0), minlength=n_users
+    )
+
+    # Clip every session to the period
+    starts = np.maximum(starts, period_start)
+    stops = np.minimum(stops, period_stop)
+    valid = stops > starts
+    user_ids, starts, stops = user_ids[valid], starts[valid], stops[valid]
+
+    # Split each session into one segment per calendar day it touches
+    first_days = starts.astype('datetime64[D]')
+    spans = ((stops - ONE_SECOND).astype('datetime64[D]') - first_days).astype(np.int64) + 1
+    session_index = np.repeat(np.arange(spans.size), spans)
+    day_offset = np.arange(session_index.size) - np.repeat(np.cumsum(spans) - spans, spans)
+    segment_days = first_days[session_index] + day_offset
+    segment_seconds = (
+        np.minimum(stops[session_index], (segment_days + 1).astype('datetime64[s]'))
+        - np.maximum(starts[session_index], segment_days.astype('datetime64[s]'))
+    ).astype(np.int64)
+
+    # Group by (user, day) into a users x days matrix
+    day_index = (segment_days - np.datetime64(first_day, 'D')).astype(np.int64)
+    daily = np.bincount(
+        user_ids[session_index] * n_days + day_index, weights=segment_seconds, minlength=n_users * n_days
+    ).reshape(n_users, n_days)
+
+    gross = daily.sum(axis=1)
+    overtime = np.clip(daily - overtime_seconds, 0, None).sum(axis=1)
+    days_worked = np.count_nonzero(daily, axis=1)
+
+    return gross.astype(np.int64), break_seconds.astype(np.int64), overtime.astype(np.int64), days_worked
+
+
+def _read_intervals(repo, period_start, period_stop, chunk_size):
+    """
+    Streams the sessions overlapping the period into (user_id, start, stop, break) arrays.
+    """
+    user_ids, starts, stops, breaks = [], [], [], []
+    for rows in repo.sessions.iter_intervals(period_start, period_stop, chunk_size):
+        columns = list(zip(*rows))
+        user_ids.append(np.array(columns[0], dtype=np.int64))
+        starts.append(np.array(columns[1], dtype='datetime64[s]'))
+        stops.append(np.array(columns[2], dtype='datetime64[s]'))
+        breaks.append(np.array(columns[3], dtype=np.int64) * 60)  # OnlineTime.breakTime is in minutes
+    if not user_ids:
+        return (np.empty(0, np.int64), np.empty(0, 'datetime64[s]'),
+                np.empty(0, 'datetime64[s]'), np.empty(0, np.int64))
+    return np.concatenate(user_ids), np.concatenate(starts), np.concatenate(stops), np.concatenate(breaks)
+
+
+def get_payroll_report():
+    """
+    Returns gross time, break time, overtime and days worked per user between the 'from' and 'to' dates.
+    :return: JSON response and status code.
+    """
+    first_day = parse_date(request.args.get('from'))
+    last_day = parse_date(request.args.get('to'))
+    if first_day is None or last_day is None:
+        return jsonify({"message": "Invalid from/to format. Expected YYYY-MM-DD."}), 400
+    if first_day > last_day:
+        return jsonify({"message": "from must not be after to"}), 400
+    if (last_day - first_day).days + 1 > current_app.config['PAYROLL_MAX_DAYS']:
+        return jsonify({"message": f"Period too long, at most {current_app.config['PAYROLL_MAX_DAYS']} days"}), 400
+    try:
+        overtime_hours = float(request.args.get('overtime', current_app.config['PAYROLL_OVERTIME_HOURS_PER_DAY']))
+    except ValueError:
+        return jsonify({"message": "Invalid overtime, expected hours per day"}), 400
+    if not 0 <= overtime_hours <= 24:
+        return jsonify({"message": "Invalid overtime, expected 0 to 24 hours per day"}), 400
+    overtime_seconds = int(overtime_hours * 3600)
+
+    repo = get_repository()
+    if not repo:
+        return jsonify({"message": "Database connection failed"}), 500
+
+    period_start = datetime.combine(first_day, time.min)
+    period_stop = datetime.combine(last_day + timedelta(days=1), time.min)
+    session_users, starts, stops, breaks = _read_intervals(
+        repo, period_start, period_stop, current_app.config['STREAM_FETCH_SIZE']
+    )
+
+    # Every user is reported, map session user ids onto the sorted user list
+    users = repo.users.list()
+    report_ids = np.array([row[0] for row in users], dtype=np.int64)
+    order = np.argsort(report_ids)
+    report_ids = report_ids[order]
+    positions = np.searchsorted(report_ids, session_users)
+    known = positions < report_ids.size
+    known[known] = report_ids[positions[known]] == session_users[known]  # drop sessions of deleted users
+
+    gross, break_seconds, overtime, days_worked = aggregate_payroll(
+        positions[known], starts[known], stops[known], breaks[known], first_day, last_day, overtime_seconds
+    )
+    n_users = report_ids.size
+    gross, break_seconds, overtime, days_worked = (
+        np.pad(values, (0, n_users - values.size)) for values in (gross, break_seconds, overtime, days_worked)
+    )
+
+    payroll = []
+    for position, index in enumerate(order.tolist()):
+        row = users[index]
+        payroll.append({'user_id': row[0],
+                        'firstName': row[1],
+                        'lastName': row[2],
+                        'grossTime': format_seconds(gross[position]),
+                        'grossSeconds': int(gross[position]),
+                        'breakTime': format_seconds(break_seconds[position]),
+                        'breakSeconds': int(break_seconds[position]),
+                        'overtime': format_seconds(overtime[position]),
+                        'overtimeSeconds': int(overtime[position]),
+                        'daysWorked': int(days_worked[position])})
+    return jsonify({"from": first_day.isoformat(), "to": last_day.isoformat(),
+                    "overtimeThreshold": format_seconds(overtime_seconds), "data": payroll}), 200
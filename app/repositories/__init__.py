@@ -0,0 +1,52 @@
+"""
+Repository layer
+
+All data access goes through the repositories of the configured storage
+backend (Config.DATABASE_BACKEND): 'mysql' for the pooled MySQL server or
+'sqlite' for an embedded SQLite file.
+
+Functions:
+ - init_repository(app): Sets up the configured backend for the app.
+ - get_repository(): Returns the repositories bound to the current request's connection.
+"""
+from flask import current_app, g
+from .base import DuplicateKeyError, Repository
+from .mysqlRepository import MySQLRepository
+from .sqliteRepository import SQLiteRepository
+
+BACKENDS = {
+    'mysql': MySQLRepository,
+    'sqlite': SQLiteRepository,
+}
+
+
+def init_repository(app):
+    """
+    Initializes the storage backend named by DATABASE_BACKEND.
+    """
+    backend = app.config.get('DATABASE_BACKEND', 'mysql')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown DATABASE_BACKEND: {backend}")
+    app.extensions['repository'] = BACKENDS[backend]
+    BACKENDS[backend].init_app(app)
+    app.teardown_appcontext(close_repository)
+
+
+def get_repository():
+    """
+    Returns the repositories bound to the current app context.
+
+    Returns:
+        Repository: The repositories, or None if no database connection is available.
+    """
+    if 'repository' not in g:
+        repository = current_app.extensions['repository'].open()
+        if repository is None:
+            return None
+        g.repository = repository
+    return g.repository
+
+
+def close_repository(exception=None):
+    # The connection behind it is released by the backend's own teardown handler
+    g.pop('repository', None)
@@ -0,0 +1,792 @@
+"""
+Storage-independent data access
+
+The repositories hold every query of the application. They are written once
+against the Database interface below; the MySQL and SQLite backends only
+supply a Database subclass for their driver and override the few queries
+that have a better dialect-specific form. Values MySQL used to compute in
+SQL (NOW(), TIMESTAMPDIFF, SHA2) are computed in Python so both backends
+store the same data.
+
+Classes:
+ - Database: Wraps one DB-API connection and hides the driver's differences.
+ - DuplicateKeyError: Raised when a write violates a unique key.
+ - UserRepository, SessionRepository, TotalTimeRepository, RollupRepository, PermissionRepository: The queries per table.
+ - ChangeLogRepository: The trigger-fed change log behind GET /sync.
+ - Repository: Bundles the repositories around one connection.
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from ..rollups import rollup_deltas, week_start
+
+USER_COLUMNS = ('id', 'firstName', 'lastName', 'tagNum', 'email')
+LOGIN_COLUMNS = ('id', 'firstName', 'lastName', 'email', 'permission_id')
+EPOCH = "'1970-01-01 00:00:00'"
+# Tables whose writes are recorded in ChangeLog for GET /sync
+CHANGE_TRACKED_TABLES = ('User', 'OnlineTime', 'TotalTime')
+
+
+class DuplicateKeyError(Exception):
+    """
+    A write violated a unique key.
+
+    Attributes:
+        key (str): Name of the violated key as in the MySQL schema (e.g. uq_User_email), or None if unknown.
+    """
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
+
+
+class Database(ABC):
+    """
+    One connection plus the dialect details the repositories need.
+
+    Queries are written with %s placeholders; sql() rewrites them for drivers
+    that use another paramstyle. Subclasses translate the driver's
+    unique-key errors into DuplicateKeyError in execute() and must implement
+    the abstract dialect methods, or they cannot be instantiated.
+    """
+    placeholder = '%s'
+    lock_clause = ' FOR UPDATE'  # appended to SELECTs that must lock the rows they read
+    now = None  # SQL expression of the current local time
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def sql(self, query):
+        if self.placeholder != '%s':
+            return query.replace('%s', self.placeholder)
+        return query
+
+    def placeholders(self, count):
+        return ', '.join(['%s'] * count)
+
+    @abstractmethod
+    def seconds_between(self, start, stop):
+        """
+        Returns an SQL expression for the whole seconds between two DATETIME expressions.
+        """
+
+    @abstractmethod
+    def upsert_add(self, table, key_columns, value_column):
+        """
+        Returns an INSERT that adds value_column to an existing row with the same key instead of failing.
+        """
+
+    def cursor(self):
+        return self.cnx.cursor()
+
+    def translate_error(self, error):
+        """
+        Returns a DuplicateKeyError for a driver error caused by a unique key, else None.
+        """
+        return None
+
+    def _run(self, cursor, method, query, params):
+        try:
+            return getattr(cursor, method)(self.sql(query), params)
+        except Exception as e:
+            duplicate = self.translate_error(e)
+            if duplicate is not None:
+                raise duplicate from e
+            raise
+
+    def fetchone(self, query, params=()):
+        with self.cursor() as cursor:
+            self._run(cursor, 'execute', query, params)
+            return cursor.fetchone()
+
+    def fetchall(self, query, params=()):
+        with self.cursor() as cursor:
+            self._run(cursor, 'execute', query, params)
+            return cursor.fetchall()
+
+    def execute(self, query, params=()):
+        """
+        Runs a write and returns the number of affected rows.
+        """
+        with self.cursor() as cursor:
+            self._run(cursor, 'execute', query, params)
+            return cursor.rowcount
+
+    def insert(self, query, params=()):
+        """
+        Runs an INSERT and returns the id of the new row.
+        """
+        with self.cursor() as cursor:
+            self._run(cursor, 'execute', query, params)
+            return cursor.lastrowid
+
+    def executemany(self, query, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        if not seq_of_params:
+            return 0
+        with self.cursor() as cursor:
+            self._run(cursor, 'executemany', query, seq_of_params)
+            return cursor.rowcount
+
+    def iter_chunks(self, query, params, size):
+        """
+        Yields the result of a query in lists of at most size rows.
+        """
+        with self.cursor() as cursor:
+            self._run(cursor, 'execute', query, params)
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.cnx.commit()
+
+    def rollback(self):
+        self.cnx.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in one transaction, committing on success and rolling back on any exception.
+        """
+        self.begin()
+        try:
+            yield
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+
+class UserRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def list(self, limit=None, after_id=None):
+        """
+        Returns (id, firstName, lastName, tagNum, email) rows, ordered by id when limit is given.
+        """
+        if limit is None:
+            return self.db.fetchall("SELECT id, firstName, lastName, tagNum, email FROM `User`")
+        if after_id is None:
+            return self.db.fetchall("SELECT id, firstName, lastName, tagNum, email FROM `User` ORDER BY id LIMIT %s", (limit,))
+        return self.db.fetchall(
+            "SELECT id, firstName, lastName, tagNum, email FROM `User` WHERE id > %s ORDER BY id LIMIT %s", (after_id, limit)
+        )
+
+    def sync_rows(self, user_ids=None):
+        """
+        Returns (id, firstName, lastName, tagNum, email, permission_id) rows of the given users, or of all users.
+        """
+        query = "SELECT id, firstName, lastName, tagNum, email, permission_id FROM `User`"
+        if user_ids is None:
+            return self.db.fetchall(query)
+        return self.db.fetchall(query + f" WHERE id IN ({self.db.placeholders(len(user_ids))})", list(user_ids))
+
+    def ids(self):
+        """
+        Returns the ids of all users in ascending order.
+        """
+        return [row[0] for row in self.db.fetchall("SELECT id FROM `User` ORDER BY id")]
+
+    def iter_all(self, chunk_size):
+        return self.db.iter_chunks("SELECT id, firstName, lastName, tagNum, email FROM `User` ORDER BY id", (), chunk_size)
+
+    def get_with_permission(self, user_id):
+        """
+        Returns (id, firstName, lastName, tagNum, email, permission title) or None.
+        """
+        return self.db.fetchone(
+            "SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title FROM `User` "
+            "JOIN Permissions ON `User`.permission_id = Permissions.id WHERE `User`.id = %s", (user_id,)
+        )
+
+    def summary(self, user_id, day):
+        """
+        Returns (id, firstName, lastName, tagNum, email, permission title, open session id, open session start,
+        open session breakTime, seconds completed on day, TotalTime sumSeconds, TotalTime breakTime) or None.
+        Every lookup is a primary or unique key, so this is one round trip of point reads.
+        """
+        return self.db.fetchone(
+            "SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title, "
+            "OnlineTime.id, OnlineTime.dateTimeStart, OnlineTime.breakTime, UserDailyTime.seconds, "
+            "TotalTime.sumSeconds, TotalTime.breakTime FROM `User` "
+            "JOIN Permissions ON `User`.permission_id = Permissions.id "
+            "LEFT JOIN OnlineTime ON OnlineTime.user_id = `User`.id AND OnlineTime.openSession = 1 "
+            "LEFT JOIN UserDailyTime ON UserDailyTime.user_id = `User`.id AND UserDailyTime.day = %s "
+            "LEFT JOIN TotalTime ON TotalTime.user_id = `User`.id "
+            "WHERE `User`.id = %s", (day, user_id)
+        )
+
+    def find_by_name(self, name):
+        return self.db.fetchall(
+            "SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title FROM `User` "
+            "JOIN Permissions ON `User`.permission_id = Permissions.id WHERE firstName = %s OR lastName = %s", (name, name)
+        )
+
+    def get_login(self, user_id):
+        """
+        Returns the columns the login User object needs as a dict, never the password hash.
+        """
+        row = self.db.fetchone("SELECT id, firstName, lastName, email, permission_id FROM `User` WHERE id = %s", (user_id,))
+        return dict(zip(LOGIN_COLUMNS, row)) if row else None
+
+    def get_credentials(self, email):
+        """
+        Returns the login columns plus the stored password hash of the user with this email, or None.
+        """
+        row = self.db.fetchone(
+            "SELECT id, firstName, lastName, email, permission_id, password FROM `User` WHERE email = %s", (email,)
+        )
+        return dict(zip(LOGIN_COLUMNS + ('password',), row)) if row else None
+
+    def create(self, firstName, lastName, tagNum, email, password_hash, permission_title='Standard User'):
+        """
+        Inserts a user and returns its id. Raises DuplicateKeyError for a taken email or tag.
+        """
+        return self.db.insert(
+            "INSERT INTO `User` (firstName, lastName, tagNum, email, password, permission_id) "
+            "VALUES (%s, %s, %s, %s, %s, (SELECT id FROM Permissions WHERE title = %s))",
+            (firstName, lastName, tagNum, email, password_hash, permission_title)
+        )
+
+    UPDATABLE_COLUMNS = ('firstName', 'lastName', 'email', 'password')
+
+    def update(self, user_id, fields):
+        """
+        Updates the given columns of a user and returns the number of matched rows.
+        """
+        columns = [column for column in fields if column in self.UPDATABLE_COLUMNS]
+        if len(columns) != len(fields):
+            raise ValueError(f"Cannot update columns: {set(fields) - set(columns)}")
+        set_clause = ', '.join(f"{column} = %s" for column in columns)
+        return self.db.execute(
+            f"UPDATE `User` SET {set_clause} WHERE id = %s", [fields[column] for column in columns] + [user_id]
+        )
+
+    def replace_password(self, user_id, old_hash, new_hash):
+        """
+        Replaces a stored password hash unless it was changed since old_hash was read, returns the number of updated rows.
+        """
+        return self.db.execute(
+            "UPDATE `User` SET password = %s WHERE id = %s AND password = %s", (new_hash, user_id, old_hash)
+        )
+
+    def delete(self, user_id):
+        """
+        Deletes a user with all their sessions, badge events and totals.
+
+        Returns:
+            bool: False if the user did not exist.
+        """
+        if self.db.fetchone("SELECT id FROM `User` WHERE id = %s" + self.db.lock_clause, (user_id,)) is None:
+            return False
+        self.db.execute("DELETE FROM PunchEvent WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM OnlineTime WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM TotalTime WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM UserDailyTime WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM UserWeeklyTime WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM TotalTimeFingerprint WHERE user_id = %s", (user_id,))
+        self.db.execute("DELETE FROM `User` WHERE id = %s", (user_id,))
+        return True
+
+    def ids_by_tags(self, tags):
+        """
+        Returns {tagNum: user_id} for the tags that belong to a user.
+        """
+        if not tags:
+            return {}
+        rows = self.db.fetchall(
+            f"SELECT tagNum, id FROM `User` WHERE tagNum IN ({self.db.placeholders(len(tags))})", list(tags)
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def tag_entries(self, tag_num=None):
+        """
+        Returns (tagNum, user_id, permission_id, open session id, open since) rows for one tag or all tagged users.
+        """
+        query = (
+            "SELECT `User`.tagNum, `User`.id, `User`.permission_id, OnlineTime.id, OnlineTime.dateTimeStart "
+            "FROM `User` LEFT JOIN OnlineTime ON OnlineTime.user_id = `User`.id AND OnlineTime.openSession = 1 "
+        )
+        if tag_num is None:
+            return self.db.fetchall(query + "WHERE `User`.tagNum IS NOT NULL")
+        return self.db.fetchall(query + "WHERE `User`.tagNum = %s", (tag_num,))
+
+
+class SessionRepository:
+    def __init__(self, db):
+        self.db = db
+
+    LIST_QUERY = (
+        "SELECT `User`.id, firstName, lastName, dateTimeStart, dateTimeStop, breakTime, OnlineTime.id "
+        "FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id"
+    )
+
+    def list(self, limit=None, after=None):
+        """
+        Returns (user id, firstName, lastName, dateTimeStart, dateTimeStop, breakTime, session id) rows,
+        ordered by (dateTimeStart, session id) when limit is given.
+        """
+        if limit is None:
+            return self.db.fetchall(self.LIST_QUERY)
+        if after is None:
+            return self.db.fetchall(self.LIST_QUERY + " ORDER BY dateTimeStart, OnlineTime.id LIMIT %s", (limit,))
+        # Seek past the last (dateTimeStart, id) of the previous page instead of using OFFSET
+        return self.db.fetchall(
+            self.LIST_QUERY + " WHERE dateTimeStart > %s OR (dateTimeStart = %s AND OnlineTime.id > %s) "
+            "ORDER BY dateTimeStart, OnlineTime.id LIMIT %s",
+            (after[0], after[0], after[1], limit)
+        )
+
+    def iter_all(self, chunk_size):
+        return self.db.iter_chunks(self.LIST_QUERY + " ORDER BY dateTimeStart, OnlineTime.id", (), chunk_size)
+
+    def iter_intervals(self, period_start, period_stop, chunk_size):
+        """
+        Yields (user_id, dateTimeStart, dateTimeStop, break minutes) of the completed sessions overlapping a period in chunks.
+        """
+        return self.db.iter_chunks(
+            "SELECT user_id, dateTimeStart, dateTimeStop, COALESCE(breakTime, 0) FROM OnlineTime "
+            "WHERE dateTimeStart < %s AND dateTimeStop > %s",
+            (period_stop, period_start), chunk_size
+        )
+
+    def list_for_user(self, user_id):
+        """
+        Returns (firstName, lastName, dateTimeStart, dateTimeStop, breakTime) rows of one user.
+        """
+        return self.db.fetchall(
+            "SELECT firstName, lastName, dateTimeStart, dateTimeStop, breakTime "
+            "FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id WHERE user_id = %s", (user_id,)
+        )
+
+    def open(self, user_id, date_time_start):
+        """
+        Opens a session and returns its id. Raises DuplicateKeyError if the user already has an open session.
+        """
+        return self.db.insert("INSERT INTO OnlineTime (dateTimeStart, user_id) VALUES (%s, %s)", (date_time_start, user_id))
+
+    def sync_rows(self, session_ids=None):
+        """
+        Returns (id, user_id, dateTimeStart, dateTimeStop, breakTime) rows of the given sessions, or of all sessions.
+        """
+        query = "SELECT id, user_id, dateTimeStart, dateTimeStop, breakTime FROM OnlineTime"
+        if session_ids is None:
+            return self.db.fetchall(query)
+        return self.db.fetchall(query + f" WHERE id IN ({self.db.placeholders(len(session_ids))})", list(session_ids))
+
+    def list_open(self):
+        """
+        Returns (session id, user id, firstName, lastName, dateTimeStart) of every open session.
+        """
+        return self.db.fetchall(
+            "SELECT OnlineTime.id, user_id, firstName, lastName, dateTimeStart "
+            "FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id WHERE openSession = 1 ORDER BY dateTimeStart"
+        )
+
+    def lock_open(self, user_id):
+        """
+        Locks and returns (session id, dateTimeStart, breakTime, firstName, lastName) of the user's open session, or None.
+        """
+        return self.db.fetchone(
+            "SELECT OnlineTime.id, dateTimeStart, breakTime, firstName, lastName "
+            "FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id "
+            "WHERE user_id = %s AND openSession = 1" + self.db.lock_clause, (user_id,)
+        )
+
+    def close(self, session_id, user_id, date_time_stop, seconds):
+        """
+        Closes an open session and adds its length to the user's TotalTime.
+
+        Returns:
+            bool: False, with nothing changed, if the session was not open anymore or the user has no TotalTime row.
+        """
+        # Like the MySQL multi-table UPDATE, a missing TotalTime row leaves the session open
+        if not self.db.execute(
+            "UPDATE OnlineTime SET dateTimeStop = %s WHERE id = %s AND dateTimeStop IS NULL "
+            "AND EXISTS (SELECT 1 FROM TotalTime WHERE user_id = %s)", (date_time_stop, session_id, user_id)
+        ):
+            return False
+        self.db.execute("UPDATE TotalTime SET sumSeconds = sumSeconds + %s WHERE user_id = %s", (seconds, user_id))
+        return True
+
+    def lock_by_stop(self, user_id, date_time_stop):
+        """
+        Locks and returns (session id, dateTimeStart, dateTimeStop) of the user's sessions that ended at date_time_stop.
+        """
+        return self.db.fetchall(
+            "SELECT id, dateTimeStart, dateTimeStop FROM OnlineTime WHERE user_id = %s AND dateTimeStop = %s" + self.db.lock_clause,
+            (user_id, date_time_stop)
+        )
+
+    def update_times(self, session_ids, date_time_start=None, date_time_stop=None):
+        fields = {'dateTimeStart': date_time_start, 'dateTimeStop': date_time_stop}
+        columns = [column for column, value in fields.items() if value is not None]
+        set_clause = ', '.join(f"{column} = %s" for column in columns)
+        return self.db.execute(
+            f"UPDATE OnlineTime SET {set_clause} WHERE id IN ({self.db.placeholders(len(session_ids))})",
+            [fields[column] for column in columns] + list(session_ids)
+        )
+
+    def delete(self, session_ids):
+        return self.db.execute(
+            f"DELETE FROM OnlineTime WHERE id IN ({self.db.placeholders(len(session_ids))})", list(session_ids)
+        )
+
+    def lock_open_for_users(self, user_ids):
+        """
+        Locks the open sessions of several users and returns {user_id: (session id, dateTimeStart)}.
+        """
+        rows = self.db.fetchall(
+            f"SELECT user_id, id, dateTimeStart FROM OnlineTime WHERE user_id IN ({self.db.placeholders(len(user_ids))}) "
+            "AND openSession = 1" + self.db.lock_clause,
+            list(user_ids)
+        )
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def close_many(self, stops):
+        """
+        Closes sessions from (dateTimeStop, session id) pairs.
+        """
+        return self.db.executemany("UPDATE OnlineTime SET dateTimeStop = %s WHERE id = %s", stops)
+
+    def insert_many(self, sessions):
+        """
+        Inserts sessions from (dateTimeStart, dateTimeStop, user_id) tuples.
+        """
+        return self.db.executemany("INSERT INTO OnlineTime (dateTimeStart, dateTimeStop, user_id) VALUES (%s, %s, %s)", sessions)
+
+    def ids_by_start(self, sessions):
+        """
+        Returns {(user_id, dateTimeStart): session id} for (dateTimeStart, dateTimeStop, user_id) tuples,
+        the newest session where a user has several starting at the same time.
+        """
+        user_ids = sorted({session[2] for session in sessions})
+        starts = sorted({session[0] for session in sessions})
+        rows = self.db.fetchall(
+            f"SELECT user_id, dateTimeStart, id FROM OnlineTime WHERE user_id IN ({self.db.placeholders(len(user_ids))}) "
+            f"AND dateTimeStart IN ({self.db.placeholders(len(starts))}) ORDER BY id",
+            user_ids + starts
+        )
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def existing_event_keys(self, keys):
+        """
+        Returns the subset of badge event keys that were already applied.
+        """
+        if not keys:
+            return set()
+        rows = self.db.fetchall(
+            f"SELECT eventKey FROM PunchEvent WHERE eventKey IN ({self.db.placeholders(len(keys))})", list(keys)
+        )
+        return {row[0] for row in rows}
+
+    def record_events(self, events):
+        """
+        Records applied badge events from (eventKey, user_id, eventTime, direction) tuples.
+        """
+        return self.db.executemany(
+            "INSERT INTO PunchEvent (eventKey, user_id, eventTime, direction) VALUES (%s, %s, %s, %s)", events
+        )
+
+
+class TotalTimeRepository:
+    def __init__(self, db):
+        self.db = db
+
+    LIST_QUERY = (
+        "SELECT `User`.id, firstName, lastName, sumSeconds, breakTime "
+        "FROM TotalTime JOIN `User` ON TotalTime.user_id = `User`.id"
+    )
+
+    def create(self, user_id):
+        self.db.execute("INSERT INTO TotalTime (sumSeconds, breakTime, user_id) VALUES (0, '00:00:00', %s)", (user_id,))
+
+    def list(self, limit=None, after_id=None):
+        """
+        Returns (user id, firstName, lastName, sumSeconds, breakTime) rows, ordered by user id when limit is given.
+        """
+        if limit is None:
+            return self.db.fetchall(self.LIST_QUERY)
+        if after_id is None:
+            return self.db.fetchall(self.LIST_QUERY + " ORDER BY TotalTime.user_id LIMIT %s", (limit,))
+        return self.db.fetchall(
+            self.LIST_QUERY + " WHERE TotalTime.user_id > %s ORDER BY TotalTime.user_id LIMIT %s", (after_id, limit)
+        )
+
+    def iter_all(self, chunk_size):
+        return self.db.iter_chunks(self.LIST_QUERY + " ORDER BY TotalTime.user_id", (), chunk_size)
+
+    def list_for_user(self, user_id):
+        return self.db.fetchall(self.LIST_QUERY + " WHERE `User`.id = %s", (user_id,))
+
+    def add(self, user_id, seconds):
+        """
+        Adds seconds (may be negative) to the user's total.
+        """
+        if seconds:
+            self.db.execute("UPDATE TotalTime SET sumSeconds = sumSeconds + %s WHERE user_id = %s", (seconds, user_id))
+
+    def add_many(self, deltas):
+        """
+        Applies (seconds, user_id) deltas.
+        """
+        return self.db.executemany("UPDATE TotalTime SET sumSeconds = sumSeconds + %s WHERE user_id = %s", deltas)
+
+    def recompute(self, user_id):
+        """
+        Repair job: rebuilds a user's total from all of their completed sessions.
+        """
+        return self.db.execute(
+            "UPDATE TotalTime SET sumSeconds = ("
+            f"SELECT COALESCE(SUM({self.db.seconds_between('dateTimeStart', 'dateTimeStop')}), 0) "
+            "FROM OnlineTime WHERE user_id = %s AND dateTimeStop IS NOT NULL) WHERE user_id = %s",
+            (user_id, user_id)
+        )
+
+    def sync_rows(self, total_ids=None):
+        """
+        Returns (id, user_id, sumSeconds, breakTime) rows of the given TotalTime ids, or of all of them.
+        """
+        query = "SELECT id, user_id, sumSeconds, breakTime FROM TotalTime"
+        if total_ids is None:
+            return self.db.fetchall(query)
+        return self.db.fetchall(query + f" WHERE id IN ({self.db.placeholders(len(total_ids))})", list(total_ids))
+
+    def lock_users(self, user_ids):
+        """
+        Locks the TotalTime rows of several users, so punches wait until a bulk recompute commits.
+        """
+        return self.db.fetchall(
+            f"SELECT user_id FROM TotalTime WHERE user_id IN ({self.db.placeholders(len(user_ids))})" + self.db.lock_clause,
+            list(user_ids)
+        )
+
+    def fingerprints(self, user_ids):
+        """
+        Computes the totals of several users with one grouped query.
+
+        Returns:
+            dict: {user_id: (session count, total seconds, sum of start offsets)} of the users with completed sessions.
+                  The three values change whenever a completed session is added, edited or deleted.
+        """
+        rows = self.db.fetchall(
+            "SELECT user_id, COUNT(*), "
+            f"SUM({self.db.seconds_between('dateTimeStart', 'dateTimeStop')}), "
+            f"SUM({self.db.seconds_between(EPOCH, 'dateTimeStart')}) "
+            f"FROM OnlineTime WHERE user_id IN ({self.db.placeholders(len(user_ids))}) AND dateTimeStop IS NOT NULL "
+            "GROUP BY user_id",
+            list(user_ids)
+        )
+        return {row[0]: (int(row[1]), int(row[2]), int(row[3])) for row in rows}
+
+    def stored_fingerprints(self, user_ids):
+        """
+        Returns {user_id: (session count, total seconds, sum of start offsets)} as saved by the last recompute.
+        """
+        rows = self.db.fetchall(
+            "SELECT user_id, sessionCount, sessionSeconds, startSeconds FROM TotalTimeFingerprint "
+            f"WHERE user_id IN ({self.db.placeholders(len(user_ids))})",
+            list(user_ids)
+        )
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def save_fingerprints(self, fingerprints, checked_at):
+        """
+        Replaces the saved fingerprints of the given users, from {user_id: (count, seconds, start offsets)}.
+        """
+        if not fingerprints:
+            return
+        self.db.execute(
+            f"DELETE FROM TotalTimeFingerprint WHERE user_id IN ({self.db.placeholders(len(fingerprints))})",
+            list(fingerprints)
+        )
+        self.db.executemany(
+            "INSERT INTO TotalTimeFingerprint (user_id, sessionCount, sessionSeconds, startSeconds, checkedAt) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [(user_id,) + values + (checked_at,) for user_id, values in fingerprints.items()]
+        )
+
+    def set_many(self, totals):
+        """
+        Overwrites totals from (seconds, user_id) pairs.
+        """
+        return self.db.executemany("UPDATE TotalTime SET sumSeconds = %s WHERE user_id = %s", totals)
+
+
+class RollupRepository:
+    """
+    Per-user daily (UserDailyTime) and ISO-week (UserWeeklyTime) totals of completed sessions.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def apply(self, added=(), removed=()):
+        """
+        Adds the seconds of sessions that now count and subtracts those of sessions that no longer do.
+
+        Parameters:
+            added (iterable): (user_id, dateTimeStart, dateTimeStop) of closed or edited sessions.
+            removed (iterable): (user_id, dateTimeStart, dateTimeStop) of deleted sessions or the old times of edited ones.
+        """
+        daily, weekly = rollup_deltas(added, removed)
+        self.db.executemany(
+            self.db.upsert_add('UserDailyTime', ('user_id', 'day'), 'seconds'),
+            [(user_id, day, seconds) for (user_id, day), seconds in daily.items()]
+        )
+        self.db.executemany(
+            self.db.upsert_add('UserWeeklyTime', ('user_id', 'weekStart'), 'seconds'),
+            [(user_id, start, seconds) for (user_id, start), seconds in weekly.items()]
+        )
+
+    def rebuild(self, user_ids):
+        """
+        Repair job: rebuilds the rollups of several users from all of their completed sessions.
+        """
+        if not user_ids:
+            return
+        in_clause = f"user_id IN ({self.db.placeholders(len(user_ids))})"
+        self.db.execute(f"DELETE FROM UserDailyTime WHERE {in_clause}", list(user_ids))
+        self.db.execute(f"DELETE FROM UserWeeklyTime WHERE {in_clause}", list(user_ids))
+        rows = self.db.fetchall(
+            f"SELECT user_id, dateTimeStart, dateTimeStop FROM OnlineTime WHERE {in_clause} AND dateTimeStop IS NOT NULL",
+            list(user_ids)
+        )
+        self.apply(added=rows)
+
+    def _range(self, table, column, first, last, user_id):
+        query = (
+            f"SELECT `User`.id, firstName, lastName, {table}.{column}, {table}.seconds "
+            f"FROM {table} JOIN `User` ON {table}.user_id = `User`.id "
+            f"WHERE {table}.{column} BETWEEN %s AND %s AND {table}.seconds <> 0"
+        )
+        params = [first, last]
+        if user_id is not None:
+            query += f" AND {table}.user_id = %s"
+            params.append(user_id)
+        return self.db.fetchall(query + f" ORDER BY {table}.user_id, {table}.{column}", params)
+
+    def daily(self, first_day, last_day, user_id=None):
+        """
+        Returns (user id, firstName, lastName, day, seconds) rows for the days from first_day to last_day.
+        """
+        return self._range('UserDailyTime', 'day', first_day, last_day, user_id)
+
+    def weekly(self, first_day, last_day, user_id=None):
+        """
+        Returns (user id, firstName, lastName, weekStart, seconds) rows for every ISO week touching the range.
+        """
+        return self._range('UserWeeklyTime', 'weekStart', week_start(first_day), last_day, user_id)
+
+
+class ChangeLogRepository:
+    """
+    ChangeLog rows are written by triggers on the tracked tables, one per inserted, updated or deleted row.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def since(self, version, limit):
+        """
+        Returns (version, tableName, rowId, operation, age in seconds) of the changes after version, oldest first.
+        """
+        return self.db.fetchall(
+            f"SELECT version, tableName, rowId, operation, {self.db.seconds_between('changedAt', self.db.now)} "
+            "FROM ChangeLog WHERE version > %s ORDER BY version LIMIT %s",
+            (version, limit)
+        )
+
+    def bounds(self):
+        """
+        Returns (oldest retained version, latest version), both 0 while the log is empty.
+        """
+        row = self.db.fetchone("SELECT COALESCE(MIN(version), 0), COALESCE(MAX(version), 0) FROM ChangeLog")
+        return int(row[0]), int(row[1])
+
+    def settled_version(self, settle_seconds):
+        """
+        Returns the version of the newest change at least settle_seconds old.
+        The log is read newest first, so only the recent changes are scanned.
+        """
+        row = self.db.fetchone(
+            f"SELECT version FROM ChangeLog WHERE {self.db.seconds_between('changedAt', self.db.now)} >= %s "
+            "ORDER BY version DESC LIMIT 1",
+            (settle_seconds,)
+        )
+        if row is None:
+            # Every retained change is recent, the ones before them were pruned long ago
+            oldest, _ = self.bounds()
+            return max(oldest - 1, 0)
+        return int(row[0])
+
+    def latest(self, table):
+        """
+        Returns (version, age in seconds) of the table's latest change.
+
+        A table whose changes were all pruned gets the version before the oldest retained
+        change and no age, so its version never goes back to one an older ETag was built from.
+        """
+        row = self.db.fetchone(
+            f"SELECT version, {self.db.seconds_between('changedAt', self.db.now)} "
+            "FROM ChangeLog WHERE tableName = %s ORDER BY version DESC LIMIT 1",
+            (table,)
+        )
+        if row is None:
+            oldest, _ = self.bounds()
+            return max(oldest - 1, 0), None
+        return int(row[0]), row[1]
+
+    def prune(self, older_than_seconds):
+        """
+        Deletes the changes older than the given age, except the latest one so versions are never reused.
+        """
+        return self.db.execute(
+            f"DELETE FROM ChangeLog WHERE {self.db.seconds_between('changedAt', self.db.now)} > %s "
+            "AND version < (SELECT latest FROM (SELECT MAX(version) AS latest FROM ChangeLog) AS newest)",
+            (older_than_seconds,)
+        )
+
+
+class PermissionRepository:
+    def __init__(self, db):
+        self.db = db
+
+    def list(self):
+        """
+        Returns (permissionLevel, title) rows.
+        """
+        return self.db.fetchall("SELECT permissionLevel, title FROM Permissions")
+
+    def levels(self):
+        """
+        Returns (id, permissionLevel) rows.
+        """
+        return self.db.fetchall("SELECT id, permissionLevel FROM Permissions")
+
+
+class Repository:
+    """
+    The repositories of one request, all sharing the request's connection.
+    """
+    user_class = UserRepository
+    session_class = SessionRepository
+    total_class = TotalTimeRepository
+    rollup_class = RollupRepository
+    permission_class = PermissionRepository
+    change_class = ChangeLogRepository
+
+    def __init__(self, db):
+        self.db = db
+        self.users = self.user_class(db)
+        self.sessions = self.session_class(db)
+        self.totals = self.total_class(db)
+        self.rollups = self.rollup_class(db)
+        self.permissions = self.permission_class(db)
+        self.changes = self.change_class(db)
+
+    def transaction(self):
+        return self.db.transaction()
@@ -0,0 +1,63 @@
+"""
+MySQL storage backend
+
+Uses the pooled per-request connection from mysqlConnector.
+
+Classes:
+ - MySQLDatabase: Database for mysql.connector connections.
+ - MySQLSessionRepository: Closes a session and updates TotalTime in a single multi-table UPDATE.
+ - MySQLRepository: The repositories on top of MySQL.
+"""
+import re
+from mysql.connector import IntegrityError, errorcode
+from ..mysqlConnector import init_db, get_db_connection
+from .base import Database, DuplicateKeyError, Repository, SessionRepository
+
+
+class MySQLDatabase(Database):
+    placeholder = '%s'
+    lock_clause = ' FOR UPDATE'
+    now = "NOW()"
+
+    def seconds_between(self, start, stop):
+        return f"TIMESTAMPDIFF(SECOND, {start}, {stop})"
+
+    def upsert_add(self, table, key_columns, value_column):
+        columns = ', '.join(key_columns + (value_column,))
+        return (
+            f"INSERT INTO {table} ({columns}) VALUES ({self.placeholders(len(key_columns) + 1)}) "
+            f"ON DUPLICATE KEY UPDATE {value_column} = {value_column} + VALUES({value_column})"
+        )
+
+    def translate_error(self, error):
+        if isinstance(error, IntegrityError) and error.errno == errorcode.ER_DUP_ENTRY:
+            match = re.search(r"for key '(?:\w+\.)?(\w+)'", error.msg or '')
+            return DuplicateKeyError(match.group(1) if match else None, error.msg)
+        return None
+
+
+class MySQLSessionRepository(SessionRepository):
+    def close(self, session_id, user_id, date_time_stop, seconds):
+        # Close the session and add its length to TotalTime in one statement
+        return self.db.execute(
+            "UPDATE OnlineTime JOIN TotalTime ON TotalTime.user_id = OnlineTime.user_id "
+            "SET OnlineTime.dateTimeStop = %s, TotalTime.sumSeconds = TotalTime.sumSeconds + %s "
+            "WHERE OnlineTime.id = %s AND OnlineTime.dateTimeStop IS NULL",
+            (date_time_stop, seconds, session_id)
+        ) > 0
+
+
+class MySQLRepository(Repository):
+    session_class = MySQLSessionRepository
+
+    @staticmethod
+    def init_app(app):
+        init_db(app)
+
+    @classmethod
+    def open(cls):
+        """
+        Returns a repository on the request's pooled connection, or None if none could be acquired.
+        """
+        cnx = get_db_connection()
+        return cls(MySQLDatabase(cnx)) if cnx else None
@@ -0,0 +1,228 @@
+"""
+Embedded SQLite storage backend
+
+Runs TimeClockDB in a local SQLite file in WAL mode, so small sites need no
+database server and tests or benchmarks can run in-process. The schema
+mirrors Create_TimeClockDB.sql and is created on startup if missing.
+
+Functions:
+ - init_sqlite(app): Creates the schema and registers the teardown handler.
+ - get_sqlite_connection(): Returns the connection bound to the current app context.
+
+Classes:
+ - SQLiteDatabase: Database for sqlite3 connections.
+ - SQLiteRepository: The repositories on top of SQLite.
+"""
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime, date
+from flask import current_app, g
+from .base import Database, DuplicateKeyError, Repository, CHANGE_TRACKED_TABLES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Permissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    permissionLevel VARCHAR(255),
+    title VARCHAR(255)
+);
+
+CREATE TABLE IF NOT EXISTS `User` (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    firstName VARCHAR(255),
+    lastName VARCHAR(255),
+    tagNum VARCHAR(255),
+    email VARCHAR(255),
+    password TEXT,
+    permission_id INTEGER REFERENCES Permissions(id),
+    CONSTRAINT uq_User_email UNIQUE (email),
+    CONSTRAINT uq_User_tagNum UNIQUE (tagNum)
+);
+CREATE INDEX IF NOT EXISTS ix_User_lastName ON `User` (lastName);
+CREATE INDEX IF NOT EXISTS ix_User_firstName ON `User` (firstName);
+
+CREATE TABLE IF NOT EXISTS OnlineTime (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dateTimeStart DATETIME,
+    dateTimeStop DATETIME,
+    breakTime INT,
+    user_id INTEGER REFERENCES `User`(id),
+    openSession INTEGER GENERATED ALWAYS AS (CASE WHEN dateTimeStop IS NULL THEN 1 END) VIRTUAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_OnlineTime_openSession ON OnlineTime (user_id, openSession);
+CREATE INDEX IF NOT EXISTS ix_OnlineTime_user_stop ON OnlineTime (user_id, dateTimeStop, dateTimeStart);
+CREATE INDEX IF NOT EXISTS ix_OnlineTime_start ON OnlineTime (dateTimeStart, id);
+
+CREATE TABLE IF NOT EXISTS TotalTime (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sumSeconds INTEGER NOT NULL DEFAULT 0,
+    breakTime TIME,
+    user_id INTEGER REFERENCES `User`(id),
+    CONSTRAINT uq_TotalTime_user UNIQUE (user_id)
+);
+
+CREATE TABLE IF NOT EXISTS UserDailyTime (
+    user_id INTEGER REFERENCES `User`(id),
+    day DATE,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+CREATE INDEX IF NOT EXISTS ix_UserDailyTime_day ON UserDailyTime (day);
+
+CREATE TABLE IF NOT EXISTS UserWeeklyTime (
+    user_id INTEGER REFERENCES `User`(id),
+    weekStart DATE,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, weekStart)
+);
+CREATE INDEX IF NOT EXISTS ix_UserWeeklyTime_weekStart ON UserWeeklyTime (weekStart);
+
+CREATE TABLE IF NOT EXISTS TotalTimeFingerprint (
+    user_id INTEGER PRIMARY KEY REFERENCES `User`(id),
+    sessionCount INTEGER NOT NULL,
+    sessionSeconds INTEGER NOT NULL,
+    startSeconds INTEGER NOT NULL,
+    checkedAt DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS PunchEvent (
+    eventKey VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER REFERENCES `User`(id),
+    eventTime DATETIME,
+    direction VARCHAR(3)
+);
+
+CREATE TABLE IF NOT EXISTS ChangeLog (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    tableName VARCHAR(32) NOT NULL,
+    rowId INTEGER NOT NULL,
+    operation VARCHAR(6) NOT NULL,
+    changedAt DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_ChangeLog_table ON ChangeLog (tableName, version);
+"""
+
+# Every write to a synced table is logged by a trigger, see GET /sync
+SCHEMA += ''.join(
+    f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()} AFTER {event} ON `{table}` FOR EACH ROW BEGIN "
+    f"INSERT INTO ChangeLog (tableName, rowId, operation, changedAt) "
+    f"VALUES ('{table}', {'OLD' if event == 'DELETE' else 'NEW'}.id, '{'delete' if event == 'DELETE' else 'upsert'}', "
+    f"datetime('now', 'localtime')); END;\n"
+    for table in CHANGE_TRACKED_TABLES for event in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+PERMISSIONS = [
+    ('Dev', 'Developer'),
+    ('Admin', 'Administrator'),
+    ('Supervisor', 'Supervisor'),
+    ('User', 'Standard User'),
+    ('Guest', 'Guest User'),
+]
+
+# SQLite reports the columns of a violated unique constraint, not its name
+UNIQUE_KEYS = {
+    'User.email': 'uq_User_email',
+    'User.tagNum': 'uq_User_tagNum',
+    'OnlineTime.user_id, OnlineTime.openSession': 'uq_OnlineTime_openSession',
+    'TotalTime.user_id': 'uq_TotalTime_user',
+    'PunchEvent.eventKey': 'PRIMARY',
+}
+
+# Store DATETIME and DATE columns in the same 'YYYY-MM-DD HH:MM:SS' / 'YYYY-MM-DD' form MySQL uses
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode('utf-8')))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode('utf-8')))
+
+
+def _connect(app):
+    path = app.config['SQLITE_DATABASE_PATH']
+    cnx = sqlite3.connect(
+        path,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        isolation_level=None,  # transactions are started explicitly by SQLiteDatabase.begin()
+        check_same_thread=False,
+        timeout=app.config['SQLITE_BUSY_TIMEOUT'],
+        uri=path.startswith('file:')
+    )
+    cnx.execute("PRAGMA foreign_keys = ON")
+    cnx.execute("PRAGMA synchronous = NORMAL")
+    return cnx
+
+
+def init_sqlite(app):
+    """
+    Switches the database file to WAL mode, creates missing tables and registers the teardown handler.
+    """
+    cnx = _connect(app)
+    try:
+        cnx.execute("PRAGMA journal_mode = WAL")
+        cnx.executescript(SCHEMA)
+        if cnx.execute("SELECT COUNT(*) FROM Permissions").fetchone()[0] == 0:
+            cnx.executemany("INSERT INTO Permissions (permissionLevel, title) VALUES (?, ?)", PERMISSIONS)
+    finally:
+        cnx.close()
+    app.teardown_appcontext(close_sqlite_connection)
+
+
+def get_sqlite_connection():
+    """
+    Returns the connection bound to the current app context, opening it on first use.
+    """
+    if 'sqlite_cnx' not in g:
+        g.sqlite_cnx = _connect(current_app)
+    return g.sqlite_cnx
+
+
+def close_sqlite_connection(exception=None):
+    cnx = g.pop('sqlite_cnx', None)
+    if cnx is not None:
+        cnx.close()
+
+
+class SQLiteDatabase(Database):
+    placeholder = '?'
+    lock_clause = ''  # BEGIN IMMEDIATE already holds the write lock for the whole transaction
+    now = "datetime('now', 'localtime')"
+
+    def seconds_between(self, start, stop):
+        return f"(CAST(strftime('%s', {stop}) AS INTEGER) - CAST(strftime('%s', {start}) AS INTEGER))"
+
+    def upsert_add(self, table, key_columns, value_column):
+        columns = ', '.join(key_columns + (value_column,))
+        return (
+            f"INSERT INTO {table} ({columns}) VALUES ({self.placeholders(len(key_columns) + 1)}) "
+            f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {value_column} = {value_column} + excluded.{value_column}"
+        )
+
+    def sql(self, query):
+        # Only the %s placeholders, the strftime('%s', ...) format above must stay as is
+        return re.sub(r"%s(?!')", '?', query)
+
+    def cursor(self):
+        return closing(self.cnx.cursor())
+
+    def translate_error(self, error):
+        if isinstance(error, sqlite3.IntegrityError):
+            message = str(error)
+            if message.startswith('UNIQUE constraint failed: '):
+                columns = message[len('UNIQUE constraint failed: '):]
+                return DuplicateKeyError(UNIQUE_KEYS.get(columns), message)
+        return None
+
+    def begin(self):
+        if not self.cnx.in_transaction:
+            self.cnx.execute("BEGIN IMMEDIATE")
+
+
+class SQLiteRepository(Repository):
+    @staticmethod
+    def init_app(app):
+        init_sqlite(app)
+
+    @classmethod
+    def open(cls):
+        """
+        Returns a repository on the request's SQLite connection.
+        """
+        return cls(SQLiteDatabase(get_sqlite_connection()))
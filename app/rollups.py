@@ -0,0 +1,70 @@
+"""
+Daily and weekly rollups of worked time
+
+UserDailyTime and UserWeeklyTime hold the seconds each user worked per
+calendar day and per ISO week. They are maintained incrementally by the
+paths that close, edit or delete sessions, so range reports read one row per
+day or week instead of scanning OnlineTime.
+
+Functions:
+ - split_session_by_day(date_time_start, date_time_stop): Splits a session's seconds at midnight.
+ - week_start(day): Returns the Monday of the ISO week containing day.
+ - iso_week(day): Formats the ISO week of a day as 'YYYY-Www'.
+ - rollup_deltas(added, removed): Sums session changes into daily and weekly deltas.
+"""
+from datetime import datetime, time, timedelta
+
+
+def split_session_by_day(date_time_start, date_time_stop):
+    """
+    Splits a completed session into the seconds worked on each calendar day.
+
+    Returns:
+        dict: {date: seconds}, empty for an open session.
+    """
+    days = {}
+    if date_time_start is None or date_time_stop is None:
+        return days
+    current = date_time_start
+    while current < date_time_stop:
+        # Cut at the next midnight so a night shift counts towards both days
+        end = min(datetime.combine(current.date() + timedelta(days=1), time.min), date_time_stop)
+        days[current.date()] = days.get(current.date(), 0) + int((end - current).total_seconds())
+        current = end
+    return days
+
+
+def week_start(day):
+    """
+    Returns the Monday of the ISO week containing day, the key of the weekly rollup.
+    """
+    return day - timedelta(days=day.weekday())
+
+
+def iso_week(day):
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02}"
+
+
+def rollup_deltas(added=(), removed=()):
+    """
+    Sums session changes into rollup deltas.
+
+    Parameters:
+        added (iterable): (user_id, dateTimeStart, dateTimeStop) of sessions that now count.
+        removed (iterable): (user_id, dateTimeStart, dateTimeStop) of sessions that no longer count.
+
+    Returns:
+        tuple: ({(user_id, day): seconds}, {(user_id, weekStart): seconds}) without zero entries.
+    """
+    daily = {}
+    for sessions, sign in ((added, 1), (removed, -1)):
+        for user_id, date_time_start, date_time_stop in sessions:
+            for day, seconds in split_session_by_day(date_time_start, date_time_stop).items():
+                daily[(user_id, day)] = daily.get((user_id, day), 0) + sign * seconds
+    weekly = {}
+    for (user_id, day), seconds in daily.items():
+        key = (user_id, week_start(day))
+        weekly[key] = weekly.get(key, 0) + seconds
+    return ({key: seconds for key, seconds in daily.items() if seconds},
+            {key: seconds for key, seconds in weekly.items() if seconds})
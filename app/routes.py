@@ -11,11 +11,36 @@ Functions:
     - get_user_byName(user_name): Retrieves and returns user information by username.
     - create_user_route(): Creates a new user based on the provided data.
     - edit_user_route(user_id): Updates an existing user with the provided data.
+    - toggle_onlinetime_bytag_route(tag_num): Clocks the owner of a badge in or out.
+    - reload_permissions(): Reloads the role lookup used by role_required.
+    - ingest_onlinetime_batch_route(): Applies a batch of badge reader events.
+    - stream_onlinetime_route(): Streams who is clocked in as Server-Sent Events.
+    - issue_token_route(): Exchanges email and password for a bearer token.
+    - revoke_token_route(): Revokes the caller's bearer token or every token of a user.
+    - get_my_summary(): Returns the logged in user's profile, open session and worked time.
+    - start_recompute(): Starts the bulk recompute of all totals in the background.
+    - get_recompute_progress(): Returns the progress of the bulk recompute.
+    - get_payroll(): Returns the payroll figures of every user for a period.
+    - get_sync_route(): Returns the users, sessions and totals changed since a version.
+    - batch_route(): Runs several GET requests in one round trip.
+    - get_stats(): Returns runtime statistics such as connection pool usage.
 """
-from flask import jsonify, request, render_template, abort, send_from_directory
+from flask import jsonify, request, render_template, abort, send_from_directory, current_app
 import os
 from .services import * #Temoporary 
 from .authentication import * #Temoporary
+from .reports import get_payroll_report
+from .sync import get_sync
+from .batch import run_batch
+from .rateLimit import rate_limit, rate_limiter
+from .apiTokens import issue_api_token, revoke_api_token, token_revocations
+from .jobs import recompute_job
+from .mysqlConnector import get_pool_stats
+from .tagIndex import tag_index
+from .cache import user_cache
+from .events import event_broker
+from .passwordHashing import password_hasher
+from .etags import conditional_get, resource_versions, USERS, PERMISSIONS, ONLINETIME, TOTALTIME
 from . import csrf
 
 
@@ -50,6 +75,7 @@ def init_routes(app):
         return render_template('home.html')
 
     @app.route('/login', methods=['GET', 'POST'])
+    @rate_limit('login', ('ip', 'RATE_LIMIT_LOGIN_PER_IP'), ('email', 'RATE_LIMIT_LOGIN_PER_EMAIL'), methods=('POST',))
     def login():
         """
         User Login
@@ -72,10 +98,13 @@ def init_routes(app):
             description: Login successful
           401:
             description: Invalid credentials
+          429:
+            description: Too many requests, retry after the Retry-After seconds
         """
         return auth_login()
 
     @app.route('/register', methods=['GET', 'POST'])
+    @rate_limit('register', ('ip', 'RATE_LIMIT_LOGIN_PER_IP'), methods=('POST',))
     def register():
         """
         User Registration
@@ -87,6 +116,8 @@ def init_routes(app):
             description: Registration successful
           400:
             description: Invalid registration data
+          429:
+            description: Too many requests, retry after the Retry-After seconds
         """
         return auth_register()
 
@@ -140,6 +171,91 @@ def init_routes(app):
             description: Unauthorized - User not logged in
         """
         return auth_logout()
+
+    # Bearer tokens for kiosks and integrations, they carry no cookie for CSRF to protect
+    @csrf.exempt
+    @app.route('/auth/token', methods=['POST'])
+    @rate_limit('login', ('ip', 'RATE_LIMIT_LOGIN_PER_IP'), ('email', 'RATE_LIMIT_LOGIN_PER_EMAIL'))
+    def issue_token_route():
+        """
+        Issue a bearer token
+        ---
+        tags:
+          - Authentication
+        description: Exchanges email and password for a signed token. Send it as 'Authorization Bearer <token>', requests with it need no session cookie and no CSRF token.
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              required:
+                - email
+                - password
+              properties:
+                email:
+                  type: string
+                  example: "john.doe@example.com"
+                password:
+                  type: string
+                  example: "secret"
+        responses:
+          200:
+            description: Token issued
+            schema:
+              type: object
+              properties:
+                token:
+                  type: string
+                tokenType:
+                  type: string
+                  example: "Bearer"
+                expiresIn:
+                  type: integer
+                  example: 43200
+          400:
+            description: Missing email or password
+          401:
+            description: Invalid credentials
+          503:
+            description: Too many password checks in progress, retry after the Retry-After seconds
+          429:
+            description: Too many requests, retry after the Retry-After seconds
+        """
+        return issue_api_token()
+
+    @app.route('/auth/token/revoke', methods=['POST'])
+    @login_required
+    def revoke_token_route():
+        """
+        Revoke bearer tokens
+        ---
+        tags:
+          - Authentication
+        description: Revokes the bearer token the request was made with. Administrators can pass user_id to revoke every token of that user.
+        parameters:
+          - name: body
+            in: body
+            required: false
+            schema:
+              type: object
+              properties:
+                user_id:
+                  type: integer
+                  example: 1
+        responses:
+          200:
+            description: Token revoked
+          400:
+            description: The request was not made with a bearer token
+          401:
+            description: Unauthorized request
+          403:
+            description: Access forbidden - Admin role required
+          503:
+            description: The revocation list is full
+        """
+        return revoke_api_token()
     
     # Error handler for unauthorized access
     @app.errorhandler(403)
@@ -179,12 +295,30 @@ def init_routes(app):
     @app.route('/users/all', methods=['GET'])
     @login_required
     @role_required('admin')
+    @conditional_get(USERS)
     def get_users():
         """
         Get all Users
         ---
         tags:
           - Users
+        parameters:
+          - name: limit
+            in: query
+            required: false
+            type: integer
+            description: 'Page size. When limit or after is given the response is {"data": [...], "next": cursor}'
+          - name: after
+            in: query
+            required: false
+            type: string
+            description: The next cursor of the previous page
+          - name: stream
+            in: query
+            required: false
+            type: string
+            enum: ["json", "ndjson"]
+            description: Stream every row as a JSON array or as newline-delimited JSON instead of building the response in memory
         responses:
           200:
             description: Successful operation
@@ -219,6 +353,7 @@ def init_routes(app):
 
     @app.route('/users', methods=['GET'])
     @login_required
+    @conditional_get(USERS, PERMISSIONS, per_user=True)
     def get_user_byid():
         """
         Get user by ID
@@ -265,6 +400,7 @@ def init_routes(app):
     @app.route('/users/<string:user_name>', methods=['GET'])
     @login_required
     @role_required('admin')
+    @conditional_get(USERS, PERMISSIONS)
     def get_user_byName(user_name):
         """
         Get user by name
@@ -453,12 +589,16 @@ def init_routes(app):
   
     # Routing for /permissions
     @app.route('/permissions', methods=['GET'])
+    @conditional_get(PERMISSIONS)
     def get_permissions():
         """
         Get all permisssions
         ---
         tags:
           - Permissions
+        description: |
+          Tagged with an ETag only with the 'shared' CACHE_BACKEND. The Permissions table has no
+          change log, so with the 'memory' backend the response is never tagged.
         responses:
           200:
             description: Successful operation
@@ -492,16 +632,57 @@ def init_routes(app):
         return get_all_permissions()
     
 
+    @app.route('/permissions/reload', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    def reload_permissions():
+        """
+        Reload the role lookup from the Permissions table
+        ---
+        tags:
+          - Permissions
+        responses:
+          200:
+            description: Role lookup reloaded
+          401:
+            description: Unauthorized request
+          403:
+            description: Access forbidden - Admin role required
+          500:
+            description: Database connection failed
+        """
+        if reload_roles():
+            return jsonify({"message": "Permissions reloaded"}), 200
+        return jsonify({"message": "Database connection failed"}), 500
+
     # Routing for /onlinetime
     @app.route('/onlinetime/all', methods=['GET'])
     @login_required
     @role_required('admin')
+    @conditional_get(USERS, ONLINETIME)
     def get_onlinetime():
         """
         Get all onlinetime
         ---
         tags:
           - Onlinetime
+        parameters:
+          - name: limit
+            in: query
+            required: false
+            type: integer
+            description: 'Page size. When limit or after is given the response is {"data": [...], "next": cursor}'
+          - name: after
+            in: query
+            required: false
+            type: string
+            description: The next cursor of the previous page
+          - name: stream
+            in: query
+            required: false
+            type: string
+            enum: ["json", "ndjson"]
+            description: Stream every row as a JSON array or as newline-delimited JSON instead of building the response in memory
         responses:
           200:
             description: Successful operation
@@ -518,10 +699,10 @@ def init_routes(app):
                     example: "Doe"
                   dateTimeStart:
                     type: string
-                    example: "Fri, 01 Nov 2024 08:00:00 GMT"
+                    example: "2024-11-01T08:00:00"
                   dateTimeStop:
                     type: string
-                    example: "Fri, 01 Nov 2024 17:00:00 GMT"
+                    example: "2024-11-01T17:00:00"
                   breakTime:
                     type: string
                     example: "60"
@@ -539,6 +720,7 @@ def init_routes(app):
     
     @app.route('/onlinetime', methods=['GET'])
     @login_required
+    @conditional_get(USERS, ONLINETIME, per_user=True)
     def get_onlinetime_byid():
         """
         Get online time by user ID
@@ -565,10 +747,10 @@ def init_routes(app):
                   example: "Doe"
                 dateTimeStart:
                   type: string
-                  example: "Fri, 01 Nov 2024 08:00:00 GMT"
+                  example: "2024-11-01T08:00:00"
                 dateTimeStop:
                   type: string
-                  example: "Fri, 01 Nov 2024 17:00:00 GMT"
+                  example: "2024-11-01T17:00:00"
                 breakTime:
                   type: string
                   example: "60"
@@ -584,6 +766,7 @@ def init_routes(app):
     
     @app.route('/onlinetime/start', methods=['POST'])
     @login_required
+    @rate_limit('punch', ('user', 'RATE_LIMIT_PUNCH_PER_USER'))
     def create_onlinetime_route():
         """
         Start a new Session
@@ -621,12 +804,15 @@ def init_routes(app):
             description: Invalid input
           500:
             description: Database connection failed
+          429:
+            description: Too many requests, retry after the Retry-After seconds
         """
         user_id = current_user.id  # Get the ID of the logged-in user
         return create_onlinetime(user_id)
     
     @app.route('/onlinetime/stop', methods=['POST'])
     @login_required
+    @rate_limit('punch', ('user', 'RATE_LIMIT_PUNCH_PER_USER'))
     def stop_onlinetime_route():
         """
         Stop an existing Session
@@ -664,10 +850,158 @@ def init_routes(app):
             description: Invalid input
           500:
             description: Database connection failed
+          429:
+            description: Too many requests, retry after the Retry-After seconds
         """
         user_id = current_user.id  # Get the ID of the logged-in user
         return stop_onlinetime(user_id)
     
+    @app.route('/onlinetime/tag/<string:tag_num>', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    @rate_limit('punch', ('tag', 'RATE_LIMIT_PUNCH_PER_TAG'))
+    def toggle_onlinetime_bytag_route(tag_num):
+        """
+        Clock the owner of a badge in or out
+        ---
+        tags:
+          - Onlinetime
+        parameters:
+          - name: tag_num
+            in: path
+            required: true
+            type: string
+            description: The tag number read by the kiosk
+        responses:
+          200:
+            description: Session started or stopped
+            schema:
+              type: object
+              properties:
+                message:
+                  type: string
+                  example: "Session was succesfully started"
+                session:
+                  type: object
+                  properties:
+                    id:
+                      type: integer
+                      example: 1
+                    dateTimeStart:
+                      type: string
+                      example: "2024-11-01T08:00:00"
+                    dateTimeStop:
+                      type: string
+                      example: null
+                    user_id:
+                      type: integer
+                      example: 1
+          404:
+            description: Unknown tag number
+          409:
+            description: Session state changed concurrently, try again
+          500:
+            description: Database connection failed
+          429:
+            description: Too many requests, retry after the Retry-After seconds
+        """
+        return toggle_onlinetime_by_tag(tag_num)
+
+    @app.route('/onlinetime/batch', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    def ingest_onlinetime_batch_route():
+        """
+        Upload buffered badge reader events
+        ---
+        tags:
+          - Onlinetime
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              properties:
+                events:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      key:
+                        type: string
+                        description: Idempotency key, events whose key was already applied are skipped
+                        example: "door1-000123"
+                      tagNum:
+                        type: string
+                        example: "5498754759"
+                      timestamp:
+                        type: string
+                        example: "2024-11-01T08:00:00"
+                      direction:
+                        type: string
+                        enum: ["in", "out"]
+                        example: "in"
+        responses:
+          200:
+            description: Batch processed, one result per event in request order
+            schema:
+              type: object
+              properties:
+                results:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      key:
+                        type: string
+                        example: "door1-000123"
+                      status:
+                        type: string
+                        enum: ["applied", "duplicate", "rejected"]
+                        example: "applied"
+                      message:
+                        type: string
+                        example: "Unknown tag number"
+          400:
+            description: Invalid input
+          409:
+            description: Conflicts with a concurrent upload of the same events, retry the batch
+          413:
+            description: Too many events in one batch
+          500:
+            description: Database connection failed
+        """
+        return ingest_punch_batch()
+
+    @app.route('/onlinetime/stream', methods=['GET'])
+    @login_required
+    @role_required('admin')
+    def stream_onlinetime_route():
+        """
+        Stream who is clocked in as Server-Sent Events
+        ---
+        tags:
+          - Onlinetime
+        produces:
+          - text/event-stream
+        description: |
+          Sends a `snapshot` event with the open sessions, then a `clock-in` or `clock-out`
+          event for every punch as it commits. Each event's data is a JSON object
+          (`id`, `user_id`, `firstName`, `lastName`, `dateTimeStart`, `dateTimeStop`).
+          A client that falls too far behind is disconnected and should reconnect for a fresh snapshot.
+          With several workers the punches of the other workers only reach the stream with the
+          'shared' CACHE_BACKEND.
+        responses:
+          200:
+            description: Event stream
+          401:
+            description: Unauthorized request
+          500:
+            description: Database connection failed
+        """
+        return stream_onlinetime()
+
     @app.route('/onlinetime/edit/<int:user_id>/<string:session_time_identifier>', methods=['PUT'])
     @login_required
     @role_required('admin')
@@ -688,6 +1022,7 @@ def init_routes(app):
               required: true
               type: string
               description: The identifier for the session (typically end time)
+              example: "2024-11-01T17:00:00"
             - name: body
               in: body
               required: true
@@ -696,10 +1031,10 @@ def init_routes(app):
                   properties:
                       dateTimeStart:
                           type: string
-                          example: "2024-11-01 08:00:00"
+                          example: "2024-11-01T08:00:00"
                       dateTimeStop:
                           type: string
-                          example: "2024-11-01 17:00:00"
+                          example: "2024-11-01T17:00:00"
         responses:
             200:
                 description: Session updated successfully
@@ -733,6 +1068,7 @@ def init_routes(app):
             required: true
             type: string
             description: the End time of the Session
+            example: "2024-11-01T17:00:00"
         responses:
           200:
             description: User deleted successfully
@@ -765,12 +1101,48 @@ def init_routes(app):
     @app.route('/totaltime/all', methods=['GET'])
     @login_required
     @role_required('admin')
+    @conditional_get(USERS, TOTALTIME)
     def get_totaltime():
         """
         Get all Totaltime
         ---
         tags:
           - Totaltime
+        parameters:
+          - name: from
+            in: query
+            required: false
+            type: string
+            format: date
+            description: First day (YYYY-MM-DD) of a range report. With from and to the response is the worked time per day or week from the rollup tables
+          - name: to
+            in: query
+            required: false
+            type: string
+            format: date
+            description: Last day (YYYY-MM-DD) of a range report
+          - name: granularity
+            in: query
+            required: false
+            type: string
+            enum: ["day", "week"]
+            description: Report per calendar day (default) or per ISO week; weeks touching the range are reported whole
+          - name: limit
+            in: query
+            required: false
+            type: integer
+            description: 'Page size. When limit or after is given the response is {"data": [...], "next": cursor}'
+          - name: after
+            in: query
+            required: false
+            type: string
+            description: The next cursor of the previous page
+          - name: stream
+            in: query
+            required: false
+            type: string
+            enum: ["json", "ndjson"]
+            description: Stream every row as a JSON array or as newline-delimited JSON instead of building the response in memory
         responses:
           200:
             description: Successful operation
@@ -796,7 +1168,7 @@ def init_routes(app):
                     example: 5
                   breakTime:
                     type: string
-                    example: "2:30:00"
+                    example: "02:30:00"
           400:
             description: Invalid status value
           401:
@@ -806,16 +1178,38 @@ def init_routes(app):
           500:
             description: Internal server error
         """
+        if 'from' in request.args or 'to' in request.args:
+            return get_totaltime_range()
         return get_all_totaltime()
     
     @app.route('/totaltime', methods=['GET'])
     @login_required
+    @conditional_get(USERS, TOTALTIME, per_user=True)
     def get_totaltime_byid():
         """
         Get total time for the logged-in user
         ---
         tags:
           - Totaltime
+        parameters:
+          - name: from
+            in: query
+            required: false
+            type: string
+            format: date
+            description: First day (YYYY-MM-DD) of a range report. With from and to the response is the worked time per day or week from the rollup tables
+          - name: to
+            in: query
+            required: false
+            type: string
+            format: date
+            description: Last day (YYYY-MM-DD) of a range report
+          - name: granularity
+            in: query
+            required: false
+            type: string
+            enum: ["day", "week"]
+            description: Report per calendar day (default) or per ISO week; weeks touching the range are reported whole
         responses:
           200:
             description: Successful operation
@@ -845,4 +1239,545 @@ def init_routes(app):
             description: User not found
         """
         user_id = current_user.id  # Get the ID of the logged-in user
-        return get_totaltime_by_id(user_id)
\ No newline at end of file
+        if 'from' in request.args or 'to' in request.args:
+            return get_totaltime_range(user_id)
+        return get_totaltime_by_id(user_id)
+
+    # Routing for /me ---------------------------------------------------------------------------------
+    @app.route('/me/summary', methods=['GET'])
+    @login_required
+    def get_my_summary():
+        """
+        Get everything the user dashboard shows in one request
+        ---
+        tags:
+          - Me
+        responses:
+          200:
+            description: Successful operation
+            schema:
+              type: object
+              properties:
+                user:
+                  type: object
+                  properties:
+                    id:
+                      type: integer
+                      example: 1
+                    firstName:
+                      type: string
+                      example: "James"
+                    lastName:
+                      type: string
+                      example: "Bond"
+                    tagNum:
+                      type: string
+                      example: "5498754759"
+                    email:
+                      type: string
+                      example: "james.bond@example.com"
+                    permission:
+                      type: string
+                      example: "Standard User"
+                openSession:
+                  type: object
+                  description: null while clocked out
+                  properties:
+                    id:
+                      type: integer
+                      example: 42
+                    dateTimeStart:
+                      type: string
+                      example: "2024-11-01T08:00:00"
+                    breakTime:
+                      type: string
+                      example: "60"
+                    elapsedTime:
+                      type: string
+                      example: "02:15:00"
+                    elapsedSeconds:
+                      type: integer
+                      example: 8100
+                today:
+                  type: object
+                  properties:
+                    day:
+                      type: string
+                      example: "2024-11-01"
+                    sumTime:
+                      type: string
+                      example: "02:15:00"
+                    sumSeconds:
+                      type: integer
+                      example: 8100
+                total:
+                  type: object
+                  properties:
+                    sumTime:
+                      type: string
+                      example: "168:30:00"
+                    sumSeconds:
+                      type: integer
+                      example: 606600
+                    breakTime:
+                      type: string
+                      example: "10:00:00"
+          401:
+            description: Unauthorized request
+          404:
+            description: User not found
+          500:
+            description: Database connection failed
+        """
+        return get_user_summary(current_user.id)
+
+    @app.route('/totaltime/recompute', methods=['POST'])
+    @login_required
+    @role_required('admin')
+    def start_recompute():
+        """
+        Recompute the totals and daily/weekly rollups of all users in the background
+        ---
+        tags:
+          - Totaltime
+        parameters:
+          - name: force
+            in: query
+            required: false
+            type: boolean
+            description: Rewrite every user, even if their sessions did not change since the last run
+        responses:
+          202:
+            description: Recompute started, poll GET /totaltime/recompute for progress
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                  enum: ["idle", "running", "done", "failed"]
+                  example: "running"
+                users:
+                  type: integer
+                  example: 1200
+                processed:
+                  type: integer
+                  example: 500
+                changed:
+                  type: integer
+                  example: 12
+                skipped:
+                  type: integer
+                  example: 488
+                chunks:
+                  type: integer
+                  example: 3
+                chunksDone:
+                  type: integer
+                  example: 1
+                error:
+                  type: string
+                  example: null
+          401:
+            description: Unauthorized request
+          409:
+            description: A recompute is already running
+        """
+        force = request.args.get('force', 'false').lower() == 'true'
+        if not recompute_job.start(current_app._get_current_object(), force=force):
+            return jsonify({"message": "A recompute is already running", "progress": recompute_job.progress()}), 409
+        return jsonify(recompute_job.progress()), 202
+
+    @app.route('/totaltime/recompute', methods=['GET'])
+    @login_required
+    @role_required('admin')
+    def get_recompute_progress():
+        """
+        Get the progress of the bulk recompute
+        ---
+        tags:
+          - Totaltime
+        responses:
+          200:
+            description: Successful operation
+            schema:
+              type: object
+              properties:
+                status:
+                  type: string
+                  enum: ["idle", "running", "done", "failed"]
+                  example: "running"
+                users:
+                  type: integer
+                  example: 1200
+                processed:
+                  type: integer
+                  example: 500
+                changed:
+                  type: integer
+                  example: 12
+                skipped:
+                  type: integer
+                  example: 488
+                chunks:
+                  type: integer
+                  example: 3
+                chunksDone:
+                  type: integer
+                  example: 1
+                error:
+                  type: string
+                  example: null
+          401:
+            description: Unauthorized request
+        """
+        return jsonify(recompute_job.progress()), 200
+
+    # Routing for /reports
+    @app.route('/reports/payroll', methods=['GET'])
+    @login_required
+    @role_required('admin')
+    def get_payroll():
+        """
+        Get the payroll figures of every user for a period
+        ---
+        tags:
+          - Reports
+        parameters:
+          - name: from
+            in: query
+            required: true
+            type: string
+            format: date
+            description: First day of the period (YYYY-MM-DD)
+          - name: to
+            in: query
+            required: true
+            type: string
+            format: date
+            description: Last day of the period (YYYY-MM-DD), included
+          - name: overtime
+            in: query
+            required: false
+            type: number
+            description: Hours per day after which time counts as overtime (default PAYROLL_OVERTIME_HOURS_PER_DAY)
+        responses:
+          200:
+            description: Successful operation
+            schema:
+              type: object
+              properties:
+                from:
+                  type: string
+                  example: "2024-11-01"
+                to:
+                  type: string
+                  example: "2024-11-30"
+                overtimeThreshold:
+                  type: string
+                  example: "08:00:00"
+                data:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      user_id:
+                        type: integer
+                        example: 1
+                      firstName:
+                        type: string
+                        example: "James"
+                      lastName:
+                        type: string
+                        example: "Bond"
+                      grossTime:
+                        type: string
+                        example: "168:30:00"
+                      grossSeconds:
+                        type: integer
+                        example: 606600
+                      breakTime:
+                        type: string
+                        example: "10:00:00"
+                      breakSeconds:
+                        type: integer
+                        example: 36000
+                      overtime:
+                        type: string
+                        example: "8:30:00"
+                      overtimeSeconds:
+                        type: integer
+                        example: 30600
+                      daysWorked:
+                        type: integer
+                        example: 20
+          400:
+            description: Invalid period or overtime threshold
+          401:
+            description: Unauthorized request
+          500:
+            description: Database connection failed
+        """
+        return get_payroll_report()
+
+    # Routing for /sync
+    @app.route('/sync', methods=['GET'])
+    @login_required
+    @role_required('admin')
+    def get_sync_route():
+        """
+        Get the users, sessions and totals changed since a version
+        ---
+        tags:
+          - Sync
+        parameters:
+          - name: since
+            in: query
+            required: false
+            type: integer
+            description: The version of the previous response, 0 (default) for a full snapshot
+        responses:
+          200:
+            description: Changed rows; request again with the returned version, right away while more is true
+            schema:
+              type: object
+              properties:
+                version:
+                  type: integer
+                  example: 1042
+                more:
+                  type: boolean
+                  example: false
+                users:
+                  type: array
+                  items:
+                    type: object
+                onlinetime:
+                  type: array
+                  items:
+                    type: object
+                totaltime:
+                  type: array
+                  items:
+                    type: object
+                deleted:
+                  type: object
+                  properties:
+                    users:
+                      type: array
+                      items:
+                        type: integer
+                    onlinetime:
+                      type: array
+                      items:
+                        type: integer
+                    totaltime:
+                      type: array
+                      items:
+                        type: integer
+          400:
+            description: Invalid since
+          401:
+            description: Unauthorized request
+          410:
+            description: The version is unknown or its changes were pruned, resync with since=0
+          500:
+            description: Database connection failed
+        """
+        return get_sync()
+
+    # Routing for /batch
+    @app.route('/batch', methods=['POST'])
+    @login_required
+    def batch_route():
+        """
+        Run several GET requests in one round trip
+        ---
+        tags:
+          - Batch
+        parameters:
+          - name: body
+            in: body
+            required: true
+            schema:
+              type: object
+              properties:
+                requests:
+                  type: array
+                  description: Paths, or objects with a path and optional If-None-Match/Accept headers
+                  items:
+                    type: object
+                    properties:
+                      path:
+                        type: string
+                        example: "/totaltime/all"
+                      headers:
+                        type: object
+                parallel:
+                  type: boolean
+                  description: Run the requests on a thread pool, each on its own connection
+                  example: false
+        responses:
+          200:
+            description: One entry per request, in request order
+            schema:
+              type: object
+              properties:
+                responses:
+                  type: array
+                  items:
+                    type: object
+                    properties:
+                      path:
+                        type: string
+                        example: "/totaltime/all"
+                      status:
+                        type: integer
+                        example: 200
+                      body:
+                        type: object
+                      etag:
+                        type: string
+          400:
+            description: Required field is missing
+          401:
+            description: Unauthorized request
+          413:
+            description: Too many requests in one batch
+        """
+        return run_batch()
+
+    # Routing for /stats
+    @app.route('/stats', methods=['GET'])
+    @login_required
+    @role_required('admin')
+    def get_stats():
+        """
+        Get runtime statistics
+        ---
+        tags:
+          - Stats
+        responses:
+          200:
+            description: Successful operation
+            schema:
+              type: object
+              properties:
+                pool:
+                  type: object
+                  properties:
+                    size:
+                      type: integer
+                      example: 10
+                    open:
+                      type: integer
+                      example: 4
+                    idle:
+                      type: integer
+                      example: 3
+                    in_use:
+                      type: integer
+                      example: 1
+                    acquired:
+                      type: integer
+                      example: 1520
+                    timeouts:
+                      type: integer
+                      example: 0
+                tagIndex:
+                  type: object
+                  properties:
+                    entries:
+                      type: integer
+                      example: 250
+                    hits:
+                      type: integer
+                      example: 5120
+                    misses:
+                      type: integer
+                      example: 3
+                userCache:
+                  type: object
+                  properties:
+                    size:
+                      type: integer
+                      example: 120
+                    hits:
+                      type: integer
+                      example: 98000
+                    misses:
+                      type: integer
+                      example: 130
+                events:
+                  type: object
+                  properties:
+                    backend:
+                      type: string
+                      example: memory
+                    subscribers:
+                      type: integer
+                      example: 2
+                    published:
+                      type: integer
+                      example: 5400
+                    dropped:
+                      type: integer
+                      example: 0
+                passwordHashing:
+                  type: object
+                  properties:
+                    inProgress:
+                      type: integer
+                      example: 3
+                    rejected:
+                      type: integer
+                      example: 0
+                    queueWaitAvgMs:
+                      type: number
+                      example: 12.5
+                    hashTimeAvgMs:
+                      type: number
+                      example: 240.1
+                etags:
+                  type: object
+                  properties:
+                    notModified:
+                      type: integer
+                      example: 8200
+                    tagged:
+                      type: integer
+                      example: 950
+                    versions:
+                      type: object
+                tokens:
+                  type: object
+                  properties:
+                    tokens:
+                      type: integer
+                      example: 2
+                    users:
+                      type: integer
+                      example: 1
+                rateLimit:
+                  type: object
+                  properties:
+                    backend:
+                      type: string
+                      example: "memory"
+                    allowed:
+                      type: integer
+                      example: 5200
+                    rejected:
+                      type: integer
+                      example: 40
+                    keys:
+                      type: integer
+                      example: 310
+          401:
+            description: Unauthorized request
+          403:
+            description: Access forbidden - Admin role required
+        """
+        return jsonify({"pool": get_pool_stats(), "tagIndex": tag_index.stats(), "userCache": user_cache.stats(),
+                        "events": event_broker.stats(), "etags": resource_versions.stats(),
+                        "passwordHashing": password_hasher.stats(), "tokens": token_revocations.stats(),
+                        "rateLimit": rate_limiter.stats()}), 200
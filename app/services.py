@@ -7,72 +7,94 @@ Functions:
  - get_user_by_name(user_name): Retrieves and returns user information by username.
  - create_user(): Creates a new user based on the provided data and returns the created user.
  - update_user(user_id, data): Updates user details in the database based on the provided user ID and data.
+ - toggle_onlinetime_by_tag(tag_num): Clocks the owner of a badge in or out using the in-memory tag index.
+ - ingest_punch_batch(): Applies a burst of badge reader events keyed by tagNum in one transaction.
+ - stream_onlinetime(): Streams the open sessions and later clock-ins/clock-outs as Server-Sent Events.
+ - get_totaltime_range(user_id): Returns worked time per day or ISO week from the rollup tables.
+ - get_user_summary(user_id): Returns a user's profile, open session, today's and lifetime worked time in one query.
 """
-from flask import jsonify, abort, request
-from .mysqlConnector import get_db_connection
-from .utils import is_valid_email, is_valid_datetime, is_duplicate_firstName, is_duplicate_lastName, is_duplicate_tagNum, is_duplicate_email, update_total_time
+from datetime import datetime
+from flask import jsonify, abort, request, current_app, Response, stream_with_context
+from .repositories import get_repository, DuplicateKeyError
+from .tagIndex import tag_index
+from .cache import user_cache
+from .passwordHashing import password_hasher, HashingBusyError
+from .apiTokens import token_revocations
+from .events import event_broker, publish_clock_event, sse_stream
+from .etags import resource_versions, USERS, ONLINETIME, TOTALTIME
+from .rollups import iso_week, split_session_by_day
+from .utils import is_valid_email, is_valid_datetime, parse_datetime, parse_date, parse_page_args, next_page_cursor, stream_rows, STREAM_FORMATS, duplicate_user_message, format_seconds, session_seconds
 
 # /users functions
+def user_from_row(row):
+    return {'id': row[0],
+            'firstName': row[1],
+            'lastName': row[2],
+            'tagNum': row[3],
+            'email': row[4]}
+
 def get_all_users():
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT id, firstName, lastName, tagNum, email FROM user;")
-            rows = cursor.fetchall()
-            if rows:
-                users = [{'id': row[0], 
-                          'firstName': row[1], 
-                          'lastName': row[2], 
-                          'tagNum': row[3], 
-                          'email': row[4]
-                          } for row in rows]
-                return jsonify(users), 200
-            else:
-                return jsonify({"message": "No Users found"}), 404
+    paginated, limit, after, error = parse_page_args(request.args, (int,))
+    if error:
+        return jsonify({"message": error}), 400
+    stream = request.args.get('stream')
+    if stream and (stream not in STREAM_FORMATS or paginated):
+        return jsonify({"message": "Invalid stream, expected 'json' or 'ndjson' without limit/after"}), 400
+    repo = get_repository()
+    if repo:
+        if stream:
+            return stream_rows(lambda repo: repo.users.iter_all(current_app.config['STREAM_FETCH_SIZE']), user_from_row, stream)
+        if not paginated:
+            rows = repo.users.list()
+        else:
+            rows, next_cursor = next_page_cursor(repo.users.list(limit + 1, after[0] if after else None), limit, lambda row: (row[0],))
+        users = [user_from_row(row) for row in rows]
+        if paginated:
+            return jsonify({"data": users, "next": next_cursor}), 200
+        if users:
+            return jsonify(users), 200
+        else:
+            return jsonify({"message": "No Users found"}), 404
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
 def get_user_by_id(user_id):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title FROM `user` JOIN Permissions ON `User`.permission_id = Permissions.id WHERE `User`.id = %s", (user_id,))
-            row = cursor.fetchone()
-            if row:
-                user = {'id': row[0], 
-                        'firstName': row[1], 
-                        'lastName': row[2], 
-                        'tagNum': row[3], 
-                        'email': row[4],
-                        'permission': row[5]}
-                return jsonify(user), 200
-            else:
-                return jsonify({"message": "User not found"}), 404
+    repo = get_repository()
+    if repo:
+        row = repo.users.get_with_permission(user_id)
+        if row:
+            user = {'id': row[0],
+                    'firstName': row[1],
+                    'lastName': row[2],
+                    'tagNum': row[3],
+                    'email': row[4],
+                    'permission': row[5]}
+            return jsonify(user), 200
+        else:
+            return jsonify({"message": "User not found"}), 404
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
 def get_user_by_name(user_name):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            # Query to search for users with the same first or last name
-            cursor.execute("SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title FROM `user` JOIN Permissions ON `User`.permission_id = Permissions.id WHERE firstName = %s OR lastName = %s", (user_name, user_name))
-            rows = cursor.fetchall()  # Fetch all matching rows
-            if rows:
-                # Construct a list of users
-                users = [
-                    {
-                        'id': row[0],
-                        'firstName': row[1],
-                        'lastName': row[2],
-                        'tagNum': row[3],
-                        'email': row[4],
-                        'permission': row[5]
-                    } for row in rows
-                ]
-                return jsonify(users), 200  # Return the list of users
-            else:
-                return jsonify({"message": "User not found"}), 404  # If no users found
+    repo = get_repository()
+    if repo:
+        # Search for users with the same first or last name
+        rows = repo.users.find_by_name(user_name)
+        if rows:
+            # Construct a list of users
+            users = [
+                {
+                    'id': row[0],
+                    'firstName': row[1],
+                    'lastName': row[2],
+                    'tagNum': row[3],
+                    'email': row[4],
+                    'permission': row[5]
+                } for row in rows
+            ]
+            return jsonify(users), 200  # Return the list of users
+        else:
+            return jsonify({"message": "User not found"}), 404  # If no users found
     else:
         return jsonify({"message": "Database connection failed"}), 500  # If DB connection fails
 
@@ -84,7 +106,7 @@ def create_user():
     user_tagNum = data.get('tagNum')
     user_email = data.get('email')
     user_password = data.get('password')
-    
+
     if user_firstName is None:
         return jsonify({"error": "Required field is missing (firstname)"}), 400
     if user_lastName is None:
@@ -97,69 +119,42 @@ def create_user():
         return jsonify({"error": "Invalid email format"}), 400
     if user_password is None:
         return jsonify({"error": "Required field is missing (password)"}), 400
-    
-    if is_duplicate_firstName(user_firstName) == True and is_duplicate_lastName(user_lastName) == True:
-        return jsonify({"error": "FirstName and lastName already belongs to another user, try using another."}), 400
-    if is_duplicate_email(user_email) == True:
-        return jsonify({"error": "Email is already used for another account, try using another."}), 400
-    if is_duplicate_tagNum(user_tagNum) == True:
-        return jsonify({"error": "Tag number is already in use for another account, try using another."}), 400
-
-    cnx = get_db_connection()
-    if cnx:
-        try:
-            with cnx.cursor() as cursor:
-                # Start a transaction
-                cursor.execute("START TRANSACTION;")
-
-                # Create User in user table
-                cursor.execute(
-                    "INSERT INTO user (firstName, lastName, tagNum, email, password, permission_id) VALUES (%s, %s, %s, %s, SHA2(%s, 512), (SELECT id FROM Permissions where title = 'Standard User'));",
-                    (user_firstName, user_lastName, user_tagNum, user_email, user_password)
-                )
-                cnx.commit()  # Commit after inserting the user
-
-                # Get the user id from the inserted user
-                cursor.execute(
-                    "SELECT `User`.id, firstName, lastName, tagNum, email, Permissions.title FROM `user` JOIN Permissions ON `User`.permission_id = Permissions.id WHERE firstName = %s AND lastName = %s;",
-                    (user_firstName, user_lastName)
-                )
-                row = cursor.fetchone()
-
-                if row:
-                    user = {'id': row[0], 
-                            'firstName': row[1], 
-                            'lastName': row[2], 
-                            'tagNum': row[3], 
-                            'email': row[4],
-                            'permission': row[5]}
-
-                    # Create TotalTime for User
-                    cursor.execute(
-                        "INSERT INTO TotalTime (sumTime, daysWorked, breakTime, user_id) VALUES ('00:00:00', 0, '00:00:00', %s);",
-                        (row[0],)  # Passing user id to TotalTime table
-                    )
-                    cnx.commit()  # Commit if everything works
-
-                    return jsonify(user), 200
 
-                else:
-                    # If user data is not retrieved, rollback the transaction and delete the user
-                    cnx.rollback()
-                    return jsonify({"error": "User creation failed after insert."}), 500
+    # Same scheme as registration, so users created here can log in
+    try:
+        password_hash = password_hasher.hash(user_password)
+    except HashingBusyError:
+        return (jsonify({"error": "Too many password operations at once, try again shortly"}), 503,
+                {'Retry-After': str(current_app.config['PASSWORD_HASH_RETRY_AFTER'])})
 
+    repo = get_repository()
+    if repo:
+        try:
+            with repo.transaction():
+                # Create User, the unique keys on email and tagNum reject duplicates
+                user_id = repo.users.create(user_firstName, user_lastName, user_tagNum, user_email, password_hash)
+                # Create TotalTime for User in the same transaction
+                repo.totals.create(user_id)
+                row = repo.users.get_with_permission(user_id)
+            tag_index.invalidate_tag(str(user_tagNum))
+            resource_versions.bump(USERS, TOTALTIME)
+
+            user = {'id': row[0],
+                    'firstName': row[1],
+                    'lastName': row[2],
+                    'tagNum': row[3],
+                    'email': row[4],
+                    'permission': row[5]}
+            return jsonify(user), 200
+
+        except DuplicateKeyError as e:
+            message = duplicate_user_message(e)
+            if message:
+                return jsonify({"error": message}), 400
+            return jsonify({"error": f"Error: {str(e)}"}), 500
         except Exception as e:
-            # If there's any exception, rollback the transaction and remove the user
-            cnx.rollback()
-
-            # If a user was created but there's an error, delete the user
-            cursor.execute(
-                "DELETE FROM user WHERE email = %s AND firstname = %s AND lastname = %s;", (user_email, user_firstName, user_lastName,)
-            )
-            cnx.commit()  # Commit after deletion
+            # Nothing was committed, the rollback removes the partially created user
             return jsonify({"error": f"Error: {str(e)}"}), 500
-        finally:
-            cnx.close()  # Ensure the connection is closed
 
     return jsonify({"message": "Database connection failed"}), 500
 
@@ -171,235 +166,248 @@ def update_user(user_id, data):
     :param data: JSON data containing the fields to update.
     :return: JSON response and status code.
     """
-    # Initialize a list to hold the fields to update
-    updates = []
-    params = []
+    # Collect the fields to update
+    fields = {}
 
     # Check each field and add to updates if it's provided
     if 'firstName' in data and data['firstName']:
-        updates.append("firstName = %s")
-        params.append(data['firstName'])
+        fields['firstName'] = data['firstName']
     if 'lastName' in data and data['lastName']:
-        updates.append("lastName = %s")
-        params.append(data['lastName'])
+        fields['lastName'] = data['lastName']
     if 'email' in data and data['email']:
         if not is_valid_email(data['email']):
             abort(400, description="Invalid email format")
-        updates.append("email = %s")
-        params.append(data['email'])
+        fields['email'] = data['email']
 
     # If no fields are provided, return a 400 error
-    if not updates:
+    if not fields:
         abort(400, description="No fields to update")
 
-    # Add the user_id to the parameters (last parameter)
-    params.append(user_id)
-
-    # Construct the SQL query with the updates
-    sql_query = f"UPDATE user SET {', '.join(updates)} WHERE id = %s"
-
-    cnx = get_db_connection()
-    if cnx:
+    repo = get_repository()
+    if repo:
         try:
-            with cnx.cursor() as cursor:
-                # Execute the update query
-                cursor.execute(sql_query, params)
-                cnx.commit()  # Commit the transaction
-
-                # Check if the user was updated
-                if cursor.rowcount > 0:
-                    return jsonify({"message": "User updated successfully"}), 200
-                else:
-                    abort(404, description="User not found")  # Return 404 if no user found
+            with repo.transaction():
+                updated = repo.users.update(user_id, fields)
+        except DuplicateKeyError as e:
+            message = duplicate_user_message(e)
+            if message:
+                abort(400, description=message)
+            abort(500, description=f"Database error: {str(e)}")
         except Exception as e:
             # Log the error (you might consider adding proper logging)
             abort(500, description=f"Database error: {str(e)}")  # Return 500 if an error occurs
-        finally:
-            cnx.close()  # Ensure the connection is closed
+
+        # Check if the user was updated
+        if updated > 0:
+            tag_index.invalidate_user(user_id)
+            user_cache.delete(user_id)
+            resource_versions.bump(USERS)
+            return jsonify({"message": "User updated successfully"}), 200
+        else:
+            abort(404, description="User not found")  # Return 404 if no user found
     else:
         abort(500, description="Database connection failed")  # Return 500 if connection fails
 
 def delete_user_by_id(user_id):
-    cnx = get_db_connection()
-    if cnx:
+    repo = get_repository()
+    if repo:
         try:
-            with cnx.cursor() as cursor:
-                # Start a transaction
-                cursor.execute("START TRANSACTION;")
-
-                # Check if the user exists
-                cursor.execute("SELECT id FROM user WHERE id = %s", (user_id,))
-                row = cursor.fetchone()
-                
-                if not row:
-                    return jsonify({"message": "User not found"}), 404
-
-                # Delete sessions in the onlinetime table for the user
-                cursor.execute("DELETE FROM onlinetime WHERE user_id = %s", (user_id,))
-
-                # Delete the total time associated with the user
-                cursor.execute("DELETE FROM totaltime WHERE user_id = %s", (user_id,))
-
-                # Now delete the user from the user table
-                cursor.execute("DELETE FROM user WHERE id = %s", (user_id,))
-
-                cnx.commit()  # Commit after all deletions
-
-                return jsonify({"message": f"User with id {user_id} and associated data deleted successfully"}), 200
-
+            # Delete the user with their badge events, sessions and total time in one transaction
+            with repo.transaction():
+                deleted = repo.users.delete(user_id)
         except Exception as e:
-            # Rollback the transaction if there's an error
-            cnx.rollback()
-
             # Return the error message
             return jsonify({"message": f"Error: {str(e)}"}), 500
 
-        finally:
-            cnx.close()  # Ensure the connection is closed
+        if not deleted:
+            return jsonify({"message": "User not found"}), 404
+
+        tag_index.invalidate_user(user_id)
+        user_cache.delete(user_id)
+        if not token_revocations.revoke_user(user_id, current_app.config['API_TOKEN_TTL']):
+            print(f"Error: tokens of deleted user {user_id} could not be revoked")
+        resource_versions.bump(USERS, ONLINETIME, TOTALTIME)
+        return jsonify({"message": f"User with id {user_id} and associated data deleted successfully"}), 200
 
     return jsonify({"message": "Database connection failed"}), 500
 
 
 # /permission functions
 def get_all_permissions():
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT permissionLevel, title FROM permissions")
-            rows = cursor.fetchall()
-            users = [{'permissionLevel': row[0], 
-                      'title': row[1]
-                      } for row in rows]
-            return jsonify(users), 200
+    repo = get_repository()
+    if repo:
+        rows = repo.permissions.list()
+        users = [{'permissionLevel': row[0],
+                  'title': row[1]
+                  } for row in rows]
+        return jsonify(users), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
-    
+
 # /onlinetime functions
+def onlinetime_from_row(row):
+    return {'id': row[0],
+            'firstName': row[1],
+            'lastName': row[2],
+            'dateTimeStart': row[3],
+            'dateTimeStop': row[4],
+            'breakTime': row[5]}
+
 def get_all_onlinetime():
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT User.id, firstName, lastName, dateTimeStart, dateTimeStop, breakTime FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id;")
-            rows = cursor.fetchall()
-            onlineTime = [{'id': row[0], 
-                           'firstName': row[1], 
-                           'lastName': row[2], 
-                           'dateTimeStart': row[3], 
-                           'dateTimeStop': row[4], 
-                           'breakTime': row[5]
-                           } for row in rows]
-            return jsonify(onlineTime), 200
+    paginated, limit, after, error = parse_page_args(request.args, (datetime, int))
+    if error:
+        return jsonify({"message": error}), 400
+    stream = request.args.get('stream')
+    if stream and (stream not in STREAM_FORMATS or paginated):
+        return jsonify({"message": "Invalid stream, expected 'json' or 'ndjson' without limit/after"}), 400
+    repo = get_repository()
+    if repo:
+        if stream:
+            return stream_rows(lambda repo: repo.sessions.iter_all(current_app.config['STREAM_FETCH_SIZE']), onlinetime_from_row, stream)
+        if not paginated:
+            rows = repo.sessions.list()
+        else:
+            rows, next_cursor = next_page_cursor(repo.sessions.list(limit + 1, after), limit, lambda row: (row[3], row[6]))
+        onlineTime = [onlinetime_from_row(row) for row in rows]
+        if paginated:
+            return jsonify({"data": onlineTime, "next": next_cursor}), 200
+        return jsonify(onlineTime), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
-    
+
 def get_onlinetime_by_id(user_id):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT firstName, lastName, dateTimeStart, dateTimeStop, breakTime FROM OnlineTime JOIN `User` ON OnlineTime.user_id = `User`.id where user_id = %s;", (user_id,))
-            rows = cursor.fetchall()
-            onlineTime = [{'firstName': row[0], 
-                           'lastName': row[1], 
-                           'dateTimeStart': row[2], 
-                           'dateTimeStop': row[3], 
-                           'breakTime': row[4]
-                           } for row in rows]
-            return jsonify(onlineTime), 200
+    repo = get_repository()
+    if repo:
+        rows = repo.sessions.list_for_user(user_id)
+        onlineTime = [{'firstName': row[0],
+                       'lastName': row[1],
+                       'dateTimeStart': row[2],
+                       'dateTimeStop': row[3],
+                       'breakTime': row[4]
+                       } for row in rows]
+        return jsonify(onlineTime), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
-    
+
 def create_onlinetime(user_id):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            """
-            check if new session was already created
-            """ 
-            cursor.execute(
-                "SELECT id, dateTimeStart, dateTimeStop, breakTime, user_id  FROM onlinetime where user_id = %s AND dateTimeStop IS NULL order by dateTimeStart desc limit 1;", (user_id,)
-            )
-            row = cursor.fetchone()
-            if row:
-                session = {'id': row[0], 
-                        'dateTimeStart': row[1], 
-                        'dateTimeStop': row[2], 
-                        'breakTime': row[3], 
-                        'user_id': row[4]}
-            try:
-                if row == None:
-                    cursor.execute(
-                    "INSERT INTO OnlineTime (dateTimeStart, user_id) VALUES (NOW(), %s);", (user_id,)
-                    )
-                    cnx.commit()
-                    cursor.execute("SELECT *  FROM onlinetime where user_id = %s AND dateTimeStop IS NULL order by dateTimeStart desc limit 1;", (user_id,)
-                                   )
-                    row = cursor.fetchone()
-                    if row:
-                        user = {'id': row[0], 
-                                'dateTimeStart': row[1], 
-                                'dateTimeStop': row[2], 
-                                'breakTime': row[3], 
-                                'user_id': row[4]}
-                        return jsonify({"message": "Session was succesfully started"}), 200
-                else:
-                    return jsonify({"message": "Error occured, could not open session"}), 400
-            except Exception as e:
-                return jsonify({"message": "Error occured, could not open session"}), 400
+    repo = get_repository()
+    if repo:
+        date_time_start = datetime.now().replace(microsecond=0)
+        try:
+            # The unique (user_id, openSession) key rejects a second open session,
+            # so a single INSERT both checks and opens the session atomically
+            with repo.transaction():
+                session_id = repo.sessions.open(user_id, date_time_start)
+        except DuplicateKeyError:
+            return jsonify({"message": "Error occured, a session is already open"}), 400
+        except Exception as e:
+            print(f"Error: {e}")
+            return jsonify({"message": "Error occured, could not open session"}), 400
+
+        tag_index.session_opened(user_id, session_id, date_time_start)
+        resource_versions.bump(ONLINETIME)
+        publish_clock_event('clock-in', user_id, session_id, date_time_start)
+        session = {'id': session_id,
+                   'dateTimeStart': date_time_start,
+                   'dateTimeStop': None,
+                   'breakTime': None,
+                   'user_id': user_id}
+        return jsonify({"message": "Session was succesfully started", "session": session}), 200
     else:
         return abort(500, description="Database connection failed")
 
 def stop_onlinetime(user_id):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            try:
-                cursor.execute("SELECT id, dateTimeStart, dateTimeStop, user_id  FROM onlinetime where user_id = %s AND dateTimeStop IS NULL order by dateTimeStart desc limit 1;", (user_id,)
-                           )
-                row = cursor.fetchone()
-                if row:
-                    dateStop_check = {'id': row[0], 
-                            'dateTimeStart': row[1], 
-                            'dateTimeStop': row[2],
-                            'user_id': row[3]}
-            except Exception as e:
-                print(f"error: {e}")
-                return(f"error: {e}")
-            else:
-                try:
-                    if all(var is not None for var in (row[0], row[1], row[3])) and row[2] is None:
-                        cursor.execute(
-                        "UPDATE onlinetime SET dateTimeStop = now() WHERE user_id = %s AND dateTimeStop IS NULL;", (user_id,)
-                        )
-                        cnx.commit()
-                        cursor.execute("SELECT *  FROM onlinetime where user_id = %s AND dateTimeStop IS not NULL order by dateTimeStart desc limit 1;", (user_id,)
-                                       )
-                        row = cursor.fetchone()
-                        if row:
-                            session = {'id': row[0], 
-                                    'dateTimeStart': str(row[1]), 
-                                    'dateTimeStop': str(row[2]), 
-                                    'breakTime': row[3], 
-                                    'user_id': row[4]}
-                        cursor.execute("SELECT firstName, lastName FROM `User` where id = %s;", (user_id,)
-                                       )
-                        row2 = cursor.fetchone()
-                        if row2:
-                            user = {'firstName': row2[0],
-                                    'lastName': row2[1]}
-                            
-                        update_total_time(user_id)
-                        return jsonify({"message": "Session was succesfully stopped at: "+ str(row[2]) + ",for the User: "+ row2[0] + " " + row2[1]}), 200
-                    elif row == None:
-                        return jsonify({"message": "Error occured, could not find open session"}), 404
-                    else:
-                        return jsonify({"message": "An unexpected error occured"}), 500
-                except Exception as e:
-                    print(e)
-                    return jsonify({"message": "Error occured, could not find open session"}), 404
-
+    repo = get_repository()
+    if repo:
+        date_time_stop = datetime.now().replace(microsecond=0)
+        try:
+            with repo.transaction():
+                # Lock the user's open session, the unique (user_id, openSession) key makes this a point lookup
+                row = repo.sessions.lock_open(user_id)
+                closed = False
+                if row is not None:
+                    # Close the session and add its length to TotalTime and the daily/weekly rollups
+                    closed = repo.sessions.close(row[0], user_id, date_time_stop, session_seconds(row[1], date_time_stop))
+                    if closed:
+                        repo.rollups.apply(added=[(user_id, row[1], date_time_stop)])
+        except Exception as e:
+            print(f"Error: {e}")
+            return jsonify({"message": "An unexpected error occured"}), 500
+
+        if row is None:
+            return jsonify({"message": "Error occured, could not find open session"}), 404
+        if not closed:
+            # The session is locked as open, so the user's TotalTime row is missing
+            print(f"Error: cannot close session {row[0]}, user {user_id} has no TotalTime row")
+            return jsonify({"message": "Session could not be stopped, the user's total time record is missing"}), 500
+
+        tag_index.session_closed(user_id)
+        resource_versions.bump(ONLINETIME, TOTALTIME)
+        publish_clock_event('clock-out', user_id, row[0], row[1], date_time_stop)
+        session = {'id': row[0],
+                   'dateTimeStart': row[1],
+                   'dateTimeStop': date_time_stop,
+                   'breakTime': row[2],
+                   'user_id': user_id}
+        return jsonify({"message": "Session was succesfully stopped at: " + date_time_stop.isoformat() + ",for the User: " + row[3] + " " + row[4],
+                        "session": session}), 200
     else:
         return abort(500, description="Database connection failed")
 
+def toggle_onlinetime_by_tag(tag_num):
+    """
+    Clocks the owner of a badge in or out, whichever applies.
+    The user and open-session state come from the in-memory tag index, so only the write reaches the database.
+    :param tag_num: The tag number read by the kiosk.
+    :return: JSON response with the resulting session and status code.
+    """
+    repo = get_repository()
+    if not repo:
+        return abort(500, description="Database connection failed")
+
+    # One retry covers an index entry made stale by a punch on another worker
+    for attempt in range(2):
+        entry = tag_index.lookup(tag_num)
+        if entry is None:
+            return jsonify({"message": "Unknown tag number"}), 404
+        now = datetime.now().replace(microsecond=0)
+        try:
+            if entry.open_session_id is None:
+                with repo.transaction():
+                    session_id = repo.sessions.open(entry.user_id, now)
+                tag_index.session_opened(entry.user_id, session_id, now)
+                resource_versions.bump(ONLINETIME)
+                publish_clock_event('clock-in', entry.user_id, session_id, now)
+                session = {'id': session_id,
+                           'dateTimeStart': now,
+                           'dateTimeStop': None,
+                           'breakTime': None,
+                           'user_id': entry.user_id}
+                return jsonify({"message": "Session was succesfully started", "session": session}), 200
+
+            with repo.transaction():
+                closed = repo.sessions.close(entry.open_session_id, entry.user_id, now, session_seconds(entry.open_since, now))
+                if closed:
+                    repo.rollups.apply(added=[(entry.user_id, entry.open_since, now)])
+            if closed:
+                tag_index.session_closed(entry.user_id)
+                resource_versions.bump(ONLINETIME, TOTALTIME)
+                publish_clock_event('clock-out', entry.user_id, entry.open_session_id, entry.open_since, now)
+                session = {'id': entry.open_session_id,
+                           'dateTimeStart': entry.open_since,
+                           'dateTimeStop': now,
+                           'breakTime': None,
+                           'user_id': entry.user_id}
+                return jsonify({"message": "Session was succesfully stopped", "session": session}), 200
+        except DuplicateKeyError:
+            pass
+        except Exception as e:
+            print(f"Error: {e}")
+            return jsonify({"message": "An unexpected error occured"}), 500
+        tag_index.invalidate_user(entry.user_id)
+
+    return jsonify({"message": "Session state changed concurrently, try again"}), 409
+
 def update_onlinetime(user_id, session_time_identifier, data):
     """
     Updates online time session in the database.
@@ -408,55 +416,58 @@ def update_onlinetime(user_id, session_time_identifier, data):
     :param data: JSON data containing the fields to update.
     :return: JSON response and status code.
     """
-    updates = []
-    params = []
-
     # Validate session_time_identifier format
     if not is_valid_datetime(session_time_identifier):
         return jsonify({"message": "Invalid session_time_identifier format. Expected YYYY-MM-DD HH:MM:SS."}), 400
 
+    new_start = None
+    new_stop = None
+
     # Check each field and add to updates if it's provided
     if 'dateTimeStart' in data and data['dateTimeStart']:
         if not is_valid_datetime(data['dateTimeStart']):
             return jsonify({"message": "Invalid dateTimeStart format. Expected YYYY-MM-DD HH:MM:SS."}), 400
-        updates.append("dateTimeStart = %s")
-        params.append(data['dateTimeStart'])
+        new_start = parse_datetime(data['dateTimeStart'])
 
     if 'dateTimeStop' in data and data['dateTimeStop']:
         if not is_valid_datetime(data['dateTimeStop']):
             return jsonify({"message": "Invalid dateTimeStop format. Expected YYYY-MM-DD HH:MM:SS."}), 400
-        updates.append("dateTimeStop = %s")
-        params.append(data['dateTimeStop'])
+        new_stop = parse_datetime(data['dateTimeStop'])
 
     # If no fields are provided, return a 400 error
-    if not updates:
+    if new_start is None and new_stop is None:
         return jsonify({"message": "No fields to update"}), 400
+    if new_start is not None and new_stop is not None and new_start > new_stop:
+        return jsonify({"message": "dateTimeStart must not be after dateTimeStop"}), 400
 
-    # Add the user_id and session_time_identifier as the last parameters
-    params.append(user_id)
-    params.append(session_time_identifier)
-
-    # Construct the SQL query
-    set_clause = ", ".join(updates)
-    sql_query = f"UPDATE onlinetime SET {set_clause} WHERE user_id = %s AND dateTimeStop = %s"
-
-    cnx = get_db_connection()
-    if cnx:
+    repo = get_repository()
+    if repo:
+        inverted = False
         try:
-            with cnx.cursor() as cursor:
-                cursor.execute(sql_query, params)  # Execute the query
-                cnx.commit()  # Commit the transaction
-
-                if cursor.rowcount > 0:
-                    update_total_time(user_id)  # Update total time after editing session
-                    return jsonify({"message": "Session updated successfully"}), 200
-                else:
-                    return jsonify({"message": "Session not found or no changes made"}), 404
+            with repo.transaction():
+                # Lock the affected sessions so the TotalTime delta matches what gets written
+                rows = repo.sessions.lock_by_stop(user_id, parse_datetime(session_time_identifier))
+                # The new start or stop may only be invalid against the stored other end, check before writing anything
+                inverted = any((new_start or start) > (new_stop or stop) for session_id, start, stop in rows)
+                if rows and not inverted:
+                    delta_seconds = 0
+                    for session_id, start, stop in rows:
+                        delta_seconds += session_seconds(new_start or start, new_stop or stop) - session_seconds(start, stop)
+
+                    repo.sessions.update_times([row[0] for row in rows], new_start, new_stop)
+                    repo.totals.add(user_id, delta_seconds)
+                    repo.rollups.apply(added=[(user_id, new_start or start, new_stop or stop) for session_id, start, stop in rows],
+                                       removed=[(user_id, start, stop) for session_id, start, stop in rows])
         except Exception as e:
             print(f"Database error: {str(e)}")
             return jsonify({"message": f"Database error: {str(e)}"}), 500
-        finally:
-            cnx.close()
+
+        if not rows:
+            return jsonify({"message": "Session not found or no changes made"}), 404
+        if inverted:
+            return jsonify({"message": "dateTimeStart must not be after dateTimeStop"}), 400
+        resource_versions.bump(ONLINETIME, TOTALTIME)
+        return jsonify({"message": "Session updated successfully"}), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
@@ -474,72 +485,315 @@ def delete_onlineTime_by_id(user_id, session_time_identifier):
     if not is_valid_datetime(session_time_identifier):
         return jsonify({"message": "Invalid session_time_identifier format. Expected YYYY-MM-DD HH:MM:SS."}), 400
 
-    cnx = get_db_connection()
-    if cnx:
+    repo = get_repository()
+    if repo:
         try:
-            with cnx.cursor() as cursor:
-                # Check if the session exists
-                cursor.execute(
-                    "SELECT * FROM OnlineTime WHERE user_id = %s AND dateTimeStop = %s;",
-                    (user_id, session_time_identifier)
-                )
-                row = cursor.fetchone()
-
-                if not row:
-                    return jsonify({"message": "Session not found"}), 404
-
-                # Delete the session
-                cursor.execute(
-                    "DELETE FROM OnlineTime WHERE user_id = %s AND dateTimeStop = %s;",
-                    (user_id, session_time_identifier)
-                )
-                cnx.commit()  # Commit the transaction
-
-                # Update the total time for the user
-                update_total_time(user_id)
-
-                return jsonify({"message": f"Session from User with id {user_id} was deleted successfully"}), 200
+            with repo.transaction():
+                # Check if the session exists and lock it until the TotalTime update is done
+                rows = repo.sessions.lock_by_stop(user_id, parse_datetime(session_time_identifier))
+                if rows:
+                    # Delete the session and remove its time from the user's total
+                    repo.sessions.delete([row[0] for row in rows])
+                    repo.totals.add(user_id, -sum(session_seconds(row[1], row[2]) for row in rows))
+                    repo.rollups.apply(removed=[(user_id, row[1], row[2]) for row in rows])
         except Exception as e:
             print(f"Error: {e}")  # Log the error
             return jsonify({"message": f"An internal error occurred: {str(e)}"}), 500
-        finally:
-            cnx.close()  # Ensure the connection is closed
+
+        if not rows:
+            return jsonify({"message": "Session not found"}), 404
+        resource_versions.bump(ONLINETIME, TOTALTIME)
+        return jsonify({"message": f"Session from User with id {user_id} was deleted successfully"}), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
 
+def ingest_punch_batch():
+    """
+    Applies a burst of badge reader events in one transaction.
+    Expects a JSON body {"events": [{"key": ..., "tagNum": ..., "timestamp": ..., "direction": "in"|"out"}, ...]}.
+    :return: JSON response with one result per event, in request order, and status code.
+    """
+    data = request.get_json(silent=True) or {}
+    events = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(events, list) or not events:
+        return jsonify({"error": "Required field is missing (events)"}), 400
+    if len(events) > current_app.config['PUNCH_BATCH_MAX_EVENTS']:
+        return jsonify({"error": f"Too many events, at most {current_app.config['PUNCH_BATCH_MAX_EVENTS']} per batch"}), 413
+
+    results = [None] * len(events)
+    punches = []  # (index, key, tagNum, timestamp, direction) of the well-formed events
+    batch_keys = set()
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            results[index] = {'key': None, 'status': 'rejected', 'message': "Event must be an object"}
+            continue
+        key = event.get('key')
+        tag_num = event.get('tagNum')
+        timestamp = parse_datetime(event.get('timestamp'))
+        direction = event.get('direction')
+        if not isinstance(key, str) or not key or len(key) > 64:
+            results[index] = {'key': key, 'status': 'rejected', 'message': "Invalid key, expected a string of at most 64 characters"}
+        elif tag_num is None:
+            results[index] = {'key': key, 'status': 'rejected', 'message': "Required field is missing (tagNum)"}
+        elif timestamp is None:
+            results[index] = {'key': key, 'status': 'rejected', 'message': "Invalid timestamp format. Expected YYYY-MM-DD HH:MM:SS."}
+        elif direction not in ('in', 'out'):
+            results[index] = {'key': key, 'status': 'rejected', 'message': "Invalid direction, expected 'in' or 'out'"}
+        elif key in batch_keys:
+            results[index] = {'key': key, 'status': 'duplicate'}
+        else:
+            batch_keys.add(key)
+            punches.append((index, key, str(tag_num), timestamp, direction))
+
+    if not punches:
+        return jsonify({"results": results}), 200
+
+    repo = get_repository()
+    if not repo:
+        return jsonify({"message": "Database connection failed"}), 500
+
+    try:
+        with repo.transaction():
+            # Resolve all tags to users in one query
+            user_by_tag = repo.users.ids_by_tags(sorted({punch[2] for punch in punches}))
+
+            # Drop events that an earlier upload already applied
+            applied_keys = repo.sessions.existing_event_keys([punch[1] for punch in punches])
+
+            punches_by_user = {}
+            for index, key, tag_num, timestamp, direction in punches:
+                if key in applied_keys:
+                    results[index] = {'key': key, 'status': 'duplicate'}
+                elif tag_num not in user_by_tag:
+                    results[index] = {'key': key, 'status': 'rejected', 'message': "Unknown tag number"}
+                else:
+                    punches_by_user.setdefault(user_by_tag[tag_num], []).append((timestamp, index, key, direction))
+
+            # Lock the open sessions of every affected user
+            user_ids = sorted(punches_by_user)
+            open_sessions = repo.sessions.lock_open_for_users(user_ids) if user_ids else {}
+
+            closed_sessions = []  # (dateTimeStop, id) of sessions that were already open
+            new_sessions = []     # (dateTimeStart, dateTimeStop, user_id) of sessions opened in this batch
+            punch_events = []     # (eventKey, user_id, eventTime, direction)
+            total_deltas = []     # (delta_seconds, user_id)
+            completed = []        # (user_id, dateTimeStart, dateTimeStop) of sessions closed in this batch
+            clock_events = []     # (kind, user_id, session id, dateTimeStart, dateTimeStop) for the event feed
+            for user_id in user_ids:
+                session_id, open_since = open_sessions.get(user_id, (None, None))
+                delta_seconds = 0
+                for timestamp, index, key, direction in sorted(punches_by_user[user_id]):
+                    if direction == 'in':
+                        if open_since is not None:
+                            results[index] = {'key': key, 'status': 'rejected', 'message': "A session is already open"}
+                            continue
+                        session_id, open_since = None, timestamp
+                    else:
+                        if open_since is None:
+                            results[index] = {'key': key, 'status': 'rejected', 'message': "No open session to stop"}
+                            continue
+                        if timestamp < open_since:
+                            results[index] = {'key': key, 'status': 'rejected', 'message': "Timestamp is before the session start"}
+                            continue
+                        if session_id is not None:
+                            closed_sessions.append((timestamp, session_id))
+                        else:
+                            new_sessions.append((open_since, timestamp, user_id))
+                        delta_seconds += session_seconds(open_since, timestamp)
+                        completed.append((user_id, open_since, timestamp))
+                        clock_events.append(('clock-out', user_id, session_id, open_since, timestamp))
+                        session_id, open_since = None, None
+                    punch_events.append((key, user_id, timestamp, direction))
+                    results[index] = {'key': key, 'status': 'applied'}
+                if session_id is None and open_since is not None:
+                    new_sessions.append((open_since, None, user_id))  # Left open by the batch
+                    clock_events.append(('clock-in', user_id, None, open_since, None))
+                if delta_seconds:
+                    total_deltas.append((delta_seconds, user_id))
+
+            # Close pre-existing sessions before inserting new open ones so the open-session key holds
+            repo.sessions.close_many(closed_sessions)
+            repo.sessions.insert_many(new_sessions)
+            if new_sessions and event_broker.has_subscribers():
+                # executemany returns no ids, the event feed gets the ids of the new sessions by their start
+                session_ids = repo.sessions.ids_by_start(new_sessions)
+                clock_events = [(kind, user_id, session_id or session_ids.get((user_id, start)), start, stop)
+                                for kind, user_id, session_id, start, stop in clock_events]
+            repo.sessions.record_events(punch_events)
+            # One TotalTime update per affected user, one rollup row per affected day and week
+            repo.totals.add_many(total_deltas)
+            repo.rollups.apply(added=completed)
+    except DuplicateKeyError:
+        # A concurrent upload applied some of the same events, the terminal can safely resend the batch
+        return jsonify({"message": "Batch conflicts with a concurrent upload, retry the batch"}), 409
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"message": f"An internal error occurred: {str(e)}"}), 500
+
+    # Ids of sessions opened by executemany are unknown, let the index reload the affected users
+    for user_id in {event[1] for event in punch_events}:
+        tag_index.invalidate_user(user_id)
+    if punch_events:
+        resource_versions.bump(ONLINETIME, TOTALTIME)
+    for clock_event in clock_events:
+        publish_clock_event(*clock_event)
+    return jsonify({"results": results}), 200
+
+
+def stream_onlinetime():
+    """
+    Streams the currently open sessions, then every clock-in and clock-out as Server-Sent Events.
+    The database is read once for the snapshot; the stream itself holds no connection.
+    :return: A text/event-stream response.
+    """
+    repo = get_repository()
+    if not repo:
+        return jsonify({"message": "Database connection failed"}), 500
+
+    # Subscribe before reading the snapshot so no punch falls between the two
+    subscriber = event_broker.subscribe(current_app.config['SSE_QUEUE_SIZE'])
+    try:
+        rows = repo.sessions.list_open()
+    except Exception as e:
+        event_broker.unsubscribe(subscriber)
+        return jsonify({"message": f"An internal error occurred: {str(e)}"}), 500
+    snapshot = [{'id': row[0],
+                 'user_id': row[1],
+                 'firstName': row[2],
+                 'lastName': row[3],
+                 'dateTimeStart': row[4]} for row in rows]
+    return Response(
+        stream_with_context(sse_stream(subscriber, snapshot, current_app.config['SSE_HEARTBEAT_INTERVAL'])),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # /totaltime functions
+def totaltime_from_row(row):
+    return {'user_id': row[0],
+            'firstName': row[1],
+            'lastName': row[2],
+            'sumTime': format_seconds(row[3]),
+            'sumSeconds': row[3],
+            'daysWorked': row[3] // 86400,
+            'breakTime': row[4]}
+
 def get_all_totaltime():
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT `User`.id, firstName, lastName, sumTime, daysWorked, breakTime FROM totaltime JOIN `User` ON totalTime.user_id = `User`.id;")
-            rows = cursor.fetchall()
-            totalTime = [{'user_id': row[0], 
-                          'firstName': row[1], 
-                          'lastName': row[2], 
-                          'sumTime': str(row[3]),
-                          'daysWorked': row[4], 
-                          'breakTime': str(row[5])
-                          } for row in rows]
-            return jsonify(totalTime), 200
+    paginated, limit, after, error = parse_page_args(request.args, (int,))
+    if error:
+        return jsonify({"message": error}), 400
+    stream = request.args.get('stream')
+    if stream and (stream not in STREAM_FORMATS or paginated):
+        return jsonify({"message": "Invalid stream, expected 'json' or 'ndjson' without limit/after"}), 400
+    repo = get_repository()
+    if repo:
+        if stream:
+            return stream_rows(lambda repo: repo.totals.iter_all(current_app.config['STREAM_FETCH_SIZE']), totaltime_from_row, stream)
+        if not paginated:
+            rows = repo.totals.list()
+        else:
+            rows, next_cursor = next_page_cursor(repo.totals.list(limit + 1, after[0] if after else None), limit, lambda row: (row[0],))
+        totalTime = [totaltime_from_row(row) for row in rows]
+        if paginated:
+            return jsonify({"data": totalTime, "next": next_cursor}), 200
+        return jsonify(totalTime), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
 
 def get_totaltime_by_id(user_id):
-    cnx = get_db_connection()
-    if cnx:
-        with cnx.cursor() as cursor:
-            cursor.execute("SELECT `User`.id, firstName, lastName, sumTime, daysWorked, breakTime FROM totaltime JOIN `User` ON totalTime.user_id = `User`.id where `User`.id = %s;", (user_id,))
-            rows = cursor.fetchall()
-            totalTime = [{'user.id': row[0], 
-                          'firstName': row[1], 
-                          'lastName': row[2], 
-                          'sumTime': str(row[3]),
-                          'daysWorked': row[4], 
-                          'breakTime': str(row[5])
-                          } for row in rows]
-            return jsonify(totalTime), 200
+    repo = get_repository()
+    if repo:
+        rows = repo.totals.list_for_user(user_id)
+        totalTime = [{'user.id': row[0],
+                      'firstName': row[1],
+                      'lastName': row[2],
+                      'sumTime': format_seconds(row[3]),
+                      'sumSeconds': row[3],
+                      'daysWorked': row[3] // 86400,
+                      'breakTime': row[4]
+                      } for row in rows]
+        return jsonify(totalTime), 200
+    else:
+        return jsonify({"message": "Database connection failed"}), 500
+
+ROLLUP_GRANULARITIES = ('day', 'week')
+
+def get_totaltime_range(user_id=None):
+    """
+    Returns the worked time per day or per ISO week between the 'from' and 'to' dates.
+    Reads the daily/weekly rollups, so the cost grows with the number of days, not of sessions.
+    :param user_id: Restrict the report to one user, None for all users.
+    :return: JSON response and status code.
+    """
+    first_day = parse_date(request.args.get('from'))
+    last_day = parse_date(request.args.get('to'))
+    granularity = request.args.get('granularity', 'day')
+    if first_day is None or last_day is None:
+        return jsonify({"message": "Invalid from/to format. Expected YYYY-MM-DD."}), 400
+    if first_day > last_day:
+        return jsonify({"message": "from must not be after to"}), 400
+    if granularity not in ROLLUP_GRANULARITIES:
+        return jsonify({"message": "Invalid granularity, expected 'day' or 'week'"}), 400
+
+    repo = get_repository()
+    if repo:
+        if granularity == 'day':
+            rows = repo.rollups.daily(first_day, last_day, user_id)
+        else:
+            rows = repo.rollups.weekly(first_day, last_day, user_id)
+        totalTime = [{'user_id': row[0],
+                      'firstName': row[1],
+                      'lastName': row[2],
+                      granularity: row[3].isoformat() if granularity == 'day' else iso_week(row[3]),
+                      'sumTime': format_seconds(row[4]),
+                      'sumSeconds': row[4]
+                      } for row in rows]
+        return jsonify({"from": first_day.isoformat(), "to": last_day.isoformat(),
+                        "granularity": granularity, "data": totalTime}), 200
     else:
         return jsonify({"message": "Database connection failed"}), 500
-    
+
+
+# /me functions
+def get_user_summary(user_id):
+    """
+    Returns everything the user dashboard shows: profile, open session, time worked today and in total.
+    Today's time is read from the daily rollup plus the part of the open session since midnight.
+    :param user_id: The ID of the logged in user.
+    :return: JSON response and status code.
+    """
+    repo = get_repository()
+    if not repo:
+        return jsonify({"message": "Database connection failed"}), 500
+
+    now = datetime.now().replace(microsecond=0)
+    row = repo.users.summary(user_id, now.date())
+    if row is None:
+        return jsonify({"message": "User not found"}), 404
+
+    open_session = None
+    today_seconds = row[9] or 0
+    if row[6] is not None:
+        elapsed_seconds = session_seconds(row[7], now)
+        today_seconds += split_session_by_day(row[7], now).get(now.date(), 0)
+        open_session = {'id': row[6],
+                        'dateTimeStart': row[7],
+                        'breakTime': row[8],
+                        'elapsedTime': format_seconds(elapsed_seconds),
+                        'elapsedSeconds': elapsed_seconds}
+    summary = {'user': {'id': row[0],
+                        'firstName': row[1],
+                        'lastName': row[2],
+                        'tagNum': row[3],
+                        'email': row[4],
+                        'permission': row[5]},
+               'openSession': open_session,
+               'today': {'day': now.date(),
+                         'sumTime': format_seconds(today_seconds),
+                         'sumSeconds': today_seconds},
+               'total': {'sumTime': format_seconds(row[10] or 0),
+                         'sumSeconds': row[10] or 0,
+                         'breakTime': row[11]}}
+    return jsonify(summary), 200
@@ -131,6 +131,45 @@ async function fetchPermissions() {
     }
 }
 
+/* Everything the user dashboard shows, from /me/summary */
+async function fetchSummary() {
+    try {
+        const response = await fetch(`/me/summary`);
+        if (!response.ok) {
+            throw new Error('Network response was not ok');
+        }
+        const data = await response.json();
+        document.getElementById('summary').innerText = JSON.stringify(data); // Display the summary
+    } catch (error) {
+        console.error('There was a problem with the fetch operation:', error);
+    }
+}
+
+/* Load every admin listing with one /batch round trip */
+async function fetchAdminDashboard() {
+    const targets = {'/totaltime/all': 'result7', '/onlinetime/all': 'result6', '/users/all': 'result1'};
+    try {
+        const csrfToken = document.querySelector('[name=csrf_token]').value;
+        const response = await fetch(`/batch`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken
+            },
+            body: JSON.stringify({requests: Object.keys(targets)})
+        });
+        if (!response.ok) {
+            throw new Error('Network response was not ok');
+        }
+        const data = await response.json();
+        data.responses.forEach((result) => {
+            document.getElementById(targets[result.path]).innerText = JSON.stringify(result.body); // Display each listing
+        });
+    } catch (error) {
+        console.error('There was a problem with the fetch operation:', error);
+    }
+}
+
 /* Onlinetime Requests */
 async function fetchALLOnlineTime() {
     try {
@@ -145,6 +184,37 @@ async function fetchALLOnlineTime() {
     }
 }
 
+/* Live list of who is clocked in, kept current by the /onlinetime/stream events */
+let onlineTimeStream = null;
+
+function watchOnlineTime() {
+    if (onlineTimeStream) {
+        return;
+    }
+    const clockedIn = new Map();
+    const render = () => {
+        document.getElementById('presence').innerText = JSON.stringify([...clockedIn.values()]); // Display open sessions
+    };
+    onlineTimeStream = new EventSource(`/onlinetime/stream`);
+    onlineTimeStream.addEventListener('snapshot', (event) => {
+        clockedIn.clear();
+        JSON.parse(event.data).sessions.forEach((session) => clockedIn.set(session.user_id, session));
+        render();
+    });
+    onlineTimeStream.addEventListener('clock-in', (event) => {
+        const session = JSON.parse(event.data);
+        clockedIn.set(session.user_id, session);
+        render();
+    });
+    onlineTimeStream.addEventListener('clock-out', (event) => {
+        clockedIn.delete(JSON.parse(event.data).user_id);
+        render();
+    });
+    onlineTimeStream.onerror = (error) => {
+        console.error('Onlinetime stream interrupted, reconnecting:', error); // EventSource reconnects and gets a new snapshot
+    };
+}
+
 async function fetchOnlineTime() {
     try {
         const response = await fetch(`/onlinetime`);
@@ -0,0 +1,137 @@
+"""
+Delta sync for dashboard replicas
+
+Triggers on User, OnlineTime and TotalTime append one ChangeLog row per
+written row. A client keeps a local copy current by calling
+GET /sync?since=<version> with the version of its previous response and
+applying the returned rows and deletions.
+
+Functions:
+ - get_sync(): Returns the rows changed since a version, or a full snapshot for since=0.
+ - init_sync(app): Registers the `flask prune-changelog` command.
+"""
+import click
+from flask import jsonify, request, current_app
+from .repositories import get_repository
+from .utils import format_seconds
+
+# ChangeLog.tableName -> key of the response
+SYNC_KEYS = {'User': 'users', 'OnlineTime': 'onlinetime', 'TotalTime': 'totaltime'}
+
+
+def _user_item(row):
+    return {'id': row[0],
+            'firstName': row[1],
+            'lastName': row[2],
+            'tagNum': row[3],
+            'email': row[4],
+            'permission_id': row[5]}
+
+
+def _onlinetime_item(row):
+    return {'id': row[0],
+            'user_id': row[1],
+            'dateTimeStart': row[2],
+            'dateTimeStop': row[3],
+            'breakTime': row[4]}
+
+
+def _totaltime_item(row):
+    return {'id': row[0],
+            'user_id': row[1],
+            'sumTime': format_seconds(row[2]),
+            'sumSeconds': row[2],
+            'breakTime': row[3]}
+
+
+def _read_rows(repo, table, ids=None):
+    """
+    Returns the sync items of the given row ids (all rows if ids is None) of a tracked table.
+    """
+    if table == 'User':
+        return [_user_item(row) for row in repo.users.sync_rows(ids)]
+    if table == 'OnlineTime':
+        return [_onlinetime_item(row) for row in repo.sessions.sync_rows(ids)]
+    return [_totaltime_item(row) for row in repo.totals.sync_rows(ids)]
+
+
+def get_sync():
+    """
+    Returns the rows inserted, updated or deleted after the 'since' version.
+    :return: JSON {"version", "more", "users", "onlinetime", "totaltime", "deleted": {...}} and status code.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"message": "Invalid since, expected a version number"}), 400
+    if since < 0:
+        return jsonify({"message": "Invalid since, expected a version number"}), 400
+
+    repo = get_repository()
+    if not repo:
+        return jsonify({"message": "Database connection failed"}), 500
+
+    oldest, latest = repo.changes.bounds()
+    response = {key: [] for key in SYNC_KEYS.values()}
+    response['deleted'] = {key: [] for key in SYNC_KEYS.values()}
+
+    if since == 0:
+        # Full snapshot; read the version first so changes made meanwhile are sent again next time.
+        # As below, a transaction holding a lower version than a change logged moments ago may still
+        # commit after the rows are read, so the version stops short of the recent changes
+        version = repo.changes.settled_version(current_app.config['SYNC_SETTLE_SECONDS'])
+        for table, key in SYNC_KEYS.items():
+            response[key] = _read_rows(repo, table)
+        response.update(version=version, more=False)
+        return jsonify(response), 200
+
+    if since > latest:
+        return jsonify({"message": "Unknown version, resync with since=0"}), 410
+    if oldest and since < oldest - 1:
+        return jsonify({"message": "Changes since this version were pruned, resync with since=0"}), 410
+
+    limit = current_app.config['SYNC_PAGE_SIZE']
+    settle = current_app.config['SYNC_SETTLE_SECONDS']
+    changes = repo.changes.since(since, limit)
+
+    # A change logged moments ago may belong to a transaction that commits after a newer one,
+    # so the returned version stops short of it and the client receives it again next time
+    version = changes[-1][0] if changes else since
+    for change_version, table, row_id, operation, age in changes:
+        if age is not None and age < settle:
+            version = min(version, change_version - 1)
+            break
+
+    # Only the latest operation per row matters
+    latest_operation = {}
+    for change_version, table, row_id, operation, age in changes:
+        latest_operation[(table, row_id)] = operation
+
+    for table, key in SYNC_KEYS.items():
+        upserts = [row_id for (name, row_id), operation in latest_operation.items() if name == table and operation == 'upsert']
+        deletes = {row_id for (name, row_id), operation in latest_operation.items() if name == table and operation == 'delete'}
+        if upserts:
+            response[key] = _read_rows(repo, table, upserts)
+            # Rows deleted after the last change read here show up as missing
+            deletes.update(set(upserts) - {item['id'] for item in response[key]})
+        response['deleted'][key] = sorted(deletes)
+
+    response.update(version=max(version, since), more=len(changes) == limit)
+    return jsonify(response), 200
+
+
+def init_sync(app):
+    """
+    Registers the `flask prune-changelog` command.
+    """
+    @app.cli.command('prune-changelog')
+    @click.option('--days', type=int, default=None, help='Keep this many days of changes (default SYNC_LOG_RETENTION_DAYS).')
+    def prune_changelog(days):
+        """Delete old ChangeLog rows; clients older than that have to resync with since=0."""
+        days = current_app.config['SYNC_LOG_RETENTION_DAYS'] if days is None else days
+        repo = get_repository()
+        if repo is None:
+            raise click.ClickException("Database connection failed")
+        with repo.transaction():
+            deleted = repo.changes.prune(days * 86400)
+        click.echo(f"Deleted {deleted} changes older than {days} days")
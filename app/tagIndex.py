@@ -0,0 +1,182 @@
+"""
+In-memory tagNum lookup index
+
+This module keeps a process-local hash index from a badge's tagNum to the
+user it belongs to and that user's open session, so tag driven kiosk
+requests can be answered without a database read. With CACHE_BACKEND =
+'shared' every change to an index is also counted in a shared counter, and a
+worker that finds it moved on by a change of another worker drops its index
+and reloads tags as they are looked up.
+
+Classes:
+ - TagIndex: The index itself, warmed from the database and kept current by the write paths.
+
+Objects:
+ - tag_index: The index instance shared by the application.
+"""
+import threading
+from collections import namedtuple
+from .repositories import get_repository
+from .cache import shared_counters
+
+# Shared counter of the changes made to any worker's index
+TAG_INDEX_COUNTER = 'tagIndex'
+
+# open_session_id and open_since are None while the user is clocked out
+TagEntry = namedtuple('TagEntry', ['user_id', 'permission_id', 'open_session_id', 'open_since'])
+
+
+class TagIndex:
+    """
+    Maps tagNum -> TagEntry.
+
+    Missing tags are loaded from the database on first lookup. Writers either
+    update an entry in place (punches) or drop it (user changes); every drop
+    bumps a generation counter so a lookup that raced with it does not store
+    the stale row it read.
+    """
+    def __init__(self, counters=None):
+        self._entries = {}
+        self._tag_by_user = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'resets': 0}
+        self._counters = counters
+        self._seen = counters.get(TAG_INDEX_COUNTER) if counters is not None else 0
+
+    def _reset(self):
+        self._entries.clear()
+        self._tag_by_user.clear()
+        self._generation += 1
+
+    def _sync(self):
+        """
+        Drops the index if another worker changed its own since this one last looked.
+        """
+        if self._counters is None:
+            return
+        current = self._counters.get(TAG_INDEX_COUNTER)
+        if current != self._seen:
+            self._reset()
+            self._stats['resets'] += 1
+            self._seen = current
+
+    def _publish(self):
+        """
+        Tells the other workers that this index changed.
+        """
+        if self._counters is None:
+            return
+        value = self._counters.bump(TAG_INDEX_COUNTER)
+        # Only skip our own change, a change of another worker in between still has to reset us
+        if value == self._seen + 1:
+            self._seen = value
+
+    def _store(self, row):
+        tag_num, user_id, permission_id, session_id, open_since = row
+        old_tag = self._tag_by_user.get(user_id)
+        if old_tag is not None and old_tag != tag_num:
+            self._entries.pop(old_tag, None)
+        self._entries[tag_num] = TagEntry(user_id, permission_id, session_id, open_since)
+        self._tag_by_user[user_id] = tag_num
+
+    def warm(self):
+        """
+        Loads every user with a tag into the index.
+
+        Returns:
+            bool: True if the index was loaded, False if the database could not be read.
+        """
+        seen = self._counters.get(TAG_INDEX_COUNTER) if self._counters is not None else 0
+        repo = get_repository()
+        if not repo:
+            return False
+        try:
+            rows = repo.users.tag_entries()
+        except Exception as e:
+            print(f"Error warming tag index: {e}")
+            return False
+        with self._lock:
+            self._reset()
+            self._seen = seen
+            for row in rows:
+                self._store(row)
+        return True
+
+    def lookup(self, tag_num):
+        """
+        Returns the TagEntry for a tag, loading it from the database on a miss.
+
+        Returns:
+            TagEntry: The user and open-session state, or None if no user has this tag.
+        """
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(tag_num)
+            if entry is not None:
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+            generation = self._generation
+
+        repo = get_repository()
+        if not repo:
+            return None
+        rows = repo.users.tag_entries(tag_num)
+        if not rows:
+            return None
+        row = rows[0]
+        with self._lock:
+            self._sync()
+            if generation == self._generation:
+                self._store(row)
+        return TagEntry(*row[1:])
+
+    def session_opened(self, user_id, session_id, open_since):
+        """
+        Records that the user clocked in.
+        """
+        with self._lock:
+            self._sync()
+            tag_num = self._tag_by_user.get(user_id)
+            if tag_num is not None:
+                self._entries[tag_num] = self._entries[tag_num]._replace(open_session_id=session_id, open_since=open_since)
+            self._publish()
+
+    def session_closed(self, user_id):
+        """
+        Records that the user clocked out.
+        """
+        self.session_opened(user_id, None, None)
+
+    def invalidate_user(self, user_id):
+        """
+        Drops the entry of a user whose row changed or was deleted.
+        """
+        with self._lock:
+            self._generation += 1
+            tag_num = self._tag_by_user.pop(user_id, None)
+            if tag_num is not None:
+                self._entries.pop(tag_num, None)
+            self._publish()
+
+    def invalidate_tag(self, tag_num):
+        """
+        Drops the entry of a tag that was (re)assigned.
+        """
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.pop(tag_num, None)
+            if entry is not None:
+                self._tag_by_user.pop(entry.user_id, None)
+            self._publish()
+
+    def stats(self):
+        """
+        Returns the number of indexed tags and the hit/miss/reset counters.
+        """
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+tag_index = TagIndex(shared_counters)
@@ -0,0 +1,85 @@
+"""
+Test fixtures
+
+The application runs in-process on the SQLite database set up by the
+top-level conftest.py, emptied before every test.
+"""
+import sqlite3
+
+import pytest
+from app import app as flask_app
+from app.apiTokens import token_revocations
+from app.cache import user_cache
+from app.passwordHashing import password_hasher
+from app.rateLimit import rate_limiter
+from app.repositories import get_repository
+from app.tagIndex import tag_index
+
+PASSWORD = 'secret-password'
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    yield flask_app
+
+
+@pytest.fixture
+def db():
+    """
+    A connection to the test database for setting up and checking rows behind the application's back.
+    """
+    cnx = sqlite3.connect(flask_app.config['SQLITE_DATABASE_PATH'], isolation_level=None)
+    yield cnx
+    cnx.close()
+
+
+@pytest.fixture(autouse=True)
+def empty_database(db):
+    """
+    Deletes every row except the seeded Permissions and resets the in-process caches.
+    """
+    tables = [row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT IN ('Permissions', 'sqlite_sequence')")]
+    db.execute("PRAGMA foreign_keys = OFF")
+    for table in tables:
+        db.execute(f"DELETE FROM `{table}`")
+    db.execute("PRAGMA foreign_keys = ON")
+    user_cache.clear()
+    token_revocations.clear()
+    rate_limiter.clear()
+    with flask_app.app_context():
+        tag_index.warm()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    """
+    Creates a user with a TotalTime row and returns its id.
+    """
+    def make_user(tag_num, role='Standard User', email=None):
+        with app.app_context():
+            repo = get_repository()
+            with repo.transaction():
+                user_id = repo.users.create('Test', f'User{tag_num}', tag_num, email or f'user{tag_num}@example.com',
+                                            password_hasher.scheme.hash(PASSWORD), role)
+                repo.totals.create(user_id)
+        return user_id
+    return make_user
+
+
+@pytest.fixture
+def login(client):
+    """
+    Logs the test client in as a user through its session cookie.
+    """
+    def login(user_id):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+    return login
@@ -0,0 +1,436 @@
+"""
+Route tests on the SQLite backend
+"""
+import gc
+import hashlib
+import json
+import threading
+import time
+
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app.passwordHashing import password_hasher
+from .conftest import PASSWORD
+
+
+@pytest.fixture
+def admin(make_user, login):
+    admin_id = make_user('9000', 'Administrator')
+    login(admin_id)
+    return admin_id
+
+
+def upload_sessions(client, tags):
+    """
+    Uploads two sessions per tag, the users' sessions start at the same times.
+    """
+    events = []
+    for tag in tags:
+        for day in ('05', '06'):
+            events.append({'key': f'{tag}-{day}-in', 'tagNum': tag, 'timestamp': f'2026-01-{day} 08:00:00', 'direction': 'in'})
+            events.append({'key': f'{tag}-{day}-out', 'tagNum': tag, 'timestamp': f'2026-01-{day} 16:00:00', 'direction': 'out'})
+    response = client.post('/onlinetime/batch', json={'events': events})
+    assert response.status_code == 200
+
+
+def read_pages(client, path, limit):
+    rows, pages, after = [], 0, None
+    while True:
+        response = client.get(path, query_string={'limit': limit, **({'after': after} if after else {})})
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['data']) <= limit
+        rows += page['data']
+        pages += 1
+        after = page['next']
+        if after is None:
+            return rows, pages
+
+
+def test_onlinetime_pages_cover_every_session_once(client, admin, make_user):
+    tags = [str(3000 + number) for number in range(5)]
+    for tag in tags:
+        make_user(tag)
+    upload_sessions(client, tags)
+
+    rows, pages = read_pages(client, '/onlinetime/all', 3)
+
+    # Ten sessions, five of them tied on each start time
+    sessions = [(row['id'], row['dateTimeStart']) for row in rows]
+    assert pages == 4
+    assert len(set(sessions)) == 10
+    assert sorted(sessions) == sorted((row['id'], row['dateTimeStart']) for row in client.get('/onlinetime/all').get_json())
+    assert [start for _, start in sessions] == sorted(start for _, start in sessions)
+
+
+def test_users_pages_cover_every_user_once(client, admin, make_user):
+    for number in range(6):
+        make_user(str(3100 + number))
+
+    rows, pages = read_pages(client, '/users/all', 2)
+
+    assert pages == 4
+    assert [row['id'] for row in rows] == sorted(row['id'] for row in client.get('/users/all').get_json())
+
+
+def test_invalid_cursor_is_rejected(client, admin):
+    assert client.get('/onlinetime/all', query_string={'after': 'not-a-cursor'}).status_code == 400
+    assert client.get('/onlinetime/all', query_string={'limit': 0}).status_code == 400
+
+
+@pytest.fixture
+def settled(app, monkeypatch):
+    # Every change counts as committed at once, see etags.ResourceVersions._logged_versions
+    monkeypatch.setitem(app.config, 'SYNC_SETTLE_SECONDS', 0)
+
+
+def test_unchanged_listing_is_answered_with_304(client, admin, settled):
+    first = client.get('/onlinetime/all')
+    etag = first.headers['ETag']
+
+    second = client.get('/onlinetime/all', headers={'If-None-Match': etag})
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.data == b''
+
+
+def test_write_changes_the_etag(client, admin, settled):
+    etag = client.get('/onlinetime/all').headers['ETag']
+
+    assert client.post('/onlinetime/start').status_code == 200
+    response = client.get('/onlinetime/all', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()) == 1
+
+
+def test_write_of_another_worker_changes_the_etag(client, admin, settled, db):
+    etag = client.get('/users/all').headers['ETag']
+
+    # Nothing in this process hears of the change, only the table's change log
+    db.execute("UPDATE `User` SET lastName = 'Renamed' WHERE id = ?", (admin,))
+    response = client.get('/users/all', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.get_json()[0]['lastName'] == 'Renamed'
+
+
+def test_recent_change_is_not_tagged(client, admin):
+    # The admin was created moments ago, an older transaction could still commit before it
+    response = client.get('/users/all')
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_permissions_are_not_tagged_without_shared_counters(client, settled):
+    # Permissions has no change log to take a version from
+    response = client.get('/permissions')
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_etag_differs_per_query(client, admin, settled):
+    assert client.get('/onlinetime/all').headers['ETag'] != \
+        client.get('/onlinetime/all', query_string={'limit': 5}).headers['ETag']
+
+
+def issue_token(client, email):
+    response = client.post('/auth/token', json={'email': email, 'password': PASSWORD})
+    assert response.status_code == 200
+    return response.get_json()['token']
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def count_sessions(db, user_id):
+    return db.execute("SELECT COUNT(*) FROM OnlineTime WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_token_authenticates_without_session_or_csrf(app, client, make_user, db, monkeypatch):
+    user_id = make_user('4001')
+    token = issue_token(client, 'user4001@example.com')
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+
+    response = client.post('/onlinetime/start', headers=bearer(token))
+
+    assert response.status_code == 200
+    assert count_sessions(db, user_id) == 1
+
+
+def test_token_requires_valid_credentials(client, make_user):
+    make_user('4002')
+
+    assert client.post('/auth/token', json={'email': 'user4002@example.com', 'password': 'wrong'}).status_code == 401
+    assert client.post('/auth/token', json={'email': 'user4002@example.com'}).status_code == 400
+
+
+def test_invalid_token_is_rejected(client, make_user, login, db):
+    user_id = make_user('4003')
+    login(user_id)
+
+    # A bad token is not backed up by the session cookie
+    response = client.post('/onlinetime/start', headers=bearer('not-a-token'))
+
+    assert response.status_code == 401
+    assert 'invalid_token' in response.headers['WWW-Authenticate']
+    assert count_sessions(db, user_id) == 0
+
+
+def test_expired_token_is_rejected(app, client, make_user, monkeypatch):
+    make_user('4004')
+    token = issue_token(client, 'user4004@example.com')
+    monkeypatch.setitem(app.config, 'API_TOKEN_TTL', -1)
+
+    assert client.post('/onlinetime/start', headers=bearer(token)).status_code == 401
+
+
+def test_revoked_token_is_rejected(client, make_user, db):
+    user_id = make_user('4005')
+    token = issue_token(client, 'user4005@example.com')
+    other = issue_token(client, 'user4005@example.com')
+
+    assert client.post('/auth/token/revoke', headers=bearer(token)).status_code == 200
+
+    assert client.post('/onlinetime/start', headers=bearer(token)).status_code == 401
+    assert client.post('/onlinetime/start', headers=bearer(other)).status_code == 200
+    assert count_sessions(db, user_id) == 1
+
+
+def test_admin_revokes_every_token_of_a_user(client, make_user):
+    user_id = make_user('4006')
+    make_user('4007')
+    make_user('4008', 'Administrator')
+    tokens = [issue_token(client, 'user4006@example.com') for _ in range(2)]
+    user_token = issue_token(client, 'user4007@example.com')
+    admin_token = issue_token(client, 'user4008@example.com')
+
+    assert client.post('/auth/token/revoke', json={'user_id': user_id}, headers=bearer(user_token)).status_code == 403
+    assert client.post('/auth/token/revoke', json={'user_id': user_id}, headers=bearer(admin_token)).status_code == 200
+
+    for token in tokens:
+        assert client.post('/onlinetime/start', headers=bearer(token)).status_code == 401
+    assert client.post('/onlinetime/start', headers=bearer(admin_token)).status_code == 200
+
+
+def test_tag_punch_needs_csrf_token_with_a_session_cookie(app, client, admin, make_user, db, monkeypatch):
+    user_id = make_user('5001')
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+
+    # A cross-site form posts with the admin's cookie but without the CSRF token
+    assert client.post('/onlinetime/tag/5001').status_code == 400
+    assert count_sessions(db, user_id) == 0
+
+
+def test_tag_punch_with_bearer_token_needs_no_csrf_token(app, client, make_user, db, monkeypatch):
+    make_user('5002', 'Administrator')
+    user_id = make_user('5003')
+    token = issue_token(client, 'user5002@example.com')
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+
+    assert client.post('/onlinetime/tag/5003', headers=bearer(token)).status_code == 200
+    assert count_sessions(db, user_id) == 1
+
+
+def test_full_hashing_pool_answers_503(client, make_user, monkeypatch):
+    make_user('6001')
+    monkeypatch.setattr(password_hasher, '_slots', threading.BoundedSemaphore(1))
+    password_hasher._slots.acquire()
+
+    response = client.post('/auth/token', json={'email': 'user6001@example.com', 'password': PASSWORD})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+def test_slow_password_check_answers_503(client, make_user, monkeypatch):
+    make_user('6002')
+    monkeypatch.setattr(password_hasher, 'timeout', 0.01)
+    monkeypatch.setattr(password_hasher, '_verify_and_update', lambda password, hashed: time.sleep(0.2))
+
+    response = client.post('/auth/token', json={'email': 'user6002@example.com', 'password': PASSWORD})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+
+@pytest.fixture
+def rate_limits(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_LOGIN_PER_IP', 4)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_LOGIN_PER_EMAIL', 2)
+
+
+def request_token(client, email, ip=None):
+    headers = {'X-Forwarded-For': ip} if ip else {}
+    return client.post('/auth/token', json={'email': email, 'password': 'wrong'}, headers=headers)
+
+
+def test_login_limit_per_email(client, rate_limits):
+    statuses = [request_token(client, 'victim@example.com').status_code for _ in range(4)]
+
+    assert statuses == [401, 401, 429, 429]
+    assert request_token(client, 'victim@example.com').headers['Retry-After']
+
+
+def test_rejected_request_does_not_use_up_the_ip_budget(client, rate_limits):
+    for _ in range(6):
+        request_token(client, 'victim@example.com')
+
+    # Only the two requests the email limit let through counted for the address
+    assert [request_token(client, f'user{number}@example.com').status_code for number in range(3)] == [401, 401, 429]
+
+
+def test_login_limit_per_ip_behind_a_proxy(app, client, rate_limits, monkeypatch):
+    # What PROXY_FIX_X_FOR = 1 sets up on startup
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+
+    first = [request_token(client, f'user{number}@example.com', '203.0.113.1').status_code for number in range(5)]
+    second = request_token(client, 'user9@example.com', '203.0.113.2').status_code
+
+    assert first == [401, 401, 401, 401, 429]
+    assert second == 401
+
+
+def test_streamed_listing_matches_the_plain_one(client, admin, make_user):
+    for number in range(3):
+        make_user(str(7000 + number))
+
+    streamed = client.get('/users/all', query_string={'stream': 'json'})
+    lines = client.get('/users/all', query_string={'stream': 'ndjson'}).get_data(as_text=True).splitlines()
+
+    assert streamed.get_json() == client.get('/users/all').get_json()
+    assert [json.loads(line) for line in lines] == streamed.get_json()
+
+
+def test_stream_without_connection_answers_500(app, client, admin, monkeypatch):
+    repository_class = app.extensions['repository']
+    opened = []
+
+    def open_once():
+        # The view gets its connection, the stream finds none left
+        opened.append(True)
+        return repository_class.open() if len(opened) == 1 else None
+    monkeypatch.setitem(app.extensions, 'repository', type('Exhausted', (), {'open': staticmethod(open_once)}))
+
+    response = client.get('/users/all', query_string={'stream': 'json'})
+
+    assert response.status_code == 500
+    assert response.get_json() == {"message": "Database connection failed"}
+
+
+@pytest.mark.filterwarnings('error::pytest.PytestUnraisableExceptionWarning')
+def test_unread_stream_is_closed_in_its_own_context(client, admin):
+    # /batch closes the streamed response without reading it
+    response = client.post('/batch', json={'requests': ['/users/all?stream=json']})
+    gc.collect()
+
+    assert response.get_json()['responses'][0]['status'] == 400
+
+
+def latest_change(db):
+    return db.execute("SELECT COALESCE(MAX(version), 0) FROM ChangeLog").fetchone()[0]
+
+
+def test_snapshot_version_stops_short_of_recent_changes(client, admin, db):
+    # The admin was created moments ago, a transaction with a lower version could still commit
+    response = client.get('/sync', query_string={'since': 0})
+
+    assert response.status_code == 200
+    assert response.get_json()['version'] < latest_change(db)
+    assert [user['id'] for user in response.get_json()['users']] == [admin]
+
+
+def test_snapshot_version_covers_settled_changes(client, admin, settled, db):
+    assert client.get('/sync', query_string={'since': 0}).get_json()['version'] == latest_change(db)
+
+
+def test_sync_reports_deleted_rows(client, admin, settled, make_user):
+    user_id = make_user('8001')
+    version = client.get('/sync', query_string={'since': 0}).get_json()['version']
+
+    assert client.delete(f'/users/{user_id}').status_code == 200
+    response = client.get('/sync', query_string={'since': version}).get_json()
+
+    assert response['deleted']['users'] == [user_id]
+    assert response['deleted']['totaltime']
+    assert response['users'] == []
+    assert response['version'] > version
+
+
+def test_sync_rejects_unknown_and_pruned_versions(client, admin, settled, make_user, db):
+    make_user('8002')
+    latest = latest_change(db)
+
+    assert client.get('/sync', query_string={'since': latest + 1}).status_code == 410
+    db.execute("DELETE FROM ChangeLog WHERE version < ?", (latest,))
+    assert client.get('/sync', query_string={'since': 1}).status_code == 410
+    assert client.get('/sync', query_string={'since': latest - 1}).status_code == 200
+
+
+def test_payroll_clips_sessions_to_the_period(client, admin, make_user, db):
+    user_id = make_user('3600')
+    events = []
+    for number, (start, stop) in enumerate([('2026-01-04 22:00:00', '2026-01-05 02:00:00'),   # starts before the period
+                                            ('2026-01-06 08:00:00', '2026-01-06 18:00:00'),   # 2h overtime
+                                            ('2026-01-07 20:00:00', '2026-01-08 03:00:00')]):  # ends after it
+        events += [{'key': f'pay-{number}-in', 'tagNum': '3600', 'timestamp': start, 'direction': 'in'},
+                   {'key': f'pay-{number}-out', 'tagNum': '3600', 'timestamp': stop, 'direction': 'out'}]
+    assert client.post('/onlinetime/batch', json={'events': events}).status_code == 200
+    # Breaks count on the day their session starts, the first session's is outside the period
+    db.execute("UPDATE OnlineTime SET breakTime = 30 WHERE user_id = ?", (user_id,))
+
+    response = client.get('/reports/payroll', query_string={'from': '2026-01-05', 'to': '2026-01-07', 'overtime': 8})
+
+    assert response.status_code == 200
+    row = next(row for row in response.get_json()['data'] if row['user_id'] == user_id)
+    assert (row['grossSeconds'], row['breakSeconds'], row['overtimeSeconds'], row['daysWorked']) == \
+        (2 * 3600 + 10 * 3600 + 4 * 3600, 2 * 1800, 2 * 3600, 3)
+
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_batch_runs_sub_requests_in_order(client, admin, settled, parallel):
+    etag = client.get('/onlinetime/all').headers['ETag']
+
+    response = client.post('/batch', json={'parallel': parallel, 'requests': [
+        '/users/all',
+        {'path': '/onlinetime/all', 'headers': {'If-None-Match': etag}},
+        {'path': '/users/all', 'method': 'POST'},
+        '/batch',
+        '/users/all?stream=json']})
+
+    assert response.status_code == 200
+    results = response.get_json()['responses']
+    assert [result['status'] for result in results] == [200, 304, 400, 400, 400]
+    assert [user['id'] for user in results[0]['body']] == [admin]
+    assert results[1]['etag'] == etag
+    assert results[4]['body']['message'] == "Streaming responses cannot be batched"
+
+
+def test_batch_rejects_too_many_requests(app, client, admin, monkeypatch):
+    monkeypatch.setitem(app.config, 'BATCH_MAX_REQUESTS', 2)
+
+    assert client.post('/batch', json={'requests': ['/users/all'] * 3}).status_code == 413
+    assert client.post('/batch', json={}).status_code == 400
+
+
+def test_legacy_sha512_password_is_rehashed_on_login(client, make_user, db):
+    user_id = make_user('3700')
+    legacy = hashlib.sha512(PASSWORD.encode('utf-8')).hexdigest()
+    db.execute("UPDATE `User` SET password = ? WHERE id = ?", (legacy, user_id))
+
+    assert client.post('/auth/token', json={'email': 'user3700@example.com', 'password': 'wrong'}).status_code == 401
+    assert db.execute("SELECT password FROM `User` WHERE id = ?", (user_id,)).fetchone()[0] == legacy
+    issue_token(client, 'user3700@example.com')
+
+    stored = db.execute("SELECT password FROM `User` WHERE id = ?", (user_id,)).fetchone()[0]
+    assert stored.startswith('$2b$')
+    assert password_hasher.scheme.verify(PASSWORD, stored)
+    issue_token(client, 'user3700@example.com')
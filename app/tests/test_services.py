@@ -0,0 +1,225 @@
+"""
+Service tests on the SQLite backend
+"""
+from datetime import datetime, time
+
+from app import events
+from app.cache import SharedCache
+from app.events import SharedEventBroker, SharedEventLog, event_broker
+
+
+def open_sessions(db, user_id):
+    return db.execute("SELECT COUNT(*) FROM OnlineTime WHERE user_id = ? AND dateTimeStop IS NULL",
+                      (user_id,)).fetchone()[0]
+
+
+def total_seconds(db, user_id):
+    return db.execute("SELECT sumSeconds FROM TotalTime WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def daily_seconds(db, user_id):
+    return db.execute("SELECT COALESCE(SUM(seconds), 0) FROM UserDailyTime WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def test_start_opens_a_single_session(client, login, make_user, db):
+    user_id = make_user('1001')
+    login(user_id)
+
+    assert client.post('/onlinetime/start').status_code == 200
+    assert client.post('/onlinetime/start').status_code == 400
+    assert open_sessions(db, user_id) == 1
+
+
+def test_stop_closes_the_session_and_adds_its_time(client, login, make_user, db):
+    user_id = make_user('1002')
+    login(user_id)
+    assert client.post('/onlinetime/start').status_code == 200
+    # Move the start back so the session has a length
+    db.execute("UPDATE OnlineTime SET dateTimeStart = datetime(dateTimeStart, '-1 hours') WHERE user_id = ?", (user_id,))
+
+    response = client.post('/onlinetime/stop')
+
+    assert response.status_code == 200
+    assert open_sessions(db, user_id) == 0
+    assert 3600 <= total_seconds(db, user_id) <= 3601
+    assert daily_seconds(db, user_id) == total_seconds(db, user_id)
+    assert client.post('/onlinetime/stop').status_code == 404
+
+
+def test_stop_without_total_time_keeps_the_session_open(client, login, make_user, db):
+    user_id = make_user('1003')
+    login(user_id)
+    assert client.post('/onlinetime/start').status_code == 200
+    db.execute("DELETE FROM TotalTime WHERE user_id = ?", (user_id,))
+
+    assert client.post('/onlinetime/stop').status_code == 500
+    assert open_sessions(db, user_id) == 1
+    assert daily_seconds(db, user_id) == 0
+
+
+def test_batch_upload_is_idempotent(client, login, make_user, db):
+    admin_id = make_user('2000', 'Administrator')
+    user_id = make_user('2001')
+    login(admin_id)
+    events = [{'key': 'door1-1', 'tagNum': '2001', 'timestamp': '2026-01-05 08:00:00', 'direction': 'in'},
+              {'key': 'door1-2', 'tagNum': '2001', 'timestamp': '2026-01-05 12:00:00', 'direction': 'out'},
+              {'key': 'door1-3', 'tagNum': '2001', 'timestamp': '2026-01-05 13:00:00', 'direction': 'in'}]
+
+    first = client.post('/onlinetime/batch', json={'events': events})
+    # A reader that lost the response sends the same events again
+    second = client.post('/onlinetime/batch', json={'events': events})
+
+    assert first.status_code == 200
+    assert [result['status'] for result in first.get_json()['results']] == ['applied'] * 3
+    assert second.status_code == 200
+    assert [result['status'] for result in second.get_json()['results']] == ['duplicate'] * 3
+    assert db.execute("SELECT COUNT(*) FROM OnlineTime WHERE user_id = ?", (user_id,)).fetchone()[0] == 2
+    assert open_sessions(db, user_id) == 1
+    assert total_seconds(db, user_id) == 4 * 3600
+    assert daily_seconds(db, user_id) == 4 * 3600
+
+
+def test_batch_reports_duplicates_within_one_upload(client, login, make_user, db):
+    admin_id = make_user('2100', 'Administrator')
+    user_id = make_user('2101')
+    login(admin_id)
+    event = {'key': 'door2-1', 'tagNum': '2101', 'timestamp': '2026-01-05 08:00:00', 'direction': 'in'}
+
+    response = client.post('/onlinetime/batch', json={'events': [event, event]})
+
+    assert [result['status'] for result in response.get_json()['results']] == ['applied', 'duplicate']
+    assert open_sessions(db, user_id) == 1
+
+
+def test_batch_upload_needs_csrf_token_with_a_session_cookie(app, client, login, make_user, db, monkeypatch):
+    admin_id = make_user('2200', 'Administrator')
+    user_id = make_user('2201')
+    login(admin_id)
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+    event = {'key': 'door3-1', 'tagNum': '2201', 'timestamp': '2026-01-05 08:00:00', 'direction': 'in'}
+
+    assert client.post('/onlinetime/batch', json={'events': [event]}).status_code == 400
+    assert open_sessions(db, user_id) == 0
+
+
+def test_name_lookup_uses_both_name_indexes(db):
+    plan = ' '.join(row[3] for row in db.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM `User` WHERE firstName = 'James' OR lastName = 'James'"))
+
+    assert 'ix_User_firstName' in plan and 'ix_User_lastName' in plan
+    assert 'SCAN User' not in plan
+
+
+def test_user_lookup_by_first_or_last_name(client, login, make_user):
+    admin_id = make_user('2300', 'Administrator')
+    user_id = make_user('2301')
+    login(admin_id)
+
+    by_first = client.get('/users/Test').get_json()
+    by_last = client.get('/users/User2301').get_json()
+
+    assert {user['id'] for user in by_first} == {admin_id, user_id}
+    assert [user['id'] for user in by_last] == [user_id]
+
+
+def test_batch_clock_events_carry_the_session_ids(client, login, make_user, db):
+    admin_id = make_user('2400', 'Administrator')
+    user_id = make_user('2401')
+    login(admin_id)
+    events = [{'key': 'door4-1', 'tagNum': '2401', 'timestamp': '2026-01-05 08:00:00', 'direction': 'in'},
+              {'key': 'door4-2', 'tagNum': '2401', 'timestamp': '2026-01-05 12:00:00', 'direction': 'out'},
+              {'key': 'door4-3', 'tagNum': '2401', 'timestamp': '2026-01-05 13:00:00', 'direction': 'in'}]
+    subscriber = event_broker.subscribe(10)
+    try:
+        assert client.post('/onlinetime/batch', json={'events': events}).status_code == 200
+        published = [subscriber.get_nowait() for _ in range(subscriber.qsize())]
+    finally:
+        event_broker.unsubscribe(subscriber)
+
+    session_ids = dict(db.execute("SELECT dateTimeStart, id FROM OnlineTime WHERE user_id = ?", (user_id,)))
+    assert [(event, data['id']) for _, event, data in published] == [
+        ('clock-out', session_ids['2026-01-05 08:00:00']), ('clock-in', session_ids['2026-01-05 13:00:00'])]
+
+
+def test_shared_event_broker_fans_out_across_workers(tmp_path):
+    # Two brokers on one file stand for two worker processes
+    path = str(tmp_path / 'events')
+    publisher = SharedEventBroker(SharedEventLog(path, 4, 256), poll_interval=0.01)
+    listener = SharedEventBroker(SharedEventLog(path, 4, 256), poll_interval=0.01)
+    publisher.publish('clock-in', {'id': 1})
+    subscriber = listener.subscribe(10)
+    try:
+        assert publisher.has_subscribers()
+        publisher.publish('clock-in', {'id': 2})
+        publisher.publish('clock-out', {'id': 2})
+
+        assert subscriber.get(timeout=5) == (2, 'clock-in', {'id': 2})
+        assert subscriber.get(timeout=5) == (3, 'clock-out', {'id': 2})
+        # More events than the log holds between two polls: the stream is ended for a fresh snapshot
+        with listener._lock:
+            for index in range(5):
+                publisher.publish('clock-in', {'id': 10 + index})
+        assert subscriber.get(timeout=5)[2] is events._DISCONNECT
+    finally:
+        listener.unsubscribe(subscriber)
+
+
+def test_night_shift_is_split_at_midnight(client, login, make_user, db):
+    admin_id = make_user('2500', 'Administrator')
+    user_id = make_user('2501')
+    login(admin_id)
+    # Sunday night into Monday, so the shift also spans two ISO weeks
+    events = [{'key': 'door5-1', 'tagNum': '2501', 'timestamp': '2026-01-04 22:00:00', 'direction': 'in'},
+              {'key': 'door5-2', 'tagNum': '2501', 'timestamp': '2026-01-05 02:30:00', 'direction': 'out'}]
+    assert client.post('/onlinetime/batch', json={'events': events}).status_code == 200
+    login(user_id)
+
+    days = client.get('/totaltime', query_string={'from': '2026-01-04', 'to': '2026-01-05'}).get_json()['data']
+    weeks = client.get('/totaltime', query_string={'from': '2026-01-04', 'to': '2026-01-05',
+                                                   'granularity': 'week'}).get_json()['data']
+
+    assert [(row['day'], row['sumSeconds']) for row in days] == [('2026-01-04', 7200), ('2026-01-05', 9000)]
+    assert [(row['week'], row['sumSeconds']) for row in weeks] == [('2026-W01', 7200), ('2026-W02', 9000)]
+    assert total_seconds(db, user_id) == daily_seconds(db, user_id) == 16200
+
+
+def test_summary_adds_the_open_session_to_today(client, login, make_user, db):
+    user_id = make_user('2600')
+    login(user_id)
+    assert client.get('/me/summary').get_json()['openSession'] is None
+    db.execute("INSERT INTO UserDailyTime (user_id, day, seconds) VALUES (?, date('now', 'localtime'), 1800)", (user_id,))
+    db.execute("UPDATE TotalTime SET sumSeconds = 5400 WHERE user_id = ?", (user_id,))
+    assert client.post('/onlinetime/start').status_code == 200
+    db.execute("UPDATE OnlineTime SET dateTimeStart = datetime(dateTimeStart, '-10 minutes') WHERE user_id = ?", (user_id,))
+    start = datetime.fromisoformat(db.execute("SELECT dateTimeStart FROM OnlineTime WHERE user_id = ?", (user_id,)).fetchone()[0])
+
+    before = datetime.now().replace(microsecond=0)
+    summary = client.get('/me/summary').get_json()
+
+    # Only the part of the open session since midnight counts towards today
+    since_midnight = (before - max(start, datetime.combine(before.date(), time.min))).seconds
+    assert summary['user']['id'] == user_id
+    assert 600 <= summary['openSession']['elapsedSeconds'] <= 602
+    assert 1800 + since_midnight <= summary['today']['sumSeconds'] <= 1800 + since_midnight + 2
+    assert summary['total']['sumSeconds'] == 5400
+
+
+def test_shared_cache_skips_a_fill_that_raced_with_a_delete(tmp_path):
+    # Two caches on one file stand for two worker processes
+    path = str(tmp_path / 'users.cache')
+    filler = SharedCache(path, maxsize=64, ttl=60, slot_bytes=256)
+    writer = SharedCache(path, maxsize=64, ttl=60, slot_bytes=256)
+    generation = filler.generation(1)
+    other_generation = filler.generation(2)
+
+    # Another worker changes user 1 after this one read it from the database
+    writer.delete(1)
+    filler.set(1, {'lastName': 'Stale'}, generation)
+    filler.set(2, {'lastName': 'Fresh'}, other_generation)
+
+    assert writer.get(1) is None
+    assert writer.get(2) == {'lastName': 'Fresh'}
+    assert filler.stats()['staleFills'] == 1
+    writer.clear()
+    filler.set(2, {'lastName': 'Stale'}, other_generation)
+    assert filler.stats()['staleFills'] == 2
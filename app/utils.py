@@ -3,10 +3,24 @@ Utility functions (e.g., for validation)
 
 Functions:
  - is_valid_email(email): Validates an email address format.
+ - parse_datetime(dt_str): Parses a timestamp string into a datetime.
+ - parse_date(d_str): Parses a 'YYYY-MM-DD' date string.
+ - parse_page_args(args, types): Reads the keyset pagination parameters of a listing endpoint.
+ - next_page_cursor(rows, limit, key): Trims a page and builds the cursor of the next page.
+ - stream_rows(fetch_chunks, to_item, fmt): Streams repository rows as a JSON array or NDJSON.
+ - duplicate_user_message(error): Maps a unique key violation on User to a user-facing message.
+ - format_seconds(total_seconds): Formats seconds as an unwrapped H:MM:SS string.
+ - recompute_total_time(user_id): Repair job that rebuilds TotalTime and the rollups from all sessions.
 """
 import re
-from datetime import datetime
-from .mysqlConnector import get_db_connection
+import json
+import base64
+import contextvars
+from datetime import datetime, date
+from flask import Response, current_app, jsonify
+from .repositories import get_repository
+from .etags import resource_versions, TOTALTIME
+from .config import Config
 
 def is_valid_email(email):
     """
@@ -23,139 +37,239 @@ def is_valid_email(email):
     return re.match(pattern, email) is not None
 
 def is_valid_datetime(dt_str):
+    # Accept the ISO-8601 'T' separator the JSON responses use as well
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            datetime.strptime(dt_str, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+def parse_datetime(dt_str):
+    """
+    Parses a 'YYYY-MM-DD HH:MM:SS' (or ISO-8601 'T'-separated) timestamp.
+
+    Returns:
+        datetime: The parsed timestamp without fractional seconds, or None if it is invalid.
+    """
+    if not isinstance(dt_str, str):
+        return None
     try:
-        # Try to parse the string to a datetime object
-        datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-        return True
+        parsed = datetime.fromisoformat(dt_str)
     except ValueError:
-        return False
+        return None
+    if parsed.tzinfo is not None:
+        return None  # Sessions are stored as naive local time
+    return parsed.replace(microsecond=0)
 
-#check if User values are already in DB at creation --------------------------------------------------------
-def is_duplicate_firstName(value):
-    cnx = get_db_connection()
-    if cnx:
-        try:
-            with cnx.cursor() as cursor:
-                # Query to check if there is any other user with the same first name
-                cursor.execute("SELECT id FROM user WHERE firstName = %s", (value,))
-                row = cursor.fetchone()  # Fetch one row (if any)
-
-                if row:
-                    return True  # Duplicate found
-                else:
-                    return False  # No duplicate found
-        except Exception as e:
-            print(f"Error: {e}")
-            return True  #returning True in case of an error (failure to check duplicates)
-        finally:
-            cnx.close()  # Ensure the connection is closed
-    else:
-        print("Database connection failed")
-        return True  # Return True to indicate failure in checking duplicates
-
-def is_duplicate_lastName(value):
-    cnx = get_db_connection()
-    if cnx:
-        try:
-            with cnx.cursor() as cursor:
-                # Query to check if there is any other user with the same first name
-                cursor.execute("SELECT id FROM user WHERE lastName = %s", (value,))
-                row = cursor.fetchone()  # Fetch one row (if any)
-
-                if row:
-                    return True  # Duplicate found
-                else:
-                    return False  # No duplicate found
-        except Exception as e:
-            print(f"Error: {e}")
-            return True  #returning True in case of an error (failure to check duplicates)
-        finally:
-            cnx.close()  # Ensure the connection is closed
-    else:
-        print("Database connection failed")
-        return True  # Return True to indicate failure in checking duplicates
-
-def is_duplicate_tagNum(value):
-    cnx = get_db_connection()
-    if cnx:
-        try:
-            with cnx.cursor() as cursor:
-                # Query to check if there is any other user with the same first name
-                cursor.execute("SELECT id FROM user WHERE tagNum = %s", (value,))
-                row = cursor.fetchone()  # Fetch one row (if any)
-
-                if row:
-                    return True  # Duplicate found
-                else:
-                    return False  # No duplicate found
-        except Exception as e:
-            print(f"Error: {e}")
-            return True  #returning True in case of an error (failure to check duplicates)
-        finally:
-            cnx.close()  # Ensure the connection is closed
-    else:
-        print("Database connection failed")
-        return True  # Return True to indicate failure in checking duplicates
-
-def is_duplicate_email(value):
-    cnx = get_db_connection()
-    if cnx:
+def parse_date(d_str):
+    """
+    Parses a 'YYYY-MM-DD' date.
+
+    Returns:
+        date: The parsed date, or None if it is invalid.
+    """
+    if not isinstance(d_str, str):
+        return None
+    try:
+        return date.fromisoformat(d_str)
+    except ValueError:
+        return None
+
+#keyset pagination for the listing endpoints --------------------------------------------------------
+def encode_cursor(key):
+    """
+    Encodes the sort key of the last row of a page as an opaque cursor token.
+    """
+    key = [value.isoformat(sep=' ') if isinstance(value, datetime) else value for value in key]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token, types):
+    """
+    Decodes a cursor token created by encode_cursor().
+
+    Parameters:
+        token (str): The cursor token from the 'after' parameter.
+        types (tuple): The expected type of each key component (int or datetime).
+
+    Returns:
+        list: The sort key, or None if the token is malformed.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(key, list) or len(key) != len(types):
+        return None
+    decoded = []
+    for value, expected in zip(key, types):
+        if expected is datetime:
+            value = parse_datetime(value)
+        elif not isinstance(value, expected) or isinstance(value, bool):
+            value = None
+        if value is None:
+            return None
+        decoded.append(value)
+    return decoded
+
+def parse_page_args(args, types):
+    """
+    Reads the 'limit' and 'after' query parameters of a listing endpoint.
+
+    Returns:
+        tuple: (paginated, limit, after, error). paginated is False when neither parameter
+               was given, error is a message if the parameters are invalid.
+    """
+    if 'limit' not in args and 'after' not in args:
+        return False, None, None, None
+    limit = args.get('limit', Config.PAGE_SIZE_DEFAULT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return True, None, None, "Invalid limit, expected an integer"
+    if not 1 <= limit <= Config.PAGE_SIZE_MAX:
+        return True, None, None, f"Invalid limit, expected 1 to {Config.PAGE_SIZE_MAX}"
+    after = None
+    if args.get('after'):
+        after = decode_cursor(args['after'], types)
+        if after is None:
+            return True, None, None, "Invalid after cursor"
+    return True, limit, after, None
+
+def next_page_cursor(rows, limit, key):
+    """
+    Trims a page fetched with limit + 1 rows and returns the cursor of the next page.
+
+    Returns:
+        tuple: (rows, next_cursor). next_cursor is None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+#streaming responses for the listing endpoints --------------------------------------------------------
+STREAM_FORMATS = ('json', 'ndjson')
+
+def stream_rows(fetch_chunks, to_item, fmt):
+    """
+    Streams rows as a JSON array or as NDJSON lines.
+
+    The rows come in chunks of Config.STREAM_FETCH_SIZE from a repository's
+    iter_all() and are serialized chunk by chunk, so memory use does not grow
+    with the size of the result. The stream runs in an app context of its own,
+    so it reads on a connection it checked out itself, never on the view's,
+    and hands it back through the normal teardown after the last chunk. The
+    connection is checked out before the response starts, so a failure is
+    still answered with 500 instead of a cut-off body.
+
+    Parameters:
+        fetch_chunks (callable): Takes the repository and returns the row chunks,
+                                 e.g. lambda repo: repo.users.iter_all(size).
+        to_item (callable): Turns a row into the JSON-serializable item.
+        fmt (str): 'json' for a JSON array, 'ndjson' for one JSON document per line.
+
+    Returns:
+        Response: A streaming response, or a 500 JSON response if no connection is available.
+    """
+    app = current_app._get_current_object()
+    dumps = app.json.dumps
+
+    def generate():
+        with app.app_context():
+            repo = get_repository()
+            # Reported before any of the response is sent, see below
+            yield repo is not None
+            if repo is None:
+                return
+            if fmt == 'json':
+                yield '['
+            separator = ''
+            for rows in fetch_chunks(repo):
+                if fmt == 'ndjson':
+                    yield ''.join(dumps(to_item(row)) + '\n' for row in rows)
+                elif rows:
+                    # One dumps call per chunk, without the brackets of the chunk's array
+                    yield separator + dumps([to_item(row) for row in rows])[1:-1]
+                    separator = ','
+            if fmt == 'json':
+                yield ']'
+
+    # The stream's app context lives in a copy of the view's context, so pushing it leaves the view's g alone.
+    # Its connection is checked out now, while a failure can still be answered with an error status.
+    context = contextvars.copy_context()
+    chunks = generate()
+    if not context.run(next, chunks):
+        context.run(chunks.close)
+        return jsonify({"message": "Database connection failed"}), 500
+
+    def resume():
         try:
-            with cnx.cursor() as cursor:
-                # Query to check if there is any other user with the same first name
-                cursor.execute("SELECT id FROM user WHERE email = %s", (value,))
-                row = cursor.fetchone()  # Fetch one row (if any)
-
-                if row:
-                    return True  # Duplicate found
-                else:
-                    return False  # No duplicate found
-        except Exception as e:
-            print(f"Error: {e}")
-            return True  #returning True in case of an error (failure to check duplicates)
+            while True:
+                try:
+                    yield context.run(next, chunks)
+                except StopIteration:
+                    return
         finally:
-            cnx.close()  # Ensure the connection is closed
-    else:
-        print("Database connection failed")
-        return True  # Return True to indicate failure in checking duplicates
-    
-#calculate summed time for Totaltime table --------------------------------------------------------
-def update_total_time(user_id):
-    cnx = get_db_connection()
-    if cnx:
+            context.run(chunks.close)
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    response = Response(resume(), mimetype=mimetype)
+    # A response closed before it was read never starts resume(), end the stream's app context here too
+    response.call_on_close(lambda: context.run(chunks.close))
+    return response
+
+#map unique key violations on User to messages --------------------------------------------------------
+DUPLICATE_USER_MESSAGES = {
+    'uq_User_email': "Email is already used for another account, try using another.",
+    'uq_User_tagNum': "Tag number is already in use for another account, try using another.",
+}
+
+def duplicate_user_message(error):
+    """
+    Returns the user-facing message for a duplicate-key error on the User table.
+
+    Parameters:
+        error (DuplicateKeyError): The error raised by an INSERT or UPDATE on User.
+
+    Returns:
+        str: The message, or None if the error is not a duplicate email or tag number.
+    """
+    return DUPLICATE_USER_MESSAGES.get(error.key)
+
+#maintain summed time for Totaltime table --------------------------------------------------------
+def format_seconds(total_seconds):
+    """
+    Formats a number of seconds as an unwrapped H:MM:SS string (e.g. 40:00:00).
+    """
+    hours, remainder = divmod(int(total_seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02}:{minutes:02}:{seconds:02}"
+
+def session_seconds(date_time_start, date_time_stop):
+    """
+    Returns the length of a session in whole seconds, or 0 if it is still open.
+    """
+    if date_time_start is None or date_time_stop is None:
+        return 0
+    return int((date_time_stop - date_time_start).total_seconds())
+
+def recompute_total_time(user_id):
+    """
+    Repair job: rebuilds a user's TotalTime and daily/weekly rollups from all of their completed sessions.
+
+    The punch paths keep TotalTime current incrementally, this full scan is only
+    meant to be run explicitly after fixing bad data.
+    """
+    repo = get_repository()
+    if repo:
         try:
-            with cnx.cursor() as cursor:
-                # Calculate total session time in seconds
-                cursor.execute(
-                    "SELECT SUM(TIMESTAMPDIFF(SECOND, dateTimeStart, dateTimeStop)) AS total_seconds "
-                    "FROM OnlineTime WHERE user_id = %s AND dateTimeStop IS NOT NULL;", 
-                    (user_id,)
-                )
-                result = cursor.fetchone()
-                
-                if result[0] is None:
-                    # No completed sessions, set to 0
-                    total_seconds = 0
-                else:
-                    total_seconds = result[0]
-                
-                # Calculate hours, minutes, and seconds
-                hours = total_seconds // 3600
-                minutes = (total_seconds % 3600) // 60
-                seconds = total_seconds % 60
-                
-                # Calculate daysWorked and remaining hours
-                days_worked = hours // 24
-                remaining_hours = hours % 24
-                formatted_time = f"{remaining_hours:02}:{minutes:02}:{seconds:02}"
-
-                # Overwrite TotalTime values
-                cursor.execute(
-                    "UPDATE TotalTime SET sumTime = %s, daysWorked = %s WHERE user_id = %s;",
-                    (formatted_time, days_worked, user_id)
-                )
-                cnx.commit()
+            with repo.transaction():
+                repo.totals.recompute(user_id)
+                repo.rollups.rebuild([user_id])
+            resource_versions.bump(TOTALTIME)
+            return True
         except Exception as e:
-            print(f"Error updating total time for user {user_id}: {e}")
-        finally:
-            cnx.close()
+            print(f"Error recomputing total time for user {user_id}: {e}")
+    return False
@@ -0,0 +1,19 @@
+"""
+Test configuration
+
+Importing the app package reads the configuration and opens the database,
+so the test environment is set here, before pytest imports anything under
+app/. The suite runs on the SQLite backend in a database file of its own.
+"""
+import os
+import tempfile
+
+os.environ.update({
+    'DATABASE_BACKEND': 'sqlite',
+    'SQLITE_DATABASE_PATH': os.path.join(tempfile.mkdtemp(prefix='timeclock-tests-'), 'timeclock.sqlite3'),
+    'CACHE_BACKEND': 'memory',
+    'RATE_LIMIT_BACKEND': 'memory',
+    'RATE_LIMIT_ENABLED': 'false',
+    'TAG_INDEX_WARM_ON_STARTUP': 'false',
+    'PASSWORD_BCRYPT_ROUNDS': '4',
+})
@@ -0,0 +1,71 @@
+"""
+JSON serialization benchmark
+
+Serializes a /onlinetime/all style payload of 100k sessions with Flask's
+default provider, TimeClockJSONProvider on the json module and
+TimeClockJSONProvider on orjson (if installed), and prints the throughput
+of each. Only the serialization is timed, no database is needed; importing
+the app package may print connection errors, they do not affect the result.
+
+Usage:
+    python scripts/benchmark_json.py [--sessions 100000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.jsonProvider import TimeClockJSONProvider, orjson
+
+
+def build_payload(n_sessions):
+    start = datetime(2024, 11, 1, 8, 0, 0)
+    payload = []
+    for i in range(n_sessions):
+        date_time_start = start + timedelta(minutes=37 * i)
+        payload.append({'id': i + 1,
+                        'firstName': f"First{i % 500}",
+                        'lastName': f"Last{i % 500}",
+                        'dateTimeStart': date_time_start,
+                        'dateTimeStop': date_time_start + timedelta(hours=8, minutes=i % 60),
+                        'breakTime': timedelta(minutes=30 + i % 30)})
+    return payload
+
+
+def measure(name, provider, payload, repeat):
+    best = None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        body = provider.response(payload).get_data()
+        elapsed = time.perf_counter() - began
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<28} {best * 1000:9.1f} ms  {len(payload) / best:12,.0f} rows/s  "
+          f"{len(body) / best / 2 ** 20:8.1f} MiB/s  ({len(body) / 2 ** 20:.1f} MiB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    payload = build_payload(args.sessions)
+    print(f"{args.sessions} sessions, best of {args.repeat}")
+    with app.app_context():
+        # The default provider cannot encode timedelta, give it the strings the services used to build
+        legacy_payload = [dict(item, breakTime=str(item['breakTime'])) for item in payload]
+        measure("Flask default provider", DefaultJSONProvider(app), legacy_payload, args.repeat)
+        measure("TimeClock provider, json", TimeClockJSONProvider(app, use_orjson=False), payload, args.repeat)
+        if orjson is not None:
+            measure("TimeClock provider, orjson", TimeClockJSONProvider(app), payload, args.repeat)
+        else:
+            print("orjson is not installed, skipped the fast path")
+
+
+if __name__ == '__main__':
+    main()
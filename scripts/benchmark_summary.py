@@ -0,0 +1,100 @@
+"""
+/me/summary latency benchmark
+
+Seeds users with a history of sessions, then requests /me/summary as
+randomly chosen users through the Flask test client and reports the latency
+percentiles. Exits with status 1 if the p99 exceeds the target, so it can
+gate a change.
+
+Runs on a temporary SQLite database unless DATABASE_BACKEND is set, in which
+case the configured database is used and must already hold the seeded data
+(pass --no-seed).
+
+Usage:
+    python scripts/benchmark_summary.py [--users 1000] [--days 90] [--requests 5000] [--p99-ms 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if 'DATABASE_BACKEND' not in os.environ:
+    os.environ['DATABASE_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    os.environ.setdefault('TAG_INDEX_WARM_ON_STARTUP', 'false')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from app.repositories import get_repository
+
+
+def seed(n_users, n_days):
+    """
+    Creates n_users users with one 8 hour session per day for n_days, half of them clocked in now.
+    """
+    now = datetime.now().replace(microsecond=0)
+    first_day = datetime.combine(now.date() - timedelta(days=n_days), datetime.min.time())
+    with app.app_context():
+        repo = get_repository()
+        with repo.transaction():
+            user_ids = [repo.users.create(f"First{i}", f"Last{i}", f"B{i:08}", f"user{i}@example.com", 'x')
+                        for i in range(n_users)]
+            for user_id in user_ids:
+                repo.totals.create(user_id)
+            sessions = []
+            for user_id in user_ids:
+                for day in range(n_days):
+                    start = first_day + timedelta(days=day, hours=8)
+                    sessions.append((start, start + timedelta(hours=8), user_id))
+            repo.sessions.insert_many(sessions)
+            repo.sessions.insert_many([(now - timedelta(hours=2), None, user_id) for user_id in user_ids[::2]])
+            repo.totals.add_many([(n_days * 8 * 3600, user_id) for user_id in user_ids])
+            repo.rollups.apply(added=[(user_id, start, stop) for start, stop, user_id in sessions])
+    return user_ids
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--p99-ms', type=float, default=5.0, help='Latency target for the 99th percentile.')
+    parser.add_argument('--no-seed', action='store_true', help='Use the users already in the database.')
+    args = parser.parse_args()
+
+    if args.no_seed:
+        with app.app_context():
+            user_ids = get_repository().users.ids()
+    else:
+        began = time.perf_counter()
+        user_ids = seed(args.users, args.days)
+        print(f"Seeded {len(user_ids)} users with {args.days} days of sessions in {time.perf_counter() - began:.1f} s")
+
+    client = app.test_client()
+    latencies = []
+    for _ in range(args.requests):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(random.choice(user_ids))
+            session['_fresh'] = True
+        began = time.perf_counter()
+        response = client.get('/me/summary')
+        latencies.append((time.perf_counter() - began) * 1000)
+        if response.status_code != 200:
+            raise SystemExit(f"/me/summary answered {response.status_code}: {response.get_data(as_text=True)}")
+
+    latencies.sort()
+    p99 = percentile(latencies, 0.99)
+    print(f"{args.requests} requests: p50 {percentile(latencies, 0.50):.2f} ms, p95 {percentile(latencies, 0.95):.2f} ms, "
+          f"p99 {p99:.2f} ms, max {latencies[-1]:.2f} ms (target p99 {args.p99_ms:.2f} ms)")
+    if p99 > args.p99_ms:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()